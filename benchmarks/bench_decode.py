@@ -0,0 +1,52 @@
+"""open_image_arrayの縮小デコードと全画素デコードの速度を比較するベンチマーク
+
+    python benchmarks/bench_decode.py --width 4096 --height 3072 --size 224
+"""
+import argparse
+
+import numpy as np
+from PIL import Image
+
+from common import create_jpeg, dump, measure
+from twissify.image import open_image_array, open_image_binary
+
+
+def full_decode(image_binary, size):
+    "全画素をデコードしてから縮小する従来の方法"
+    image = open_image_binary(image_binary).convert("RGB")
+    return np.array(image.resize(size, Image.BILINEAR), dtype=np.uint8)
+
+
+def benchmark(width=4096, height=3072, size=224, repeat=10):
+    image_binary = create_jpeg(width, height)
+    size = (size, size)
+    results = {"source": [width, height],
+               "size": list(size),
+               "bytes": len(image_binary),
+               "full_decode": measure(full_decode, image_binary, size,
+                                      repeat=repeat),
+               "draft_decode": measure(open_image_array, image_binary, size,
+                                       repeat=repeat)}
+    results["speedup"] = (results["full_decode"]["mean_ms"]
+                          / results["draft_decode"]["mean_ms"])
+    return results
+
+
+def run(quick=False):
+    if quick:
+        return benchmark(width=1024, height=768, repeat=3)
+    return benchmark()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--width", type=int, default=4096)
+    parser.add_argument("--height", type=int, default=3072)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    dump(benchmark(args.width, args.height, args.size, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""合成したタイムラインでtwissify.apiのフィルターを比較するベンチマーク
+
+tweepyのStatusを経由する従来の方法、生のJSONの辞書のまま絞り込む方法、
+TweetBatchで列ごとに絞り込む方法を比較する
+
+    python benchmarks/bench_filters.py --tweets 200 --photo-ratio 0.3
+"""
+import argparse
+import json
+
+from tweepy.models import Status
+
+from common import dump, generate_timeline, measure
+from twissify.api import (extract_photo_records, extract_photo_tweets,
+                          extract_photos_urls, filter_myretweeted_tweets,
+                          filter_protected_tweets, filter_retweets,
+                          photo_tweet_filter)
+from twissify.batch import TweetBatch
+
+
+def list_filters(payload):
+    "Statusに変換してからリストを返すフィルターを順に適用する従来の方法"
+    tweets = Status.parse_list(None, json.loads(payload))
+    tweets = extract_photo_tweets(filter_myretweeted_tweets(
+        filter_protected_tweets(filter_retweets(tweets))))
+    return list(zip((tweet.id for tweet in tweets),
+                    extract_photos_urls(tweets)))
+
+
+def model_filter(payload):
+    "Statusに変換してからTweetFilterで絞り込む方法"
+    tweets = Status.parse_list(None, json.loads(payload))
+    return list(photo_tweet_filter().records(tweets))
+
+
+def raw_filter(payload):
+    "Statusを作らずに生のJSONの辞書のまま絞り込む方法"
+    return extract_photo_records(payload)
+
+
+def batch_filter(payload):
+    "TweetBatchの列に変換してから絞り込む方法"
+    batch = TweetBatch.from_json(json.loads(payload))
+    batch = (batch.filter_retweets().filter_protected_tweets()
+             .filter_myretweeted_tweets().extract_photo_tweets())
+    return list(zip(batch.extract_tweet_ids().tolist(),
+                    batch.extract_photos_urls()))
+
+
+METHODS = {"list": list_filters, "model": model_filter, "raw": raw_filter,
+           "batch": batch_filter}
+
+
+def benchmark(tweets=200, photo_ratio=0.3, retweet_ratio=0.3,
+              protected_ratio=0.05, repeat=50):
+    payload = json.dumps(generate_timeline(
+        tweets, photo_ratio=photo_ratio, retweet_ratio=retweet_ratio,
+        protected_ratio=protected_ratio))
+    expectation = raw_filter(payload)
+    results = {"tweets": tweets, "bytes": len(payload),
+               "photo_ratio": photo_ratio, "retweet_ratio": retweet_ratio,
+               "protected_ratio": protected_ratio,
+               "records": len(expectation)}
+    for name, method in METHODS.items():
+        assert method(payload) == expectation, name
+        results[name] = measure(method, payload, repeat=repeat,
+                                items=tweets)
+    results["speedup"] = (results["model"]["mean_ms"]
+                          / results["raw"]["mean_ms"])
+    return results
+
+
+def run(quick=False):
+    return benchmark(repeat=5 if quick else 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tweets", type=int, default=200)
+    parser.add_argument("--photo-ratio", type=float, default=0.3)
+    parser.add_argument("--retweet-ratio", type=float, default=0.3)
+    parser.add_argument("--protected-ratio", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    dump(benchmark(args.tweets, args.photo_ratio, args.retweet_ratio,
+                   args.protected_ratio, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""ローカルのHTTPサーバーから画像を取得するload_image_url(s)のベンチマーク
+
+サーバーはリクエストごとに ``--latency`` 秒待ってから応答するため、
+接続の使い回しや並行した取得で通信の遅延がどれだけ隠れるかと、
+ストリーミングデコード、Rangeリクエストによるヘッダーの取得の時間とメモリを比較できる。
+``--latency 0`` にすると処理の時間だけを比較できる
+
+    python benchmarks/bench_image_io.py --images 32 --width 2048 --height 1536
+"""
+import argparse
+
+from common import ImageServer, create_jpeg, dump, measure
+from twissify.image import (create_session, load_image_url, load_image_urls,
+                            probe_image_url)
+
+
+def benchmark(images=32, width=2048, height=1536, concurrency=8, repeat=5,
+              latency=0.05):
+    content = create_jpeg(width, height)
+    results = {"images": images, "source": [width, height],
+               "bytes": len(content), "concurrency": concurrency,
+               "latency": latency}
+    with ImageServer(content, latency=latency) as server:
+        urls = ["{url}/{i}.jpg".format(url=server.url, i=i)
+                for i in range(images)]
+        session = create_session(pool_maxsize=concurrency)
+
+        def sequential(**kwargs):
+            for url in urls:
+                image, _ = load_image_url(url, **kwargs)
+                image.load()
+
+        def concurrent(**kwargs):
+            for image, _ in load_image_urls(urls,
+                                            max_concurrency=concurrency,
+                                            session=session, **kwargs):
+                image.load()
+
+        def probe():
+            for url in urls:
+                probe_image_url(url, session=session)
+
+        results["sequential_no_session"] = measure(sequential, repeat=repeat,
+                                                   items=images)
+        results["sequential_session"] = measure(sequential, session=session,
+                                                repeat=repeat, items=images)
+        results["concurrent"] = measure(concurrent, repeat=repeat,
+                                        items=images)
+        results["concurrent_stream"] = measure(concurrent, stream=True,
+                                               repeat=repeat, items=images)
+        results["probe"] = measure(probe, repeat=repeat, items=images)
+        session.close()
+        results["requests"] = server.requests
+    return results
+
+
+def run(quick=False):
+    if quick:
+        return benchmark(images=8, width=1024, height=768, repeat=2,
+                         latency=0.02)
+    return benchmark()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    dump(benchmark(args.images, args.width, args.height, args.concurrency,
+                   args.repeat, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""twissify.indexの近傍探索の再現率と検索時間を計測するベンチマーク
+
+    python benchmarks/bench_index.py --sizes 10000 100000 --dim 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common import dump
+from twissify.index import ExactIndex, IVFIndex
+
+
+def create_features(n, dim, n_clusters=100, seed=0):
+    "クラスタ構造を持つDenseNetの特徴量の代わりとなるデータを作成する"
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_clusters, dim).astype(np.float32) * 2
+    assignments = rng.randint(0, n_clusters, size=n)
+    return centers[assignments] + rng.randn(n, dim).astype(np.float32)
+
+
+def recall(expectations, actuals):
+    "厳密な近傍のうち近似の近傍に含まれている割合"
+    hits = [len(set(expectation) & set(actual))
+            for expectation, actual in zip(expectations, actuals)]
+    return float(np.sum(hits) / expectations.size)
+
+
+def measure_queries(index, queries, k, **kwargs):
+    start = time.perf_counter()
+    _, indices = index.query_batch(queries, k, **kwargs)
+    elapsed = time.perf_counter() - start
+    return indices, {"query_ms": elapsed * 1000 / len(queries),
+                     "queries_per_sec": len(queries) / elapsed}
+
+
+def benchmark(sizes=(10000, 100000), dim=256, queries=1000, k=10,
+              n_probes=(1, 4, 8, 16)):
+    results = []
+    n_queries = queries
+    for size in sizes:
+        features = create_features(size, dim)
+        queries = create_features(n_queries, dim, seed=1)
+
+        exact = ExactIndex()
+        exact.add(features)
+        expectations, exact_result = measure_queries(exact, queries, k)
+        result = {"size": size, "dim": dim, "exact": exact_result,
+                  "ivf": []}
+
+        ivf = IVFIndex()
+        start = time.perf_counter()
+        ivf.add(features)
+        build_sec = time.perf_counter() - start
+        n_lists = len(ivf.centroids)
+        for n_probe in n_probes:
+            actuals, ivf_result = measure_queries(ivf, queries, k,
+                                                  n_probe=n_probe)
+            ivf_result.update({"n_lists": n_lists, "n_probe": n_probe,
+                               "build_sec": build_sec,
+                               "recall": recall(expectations, actuals)})
+            result["ivf"].append(ivf_result)
+        results.append(result)
+    return results
+
+
+def run(quick=False):
+    if quick:
+        return benchmark(sizes=(5000,), dim=64, queries=100, n_probes=(4,))
+    return benchmark()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probes", type=int, nargs="+",
+                        default=[1, 4, 8, 16])
+    args = parser.parse_args()
+    dump(benchmark(args.sizes, args.dim, args.queries, args.k,
+                   args.n_probes))
+
+
+if __name__ == "__main__":
+    main()
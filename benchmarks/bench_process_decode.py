@@ -0,0 +1,56 @@
+"""1プロセスでのデコードとProcessDecoderのスループットを比較するベンチマーク
+
+    python benchmarks/bench_process_decode.py --images 64 --processes 4
+"""
+import argparse
+import os
+import time
+
+from common import create_jpeg, dump
+from twissify.decoder import ProcessDecoder
+from twissify.image import open_image_array
+
+
+def benchmark(images=64, width=2048, height=1536, size=224, processes=None):
+    processes = processes or os.cpu_count()
+    binaries = [create_jpeg(width, height, seed=i) for i in range(images)]
+    size = (size, size)
+
+    start = time.perf_counter()
+    for image_binary in binaries:
+        open_image_array(image_binary, size)
+    serial = time.perf_counter() - start
+
+    with ProcessDecoder(size, processes=processes) as decoder:
+        decoder.decode(binaries[:processes]).close()
+        start = time.perf_counter()
+        with decoder.decode(binaries):
+            pass
+        parallel = time.perf_counter() - start
+
+    return {"images": images, "processes": processes,
+            "serial_images_per_sec": images / serial,
+            "process_images_per_sec": images / parallel,
+            "speedup": serial / parallel}
+
+
+def run(quick=False):
+    if quick:
+        return benchmark(images=8, width=1024, height=768)
+    return benchmark()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    dump(benchmark(args.images, args.width, args.height, args.size,
+                   args.processes))
+
+
+if __name__ == "__main__":
+    main()
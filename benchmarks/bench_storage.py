@@ -0,0 +1,98 @@
+"""SQLiteのメモリ上とファイル上のデータベースでストレージの操作を計測するベンチマーク
+
+    python benchmarks/bench_storage.py --operations 1000 --timelines 4
+"""
+import argparse
+import os
+import tempfile
+
+from common import dump, measure
+from twissify.storages import ProcessedTweetStorage, TimelineIndexStorage
+
+
+def timeline_workloads(url, operations, timelines, repeat):
+    "ポーリングと同じように ``since_id`` を進め続ける操作を計測する"
+    names = ["timeline-{i}".format(i=i) for i in range(timelines)]
+    results = {}
+    for label, kwargs in [("advance", {}),
+                          ("advance_write_behind", {"write_behind": True})]:
+        storage = TimelineIndexStorage(url, **kwargs)
+        counter = [0]
+
+        def advance():
+            for _ in range(operations):
+                counter[0] += 1
+                storage.advance_ids(names[counter[0] % timelines],
+                                    counter[0], counter[0] - 1)
+            storage.flush()
+        results[label] = measure(advance, repeat=repeat, items=operations)
+
+        def get():
+            for i in range(operations):
+                storage.get_ids(names[i % timelines])
+        results[label.replace("advance", "get")] = measure(
+            get, repeat=repeat, items=operations)
+        storage.close()
+
+    storage = TimelineIndexStorage(url)
+
+    def gaps():
+        for i in range(operations // 10):
+            storage.add_gap(names[0], i, i + 1)
+        for gap in storage.get_gaps(names[0]):
+            storage.delete_gap(gap.id)
+    results["gaps"] = measure(gaps, repeat=repeat,
+                              items=max(operations // 10, 1))
+    storage.close()
+    return results
+
+
+def processed_workloads(url, operations, repeat):
+    "処理済みのツイートの保存と確認を計測する"
+    storage = ProcessedTweetStorage(url, capacity=operations * 10)
+    counter = [0]
+
+    def add_many():
+        start = counter[0]
+        counter[0] += operations
+        storage.add_many((id, None, "other")
+                         for id in range(start, counter[0]))
+    results = {"add_many": measure(add_many, repeat=repeat,
+                                   items=operations)}
+    ids = list(range(counter[0] // 2, counter[0] // 2 + operations))
+    results["contains_many"] = measure(storage.contains_many, ids,
+                                       repeat=repeat, items=operations)
+    return results
+
+
+def benchmark(operations=1000, timelines=4, repeat=5):
+    results = {"operations": operations, "timelines": timelines}
+    with tempfile.TemporaryDirectory() as directory:
+        urls = {"sqlite_memory": "sqlite:///:memory:",
+                "sqlite_file": "sqlite:///" + os.path.join(directory,
+                                                           "bench.db")}
+        for label, url in urls.items():
+            results[label] = timeline_workloads(url, operations, timelines,
+                                                repeat)
+            results[label]["processed"] = processed_workloads(url, operations,
+                                                              repeat)
+    return results
+
+
+def run(quick=False):
+    if quick:
+        return benchmark(operations=100, repeat=2)
+    return benchmark()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--operations", type=int, default=1000)
+    parser.add_argument("--timelines", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    dump(benchmark(args.operations, args.timelines, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""ベンチマークで共通して使うデータの生成、計測、ローカルの画像サーバー"""
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+from PIL import Image
+
+
+def summarize(latencies, items=1):
+    """1回ごとの秒数からスループットとレイテンシのパーセンタイルを計算する
+
+    Parameters
+    ----------
+    latencies : array-like of float
+        1回ごとにかかった秒数
+    items : int, default 1
+        1回で処理した要素の数
+
+    Returns
+    -------
+    dict
+        1秒あたりの要素数と、平均、50、95、99パーセンタイルのミリ秒を格納した辞書
+    """
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    return {"throughput": float(items * 1000 / latencies.mean()),
+            "mean_ms": float(latencies.mean()),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99))}
+
+
+# ru_maxrss の単位。macOSはバイト、Linuxはキロバイト
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_memory(func, *args, **kwargs):
+    """``func`` を1回呼び出したときに増えた最大常駐メモリのバイト数
+
+    tracemallocはPillowやlibjpegがCで確保したメモリを数えないため、
+    計測する度にforkしたプロセスで ``func`` を呼び出し、前後の ``ru_maxrss`` の差を測る。
+    forkしたプロセスの ``ru_maxrss`` はその時点の常駐メモリから始まるため、
+    それまでの計測の影響を受けない
+    """
+    context = multiprocessing.get_context("fork")
+    reader, writer = context.Pipe(duplex=False)
+    process = context.Process(target=_send_peak_memory,
+                              args=(writer, func, args, kwargs))
+    process.start()
+    writer.close()
+    try:
+        peak = reader.recv()
+    finally:
+        process.join()
+    return peak
+
+
+def _send_peak_memory(writer, func, args, kwargs):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func(*args, **kwargs)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    writer.send((after - before) * _MAXRSS_UNIT)
+
+
+def measure(func, *args, repeat=10, warmup=1, items=1, memory=True,
+            **kwargs):
+    """``func`` を繰り返し呼び出してスループット、レイテンシ、最大メモリを計測する
+
+    Parameters
+    ----------
+    func : callable
+        計測する関数
+    repeat : int, default 10
+        計測する回数
+    warmup : int, default 1
+        計測の前に呼び出す回数
+    items : int, default 1
+        1回の呼び出しで処理する要素の数
+    memory : bool, default True
+        ``peak_memory`` で最大メモリを計測するかどうか
+
+    Returns
+    -------
+    dict
+        ``summarize`` の結果に ``peak_bytes`` を加えた辞書
+    """
+    for _ in range(warmup):
+        func(*args, **kwargs)
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    result = summarize(latencies, items=items)
+    if memory:
+        result["peak_bytes"] = peak_memory(func, *args, **kwargs)
+    return result
+
+
+def create_jpeg(width, height, quality=90, seed=0):
+    "掲示板の写真の代わりとなるグラデーションとノイズを含んだJPEGを作成する"
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height,
+                     (x + y) * 255 // (width + height)], axis=-1)
+    noise = rng.randint(0, 32, size=(height, width, 3))
+    array = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def generate_timeline(n, photo_ratio=0.3, retweet_ratio=0.3,
+                      protected_ratio=0.05, retweeted_ratio=0.05,
+                      base_id=1300000000000000000, image_base_url=None,
+                      seed=0):
+    """home_timelineが返すJSONに近い形のツイートの辞書を新しい順に作成する
+
+    Parameters
+    ----------
+    n : int
+        ツイートの数
+    photo_ratio, retweet_ratio, protected_ratio, retweeted_ratio : float
+        画像ツイート、リツイート、非公開ツイート、リツイート済みのツイートの割合
+    base_id : int, default 1300000000000000000
+        最も古いツイートのIDから1を引いた値
+    image_base_url : str, default None
+        画像urlの先頭。指定しなければpbs.twimg.comの形式
+    seed : int, default 0
+        乱数のシード
+
+    Returns
+    -------
+    list of dict
+        APIの生のJSONの辞書
+    """
+    rng = np.random.RandomState(seed)
+    if image_base_url is None:
+        image_base_url = "http://pbs.twimg.com/media"
+    tweets = []
+    for i in range(n):
+        id = base_id + n - i
+        user = {"id": int(rng.randint(1, 10 ** 6)), "screen_name": "user",
+                "name": "User", "description": "x" * 80,
+                "protected": bool(rng.rand() < protected_ratio),
+                "followers_count": 100, "friends_count": 100,
+                "created_at": "Wed Oct 10 20:19:24 +0000 2018"}
+        tweet = {"id": id, "id_str": str(id), "text": "x" * 140,
+                 "created_at": "Wed Oct 10 20:19:24 +0000 2018",
+                 "user": user,
+                 "retweeted": bool(rng.rand() < retweeted_ratio),
+                 "favorited": False, "retweet_count": 0,
+                 "favorite_count": 0, "lang": "ja",
+                 "entities": {"hashtags": [], "urls": [],
+                              "user_mentions": []}}
+        if rng.rand() < photo_ratio:
+            media = [{"id": id, "type": "photo",
+                      "media_url": "{base}/{id}_{j}.jpg".format(
+                          base=image_base_url, id=id, j=j),
+                      "sizes": {"small": {"w": 680, "h": 510,
+                                          "resize": "fit"},
+                                "large": {"w": 2048, "h": 1536,
+                                          "resize": "fit"}}}
+                     for j in range(int(rng.randint(1, 5)))]
+            tweet["entities"]["media"] = media[:1]
+            tweet["extended_entities"] = {"media": media}
+        if rng.rand() < retweet_ratio:
+            tweet["retweeted_status"] = dict(tweet, id=id - 1)
+        tweets.append(tweet)
+    return tweets
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        "ヘッダーだけを読んで切断したクライアントのエラーは無視する"
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class ImageServer:
+    """生成したJPEGを返すローカルのHTTPサーバー
+
+    どのパスにも同じ画像を返し、 ``Range`` ヘッダーにも対応する。
+    keep-aliveのため ``HTTP/1.1`` で応答する。
+    ``latency`` を指定すると応答の前にその秒数だけ待ち、実際の通信の遅延を模擬する。
+    リクエストごとにスレッドで応答するため、並行したリクエストの待機は重なる
+
+    Examples
+    --------
+    >>> with ImageServer(create_jpeg(2048, 1536)) as server:
+    ...     load_image_url(server.url + "/1.jpg")
+    """
+    def __init__(self, content, latency=0.0):
+        self.content = content
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                body = server.content
+                status = 200
+                headers = {"Content-Type": "image/jpeg"}
+                byte_range = self.headers.get("Range")
+                if byte_range and byte_range.startswith("bytes="):
+                    start, _, end = byte_range[6:].partition("-")
+                    start = int(start)
+                    end = min(int(end) if end else len(body) - 1,
+                              len(body) - 1)
+                    headers["Content-Range"] = "bytes {}-{}/{}".format(
+                        start, end, len(body))
+                    body = body[start:end + 1]
+                    status = 206
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{host}:{port}".format(host=host, port=port)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def environment():
+    "比較のためにベンチマークを実行した環境とコミットを返す"
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None, "python": platform.python_version(),
+            "platform": platform.platform(), "time": time.time()}
+
+
+def dump(results):
+    "結果をJSONとして出力する"
+    print(json.dumps(results, indent=2))
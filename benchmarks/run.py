@@ -0,0 +1,51 @@
+"""全てのベンチマークを実行し、結果を1つのJSONにまとめる
+
+コミットごとの結果を保存しておくと、変更によって速くなったか遅くなったかを比較できる
+
+    PYTHONPATH=. python benchmarks/run.py --output results.json
+    PYTHONPATH=. python benchmarks/run.py --quick --suites filters storage
+"""
+import argparse
+import importlib
+import json
+import time
+
+from common import environment
+
+SUITES = {"filters": "bench_filters",
+          "image_io": "bench_image_io",
+          "decode": "bench_decode",
+          "process_decode": "bench_process_decode",
+          "storage": "bench_storage",
+          "index": "bench_index"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--suites", nargs="+", choices=list(SUITES),
+                        default=list(SUITES))
+    parser.add_argument("--quick", action="store_true",
+                        help="小さいデータと少ない回数で実行する")
+    parser.add_argument("--output", help="結果を保存するJSONファイルのパス")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "quick": args.quick,
+               "suites": {}}
+    for suite in args.suites:
+        module = importlib.import_module(SUITES[suite])
+        start = time.perf_counter()
+        result = module.run(quick=args.quick)
+        results["suites"][suite] = {"elapsed_sec":
+                                    time.perf_counter() - start,
+                                    "results": result}
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,12 @@ setup(
     version="0.5.0",
     description="The package to classify the photo tweet",
     author="A03ki",
-    install_requires=["numpy", "pillow", "sqlalchemy", "tweepy"],
+    install_requires=["numpy", "pillow", "requests", "sqlalchemy",
+                      "tweepy"],
     url="",
     license="MIT License",
     packages=["twissify",
+              "twissify.index",
               "tests"],
     test_suite="tests"
 )
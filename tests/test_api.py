@@ -1,12 +1,32 @@
-import numpy as np
+import json
 import unittest
+
+import numpy as np
 from unittest.mock import Mock, patch
 
-from twissify.api import (has_media, is_photo, is_retweet,
-                          filter_myretweeted_tweets, filter_retweets,
-                          filter_protected_tweets, extract_photo_tweets,
-                          extract_tweet_ids, extract_photos_urls,
-                          extract_photo_urls)
+from twissify.api import (has_media, is_photo, is_retweet, is_protected,
+                          is_myretweeted, filter_myretweeted_tweets,
+                          filter_retweets, filter_protected_tweets,
+                          extract_photo_tweets, extract_tweet_ids,
+                          extract_photos_urls, extract_photo_urls,
+                          merge_tweets, TweetFilter, photo_tweet_filter,
+                          extract_photo_records, select_media_size,
+                          media_size_url)
+
+
+def create_raw_tweet(id, retweet=False, protected=False, retweeted=False,
+                     media_type="photo"):
+    "APIの生のJSONと同じ形の辞書を作る"
+    tweet = {"id": id, "retweeted": retweeted,
+             "user": {"id": 1, "protected": protected}, "entities": {}}
+    if media_type:
+        media = [{"type": media_type,
+                  "media_url": "http://pbs.twimg.com/{}.jpg".format(id)}]
+        tweet["entities"]["media"] = media
+        tweet["extended_entities"] = {"media": media}
+    if retweet:
+        tweet["retweeted_status"] = {"id": id - 1}
+    return tweet
 
 
 class TestAPI(unittest.TestCase):
@@ -36,6 +56,16 @@ class TestAPI(unittest.TestCase):
             actual = is_retweet(tweet)
             self.assertEqual(expectation, actual)
 
+    def test_is_protected(self):
+        for expectation in [True, False]:
+            tweet = Mock(**{"user.protected": expectation})
+            self.assertEqual(expectation, is_protected(tweet))
+
+    def test_is_myretweeted(self):
+        for expectation in [True, False]:
+            tweet = Mock(retweeted=expectation)
+            self.assertEqual(expectation, is_myretweeted(tweet))
+
     def test_filter_myretweeted_tweets(self):
         bools = [True, False, True, False, False]
         tweets = [Mock(retweeted=bool) for bool in bools]
@@ -77,7 +107,8 @@ class TestAPI(unittest.TestCase):
         actuals = extract_tweet_ids(tweets)
         np.testing.assert_array_equal(expectations, actuals)
 
-    @patch("twissify.api.extract_photo_urls", side_effect=lambda x: x)
+    @patch("twissify.api.extract_photo_urls",
+           side_effect=lambda x, size=None: x)
     @patch("twissify.api.is_photo",
            side_effect=[True, True, False, False, True])
     def test_extract_photos_urls(self, is_photo, extract_photo_urls):
@@ -95,6 +126,129 @@ class TestAPI(unittest.TestCase):
         actuals = extract_photo_urls(tweet)
         np.testing.assert_array_equal(expectations, actuals)
 
+    def test_select_media_size(self):
+        media = {"media_url": "http://pbs.twimg.com/media/a.jpg",
+                 "sizes": {"thumb": {"w": 150, "h": 150, "resize": "crop"},
+                           "small": {"w": 680, "h": 510, "resize": "fit"},
+                           "medium": {"w": 1200, "h": 900, "resize": "fit"},
+                           "large": {"w": 2048, "h": 1536, "resize": "fit"}}}
+        self.assertEqual("small", select_media_size(media, (100, 100)))
+        self.assertEqual("small", select_media_size(media, (224, 224)))
+        self.assertEqual("medium", select_media_size(media, (800, 600)))
+        self.assertIsNone(select_media_size(media, (4096, 4096)))
+        self.assertIsNone(select_media_size({}, (224, 224)))
+
+        self.assertEqual("http://pbs.twimg.com/media/a.jpg",
+                         media_size_url(media))
+        self.assertEqual("http://pbs.twimg.com/media/a.jpg?name=small",
+                         media_size_url(media, size=(224, 224)))
+        self.assertEqual("http://pbs.twimg.com/media/a.jpg",
+                         media_size_url(media, size=(4096, 4096)))
+        tweet = {"extended_entities": {"media": [media, media]}}
+        self.assertEqual(["http://pbs.twimg.com/media/a.jpg?name=medium"] * 2,
+                         extract_photo_urls(tweet, size=(1000, 700)))
+
+    def test_merge_tweets(self):
+        timelines = [[Mock(id=i, name="a") for i in [5, 3, 1]],
+                     [Mock(id=i, name="b") for i in [6, 3, 2]]]
+        actuals = merge_tweets(timelines)
+        self.assertEqual([6, 5, 3, 2, 1], [tweet.id for tweet in actuals])
+        self.assertIs(timelines[0][1], actuals[2])
+
+
+class TestTweetFilter(unittest.TestCase):
+    def test_call(self):
+        tweet_filter = (TweetFilter().exclude(lambda x: x % 2 == 0)
+                        .include(lambda x: x > 3))
+        actuals = tweet_filter(range(10))
+        self.assertNotIsInstance(actuals, list)
+        self.assertEqual([5, 7, 9], list(actuals))
+
+    def test_call_short_circuit(self):
+        second = Mock(return_value=True)
+        tweet_filter = TweetFilter().include(lambda x: x > 2).include(second)
+        self.assertEqual([3, 4], list(tweet_filter(range(5))))
+        self.assertEqual(2, second.call_count)
+
+    def test_reorder(self):
+        first = Mock(__name__="first", side_effect=lambda x: x < 8)
+        second = Mock(__name__="second", side_effect=lambda x: x < 2)
+        tweet_filter = TweetFilter(measure=True).include(first).include(second)
+        self.assertEqual([0, 1], list(tweet_filter(range(10))))
+        self.assertEqual([0.8, 0.25], tweet_filter.pass_rates())
+        tweet_filter.reorder()
+        self.assertEqual([(second, True), (first, True)],
+                         tweet_filter.predicates)
+        self.assertEqual([0.25, 0.8], tweet_filter.pass_rates())
+        self.assertEqual([0, 1], list(tweet_filter(range(10))))
+
+    def test_photo_tweet_filter(self):
+        def create_tweet(id, retweet=False, protected=False, retweeted=False,
+                         media_type="photo"):
+            tweet = Mock(id=id, retweeted=retweeted,
+                         entities={"media": None} if media_type else {},
+                         extended_entities={"media": [
+                             {"type": media_type, "media_url": str(id)}]},
+                         **{"user.protected": protected})
+            if not retweet:
+                del tweet.retweeted_status
+            return tweet
+
+        tweets = [create_tweet(0), create_tweet(1, retweet=True),
+                  create_tweet(2, protected=True),
+                  create_tweet(3, retweeted=True),
+                  create_tweet(4, media_type="video"),
+                  create_tweet(5, media_type=None), create_tweet(6)]
+        expectations = extract_photo_tweets(filter_myretweeted_tweets(
+            filter_protected_tweets(filter_retweets(tweets))))
+        tweet_filter = photo_tweet_filter()
+        self.assertEqual(expectations, list(tweet_filter(tweets)))
+        self.assertEqual([(0, ["0"]), (6, ["6"])],
+                         list(tweet_filter.records(tweets)))
+
+
+class TestRawJSON(unittest.TestCase):
+    def test_predicates(self):
+        self.assertTrue(has_media(create_raw_tweet(0)))
+        self.assertFalse(has_media(create_raw_tweet(0, media_type=None)))
+        self.assertTrue(is_photo(create_raw_tweet(0)))
+        self.assertFalse(is_photo(create_raw_tweet(0, media_type="video")))
+        self.assertFalse(is_photo(create_raw_tweet(0, media_type=None)))
+        self.assertTrue(is_retweet(create_raw_tweet(0, retweet=True)))
+        self.assertFalse(is_retweet(create_raw_tweet(0)))
+        self.assertTrue(is_protected(create_raw_tweet(0, protected=True)))
+        self.assertFalse(is_protected(create_raw_tweet(0)))
+        self.assertTrue(is_myretweeted(create_raw_tweet(0, retweeted=True)))
+        self.assertFalse(is_myretweeted(create_raw_tweet(0)))
+
+    def test_extractors(self):
+        tweets = [create_raw_tweet(2), create_raw_tweet(1, media_type=None)]
+        self.assertEqual([2, 1], extract_tweet_ids(tweets))
+        self.assertEqual(["http://pbs.twimg.com/2.jpg"],
+                         extract_photo_urls(tweets[0]))
+        self.assertEqual([["http://pbs.twimg.com/2.jpg"]],
+                         extract_photos_urls(tweets))
+        self.assertEqual([3, 2, 1], extract_tweet_ids(
+            merge_tweets([tweets, [create_raw_tweet(3)]])))
+
+    def test_extract_photo_records(self):
+        tweets = [create_raw_tweet(0), create_raw_tweet(1, retweet=True),
+                  create_raw_tweet(2, protected=True),
+                  create_raw_tweet(3, retweeted=True),
+                  create_raw_tweet(4, media_type="video"),
+                  create_raw_tweet(5, media_type=None), create_raw_tweet(6)]
+        expectations = [(0, ["http://pbs.twimg.com/0.jpg"]),
+                        (6, ["http://pbs.twimg.com/6.jpg"])]
+        self.assertEqual(expectations, extract_photo_records(tweets))
+        self.assertEqual(expectations,
+                         extract_photo_records(json.dumps(tweets)))
+        self.assertEqual(expectations, extract_photo_records(
+            json.dumps(tweets).encode("utf-8")))
+
+        tweet_filter = TweetFilter().include(is_protected)
+        self.assertEqual([2], [id for id, _ in extract_photo_records(
+            tweets, tweet_filter=tweet_filter)])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,179 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from twissify.api import extract_photo_records
+from twissify.archive import (ReplayAPI, ReplayPage, ReplaySource,
+                              TimelineArchive)
+from twissify.ratelimit import RateLimitBudget
+from twissify.storages import TimelineIndexStorage
+from twissify.timeline import Timeline
+
+
+def create_raw_tweet(id, photo=True):
+    tweet = {"id": id, "retweeted": False, "user": {"protected": False},
+             "entities": {}}
+    if photo:
+        media = [{"type": "photo", "media_url": "{}.jpg".format(id)}]
+        tweet["entities"]["media"] = media
+        tweet["extended_entities"] = {"media": media}
+    return tweet
+
+
+class TestTimelineArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_pages(self, archive, name, pages):
+        for ids in pages:
+            archive.write_page(name, [create_raw_tweet(id, photo=id % 2 == 0)
+                                      for id in ids])
+
+    def test_write_page(self):
+        archive = TimelineArchive(self.directory, segment_size=4)
+        self.write_pages(archive, "home_timeline",
+                         [[10, 9, 8], [7, 6], [5], []])
+        status = Mock(_json=create_raw_tweet(11))
+        archive.write_page("mentions_timeline", [status])
+        self.assertEqual(4, len(archive))
+        segments = archive.segments
+        self.assertEqual([(6, 10, 2, 5), (5, 11, 2, 2)],
+                         [(s["min_id"], s["max_id"], s["pages"], s["tweets"])
+                          for s in segments])
+
+        # セグメントはそのままJSON Linesとして読める
+        path = os.path.join(self.directory, segments[0]["name"])
+        with gzip.open(path, "rt") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([[10, 9, 8], [7, 6]],
+                         [[tweet["id"] for tweet in record["tweets"]]
+                          for record in records])
+
+        reopened = TimelineArchive(self.directory, segment_size=4)
+        self.assertEqual(4, len(reopened))
+        self.write_pages(reopened, "home_timeline", [[12]])
+        self.assertEqual(3, reopened.segments[-1]["pages"])
+
+    def test_recover_truncates_unindexed_tail(self):
+        archive = TimelineArchive(self.directory)
+        self.write_pages(archive, "home_timeline", [[3, 2, 1]])
+        path = os.path.join(self.directory, archive.segments[0]["name"])
+        with open(path, "ab") as f:
+            f.write(gzip.compress(b"partial")[:10])
+
+        archive = TimelineArchive(self.directory)
+        self.write_pages(archive, "home_timeline", [[4]])
+        source = ReplaySource(self.directory)
+        self.assertEqual([[3, 2, 1], [4]],
+                         [page.ids for page in source.pages()])
+
+        # pages.jsonを書き込んだ後、index.jsonを書き込む前に中断した状態を再現する
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path) as f:
+            index = f.read()
+        self.write_pages(archive, "home_timeline", [[6, 5, 4]])
+        with open(index_path, "w") as f:
+            f.write(index)
+
+        archive = TimelineArchive(self.directory)
+        self.assertEqual(2, len(archive))
+        self.write_pages(archive, "home_timeline", [[8, 7]])
+        source = ReplaySource(self.directory)
+        self.assertEqual([[3, 2, 1], [4], [8, 7]],
+                         [page.ids for page in source.pages()])
+        pages_path = os.path.join(self.directory,
+                                  archive.segments[0]["pages_name"])
+        with open(pages_path) as f:
+            self.assertEqual(3, len(json.load(f)))
+
+    def test_recover_overwrites_unindexed_segment(self):
+        archive = TimelineArchive(self.directory, segment_size=3)
+        self.write_pages(archive, "home_timeline", [[3, 2, 1]])
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path) as f:
+            index = f.read()
+        self.write_pages(archive, "home_timeline", [[6, 5, 4]])
+        with open(index_path, "w") as f:
+            f.write(index)
+
+        archive = TimelineArchive(self.directory, segment_size=3)
+        self.write_pages(archive, "home_timeline", [[8, 7]])
+        source = ReplaySource(self.directory)
+        self.assertEqual([[3, 2, 1], [8, 7]],
+                         [page.ids for page in source.pages()])
+
+    def test_replay_source(self):
+        archive = TimelineArchive(self.directory, segment_size=3)
+        self.write_pages(archive, "home_timeline",
+                         [[10, 9, 8], [7, 6, 5], [4, 3, 2]])
+        self.write_pages(archive, "mentions_timeline", [[9, 1]])
+        source = ReplaySource(self.directory)
+
+        self.assertEqual([[10, 9, 8], [7, 6, 5], [4, 3, 2], [9, 1]],
+                         [page.ids for page in source.pages()])
+        self.assertEqual([[7, 6, 5], [4]],
+                         [page.ids for page in source.pages(
+                             "home_timeline", since_id=3, max_id=7)])
+        self.assertEqual([9], [tweet["id"] for tweet in source.tweets(
+            "mentions_timeline", since_id=1)])
+        page = next(source.pages(since_id=7))
+        self.assertIsInstance(page, ReplayPage)
+        self.assertEqual((10, 7), (page.since_id, page.max_id))
+        self.assertEqual([(10, ["10.jpg"]), (8, ["8.jpg"])],
+                         extract_photo_records(page))
+
+    def test_replay_api(self):
+        archive = TimelineArchive(self.directory)
+        self.write_pages(archive, "home_timeline",
+                         [[10, 9, 8], [9, 8, 7], [6, 5]])
+        api = ReplayAPI(ReplaySource(self.directory))
+        self.assertEqual([10, 9], api.home_timeline(count=2).ids)
+        self.assertEqual([8, 7], api.home_timeline(count=2, max_id=8).ids)
+        self.assertEqual([10, 9, 8, 7], api.home_timeline(count=10,
+                                                          since_id=6).ids)
+        self.assertEqual([], api.mentions_timeline(count=10))
+
+        api = ReplayAPI(ReplaySource(self.directory),
+                        parse=lambda tweet: tweet["id"])
+        self.assertEqual([10, 9], api.home_timeline(count=2))
+
+    def test_timeline_record_and_replay(self):
+        pages = [ReplayPage([create_raw_tweet(3), create_raw_tweet(2)]),
+                 ReplayPage([create_raw_tweet(5), create_raw_tweet(4)])]
+        api = Mock(**{"home_timeline.side_effect": pages})
+        archive = TimelineArchive(self.directory)
+        timeline = Timeline(api, Mock(), archive=archive)
+        timeline.home_timeline(2)
+        timeline.home_timeline(2)
+        self.assertEqual(2, len(archive))
+
+        replay = ReplayAPI(ReplaySource(self.directory))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("home_timeline", 3, 1)
+        timeline = Timeline(replay, storage)
+        self.assertEqual([5, 4], [tweet["id"] for tweet in timeline.poll()])
+        self.assertEqual(5, timeline.home_timeline_ids.since_id)
+
+    def test_replay_with_budget(self):
+        archive = TimelineArchive(self.directory)
+        self.write_pages(archive, "home_timeline", [[3, 2, 1], [5, 4]])
+        replay = ReplayAPI(ReplaySource(self.directory))
+        self.assertIsNone(replay.last_response)
+
+        budget = RateLimitBudget()
+        timeline = Timeline(replay, TimelineIndexStorage("sqlite:///:memory:"),
+                            budget=budget)
+        self.assertEqual([5, 4], [tweet["id"] for tweet
+                                  in timeline.home_timeline(2)])
+        self.assertEqual(1, budget.usage()["home_timeline"]["used"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from unittest.mock import Mock
+
+import numpy as np
+
+from twissify.api import (extract_photo_urls, is_myretweeted, is_photo,
+                          is_protected, is_retweet)
+from twissify.batch import TweetBatch
+
+
+def create_json(id, retweet=False, protected=False, retweeted=False,
+                media_type="photo", n_photos=1):
+    tweet = {"id": id, "retweeted": retweeted, "entities": {},
+             "user": {"protected": protected}}
+    if retweet:
+        tweet["retweeted_status"] = {}
+    if media_type is not None:
+        tweet["entities"]["media"] = []
+        tweet["extended_entities"] = {"media": [
+            {"type": media_type, "media_url": "{}-{}".format(id, i)}
+            for i in range(n_photos)]}
+    return tweet
+
+
+def create_test_batch():
+    tweets = [create_json(0, n_photos=2), create_json(1, retweet=True),
+              create_json(2, protected=True), create_json(3, retweeted=True),
+              create_json(4, media_type="video"),
+              create_json(5, media_type=None), create_json(6, n_photos=4)]
+    return TweetBatch.from_json(tweets)
+
+
+class TestTweetBatch(unittest.TestCase):
+    def test_from_json(self):
+        batch = create_test_batch()
+        np.testing.assert_array_equal(np.arange(7), batch.ids)
+        np.testing.assert_array_equal([0, 1, 0, 0, 0, 0, 0], batch.retweet)
+        np.testing.assert_array_equal([0, 0, 1, 0, 0, 0, 0], batch.protected)
+        np.testing.assert_array_equal([0, 0, 0, 1, 0, 0, 0], batch.retweeted)
+        np.testing.assert_array_equal([1, 1, 1, 1, 0, 0, 1], batch.photo)
+        np.testing.assert_array_equal([0, 2, 3, 4, 5, 5, 5, 9],
+                                      batch.url_offsets)
+
+    def test_from_json_matches_predicates(self):
+        tweets = [create_json(0, n_photos=2), create_json(1, retweet=True),
+                  create_json(2, protected=True),
+                  create_json(3, retweeted=True),
+                  create_json(4, media_type="video"),
+                  create_json(5, media_type=None)]
+        batch = TweetBatch.from_json(tweets)
+        for name, predicate in [("retweet", is_retweet),
+                                ("protected", is_protected),
+                                ("retweeted", is_myretweeted),
+                                ("photo", is_photo)]:
+            with self.subTest(name=name):
+                np.testing.assert_array_equal(
+                    [predicate(tweet) for tweet in tweets],
+                    getattr(batch, name))
+        self.assertEqual([extract_photo_urls(tweet) for tweet in tweets
+                          if is_photo(tweet)], batch.extract_photos_urls())
+
+    def test_from_statuses(self):
+        tweets = []
+        for id, retweet in enumerate([False, True]):
+            tweet = Mock(id=id, retweeted=False, entities={"media": None},
+                         extended_entities={"media": [
+                             {"type": "photo", "media_url": str(id)}]},
+                         **{"user.protected": False})
+            if not retweet:
+                del tweet.retweeted_status
+            tweets.append(tweet)
+        batch = TweetBatch.from_statuses(tweets)
+        np.testing.assert_array_equal([0, 1], batch.ids)
+        np.testing.assert_array_equal([False, True], batch.retweet)
+        self.assertEqual([["0"], ["1"]], batch.extract_photos_urls())
+
+    def test_filters(self):
+        batch = (create_test_batch().filter_retweets()
+                 .filter_protected_tweets().filter_myretweeted_tweets()
+                 .extract_photo_tweets())
+        np.testing.assert_array_equal([0, 6], batch.extract_tweet_ids())
+        self.assertEqual([["0-0", "0-1"],
+                          ["6-{}".format(i) for i in range(4)]],
+                         batch.extract_photos_urls())
+
+    def test_extract_tweet_ids_view(self):
+        batch = create_test_batch()
+        self.assertIs(batch.ids, batch.extract_tweet_ids())
+
+    def test_concatenate(self):
+        batch = create_test_batch()
+        actual = TweetBatch.concatenate([batch.select(batch.ids < 3),
+                                         batch.select(batch.ids >= 3)])
+        np.testing.assert_array_equal(batch.ids, actual.ids)
+        np.testing.assert_array_equal(batch.url_offsets, actual.url_offsets)
+        self.assertEqual(batch.extract_photos_urls(),
+                         actual.extract_photos_urls())
+        self.assertEqual(0, len(TweetBatch.concatenate([])))
+
+    def test_invalid_length(self):
+        with self.assertRaises(ValueError):
+            TweetBatch([1], [False], [False], [False], [False], [0], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
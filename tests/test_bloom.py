@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from twissify.bloom import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        ids = np.random.RandomState(0).randint(0, 2 ** 62, size=1000)
+        bloom.add_many(ids)
+        self.assertTrue(bloom.contains_many(ids).all())
+        self.assertEqual(1000, len(bloom))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        bloom.add_many(np.arange(1000))
+        actual = bloom.contains_many(np.arange(10 ** 6, 10 ** 6 + 10000))
+        self.assertLess(actual.mean(), 0.03)
+
+    def test_contains(self):
+        bloom = BloomFilter(10)
+        bloom.add(1246830049453162496)
+        self.assertIn(1246830049453162496, bloom)
+        self.assertNotIn(1246830049453162497, bloom)
+
+    def test_invalid_arguments(self):
+        for kwargs in [{"capacity": 0}, {"capacity": 10, "error_rate": 1}]:
+            with self.subTest(**kwargs):
+                with self.assertRaises(ValueError):
+                    BloomFilter(**kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
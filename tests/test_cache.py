@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+from twissify.cache import ImageCache
+
+
+def create_response(status_code, content=b"", headers=None):
+    return Mock(status_code=status_code, content=content,
+                headers={} if headers is None else headers)
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fetch_hit(self):
+        cache = ImageCache(self.directory)
+        session = Mock(**{"get.return_value": create_response(200, b"image")})
+        for _ in range(3):
+            actual = cache.fetch("url", session=session)
+            self.assertEqual((b"image", 200), actual)
+        session.get.assert_called_once_with("url", timeout=None)
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertAlmostEqual(2 / 3, cache.hit_rate)
+
+    def test_fetch_not_found(self):
+        cache = ImageCache(self.directory)
+        session = Mock(**{"get.return_value": create_response(404)})
+        self.assertEqual((None, 404), cache.fetch("url", session=session))
+        self.assertNotIn("url", cache)
+
+    def test_fetch_revalidate(self):
+        cache = ImageCache(self.directory, max_age=0)
+        headers = {"ETag": "tag", "Last-Modified": "date"}
+        cache.put("url", b"image", etag="tag", last_modified="date")
+        session = Mock(**{"get.return_value": create_response(304)})
+        actual = cache.fetch("url", session=session)
+        self.assertEqual((b"image", 200), actual)
+        session.get.assert_called_once_with(
+            "url", headers={"If-None-Match": headers["ETag"],
+                            "If-Modified-Since": headers["Last-Modified"]},
+            timeout=None)
+        self.assertEqual(1, cache.revalidations)
+
+    def test_fetch_revalidate_saves_index(self):
+        cache = ImageCache(self.directory, max_age=60)
+        cache.put("url", b"image", etag="tag")
+        cache._entries["url"]["checked_at"] -= 120
+        cache.save()
+        session = Mock(**{"get.return_value": create_response(304)})
+        cache.fetch("url", session=session)
+        cache.close()
+
+        reopened = ImageCache(self.directory, max_age=60)
+        self.assertEqual((b"image", 200), reopened.fetch("url",
+                                                         session=session))
+        session.get.assert_called_once()
+
+    def test_put_shares_content(self):
+        cache = ImageCache(self.directory)
+        cache.put("url1", b"image")
+        cache.put("url2", b"image")
+        self.assertEqual(cache.digest("url1"), cache.digest("url2"))
+        self.assertEqual(len(b"image"), cache.total_bytes)
+        objects = os.listdir(os.path.join(self.directory, "objects"))
+        self.assertEqual(1, len(objects))
+
+    def test_put_evicts_least_recently_used(self):
+        cache = ImageCache(self.directory, max_bytes=10)
+        cache.put("url1", b"aaaa")
+        cache.put("url2", b"bbbb")
+        cache.get("url1")
+        cache.put("url3", b"cccc")
+        self.assertIn("url1", cache)
+        self.assertNotIn("url2", cache)
+        self.assertIn("url3", cache)
+        self.assertEqual(8, cache.total_bytes)
+        cache.put("url4", b"dddddddd")
+        self.assertEqual(["url4"], list(cache._entries))
+        self.assertEqual(8, cache.total_bytes)
+
+    def test_reopen(self):
+        cache = ImageCache(self.directory)
+        cache.put("url", b"image")
+        cache.close()
+        reopened = ImageCache(self.directory)
+        self.assertEqual(b"image", reopened.get("url"))
+        self.assertEqual(len(b"image"), reopened.total_bytes)
+
+    def test_save_interval(self):
+        cache = ImageCache(self.directory, save_interval=60)
+        with patch.object(cache, "_save_index",
+                          wraps=cache._save_index) as save_index:
+            for i in range(100):
+                cache.put("url{i}".format(i=i), str(i).encode())
+            save_index.assert_not_called()
+            cache._saved_at -= 60
+            cache.put("url", b"image")
+            self.assertEqual(1, save_index.call_count)
+            cache.close()
+            self.assertEqual(1, save_index.call_count)
+        self.assertEqual(101, len(ImageCache(self.directory)))
+
+    def test_remove_orphans(self):
+        cache = ImageCache(self.directory)
+        cache.put("url1", b"image1")
+        cache.save()
+        cache.put("url2", b"image2")
+        reopened = ImageCache(self.directory)
+        self.assertEqual(["url1"], list(reopened._entries))
+        self.assertEqual([cache.digest("url1")],
+                         os.listdir(os.path.join(self.directory, "objects")))
+
+    def test_get_reads_outside_lock(self):
+        cache = ImageCache(self.directory)
+        cache.put("url", b"image")
+        acquired = []
+
+        def acquire():
+            if cache._lock.acquire(blocking=False):
+                acquired.append(True)
+                cache._lock.release()
+
+        def read(*args, **kwargs):
+            thread = threading.Thread(target=acquire)
+            thread.start()
+            thread.join()
+            return open(*args, **kwargs)
+
+        with patch("twissify.cache.open", side_effect=read, create=True):
+            self.assertEqual(b"image", cache.get("url"))
+        self.assertEqual([True], acquired)
+
+
+if __name__ == "__main__":
+    unittest.main()
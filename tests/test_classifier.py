@@ -0,0 +1,80 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import numpy as np
+
+from twissify.classifier import Classifier, FunctionClassifier, MicroBatcher
+
+
+class SumClassifier(Classifier):
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, images):
+        self.batch_sizes.append(len(images))
+        return images.reshape(len(images), -1).sum(axis=1)
+
+
+def create_image(value, shape=(2, 2, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_classify_in_batches(self):
+        classifier = SumClassifier()
+        values = list(range(20))
+        with MicroBatcher(classifier, max_batch_size=8,
+                          max_latency_ms=200) as batcher:
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                actuals = list(executor.map(
+                    lambda value: batcher.classify(create_image(value)),
+                    values))
+        self.assertEqual([value * 12 for value in values], actuals)
+        self.assertLess(len(classifier.batch_sizes), len(values))
+        self.assertLessEqual(max(classifier.batch_sizes), 8)
+        self.assertEqual(20, batcher.images)
+        self.assertGreater(batcher.mean_batch_size, 1)
+
+    def test_deadline(self):
+        classifier = SumClassifier()
+        with MicroBatcher(classifier, max_batch_size=100,
+                          max_latency_ms=1) as batcher:
+            self.assertEqual(12, batcher.classify(create_image(1),
+                                                  timeout=5))
+        self.assertEqual([1], classifier.batch_sizes)
+
+    def test_different_shapes(self):
+        classifier = SumClassifier()
+        with MicroBatcher(classifier, max_latency_ms=100) as batcher:
+            futures = [batcher.submit(create_image(1)),
+                       batcher.submit(create_image(1, shape=(1, 1, 3))),
+                       batcher.submit(create_image(2))]
+            self.assertEqual([12, 3, 24], [future.result(timeout=5)
+                                           for future in futures])
+        self.assertEqual([2, 1], classifier.batch_sizes)
+
+    def test_exception(self):
+        function = Mock(side_effect=RuntimeError("model error"))
+        with MicroBatcher(FunctionClassifier(function)) as batcher:
+            future = batcher.submit(create_image(0))
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+    def test_wrong_number_of_results(self):
+        function = Mock(return_value=[1, 2])
+        with MicroBatcher(FunctionClassifier(function)) as batcher:
+            with self.assertRaises(ValueError):
+                batcher.classify(create_image(0), timeout=5)
+
+    def test_close(self):
+        batcher = MicroBatcher(SumClassifier(), max_latency_ms=1000)
+        future = batcher.submit(create_image(1))
+        batcher.close()
+        self.assertEqual(12, future.result(timeout=0))
+        with self.assertRaises(RuntimeError):
+            batcher.submit(create_image(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
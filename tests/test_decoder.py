@@ -0,0 +1,48 @@
+import io
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from twissify.decoder import ProcessDecoder, shared_memory
+from twissify.image import open_image_array
+
+
+def create_jpeg(color, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@unittest.skipIf(shared_memory is None, "requires Python 3.8 or later")
+class TestProcessDecoder(unittest.TestCase):
+    def test_decode(self):
+        binaries = [create_jpeg((255, 0, 0)), b"broken",
+                    create_jpeg((0, 0, 255))]
+        with ProcessDecoder((16, 8), processes=2) as decoder:
+            with decoder.decode(binaries) as batch:
+                self.assertEqual((3, 8, 16, 3), batch.images.shape)
+                self.assertEqual([True, False, True], batch.ok.tolist())
+                np.testing.assert_array_equal(
+                    open_image_array(binaries[0], (16, 8)), batch.images[0])
+                self.assertEqual(0, batch.images[1].max())
+                np.testing.assert_array_equal(
+                    open_image_array(binaries[2], (16, 8)), batch.images[2])
+
+            with decoder.decode([]) as batch:
+                self.assertEqual(0, len(batch))
+
+    def test_decode_grayscale(self):
+        with ProcessDecoder((4, 4), mode="L", processes=1) as decoder:
+            with decoder.decode([create_jpeg((128, 128, 128))]) as batch:
+                self.assertEqual((1, 4, 4), batch.images.shape)
+                self.assertTrue(batch.ok.all())
+            self.assertIsNone(batch.images)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            ProcessDecoder((4, 4), mode="CMYK")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from twissify.fingerprint import (HashIndex, dhash, dhash_many,
+                                  hamming_distance, hamming_distances, phash,
+                                  phash_many)
+
+
+def create_test_image(seed=0, size=(200, 150)):
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    array = (x * 255 // size[0])[..., None] + rng.randint(0, 64, (*size[::-1],
+                                                                  3))
+    array[40:80, 50:120] = rng.randint(0, 256, size=3)
+    return Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_near_duplicates(self):
+        image = create_test_image()
+        resized = image.resize((100, 75))
+        other = create_test_image(seed=1).transpose(Image.FLIP_LEFT_RIGHT)
+        for func in [dhash, phash]:
+            with self.subTest(func=func.__name__):
+                self.assertLessEqual(hamming_distance(func(image),
+                                                      func(resized)), 4)
+                self.assertGreater(hamming_distance(func(image),
+                                                    func(other)), 10)
+
+    def test_array_input(self):
+        image = create_test_image()
+        for func in [dhash, phash]:
+            with self.subTest(func=func.__name__):
+                self.assertEqual(func(image), func(np.asarray(image)))
+
+    def test_many(self):
+        images = [create_test_image(seed) for seed in range(3)]
+        for func, func_many in [(dhash, dhash_many), (phash, phash_many)]:
+            with self.subTest(func=func.__name__):
+                actuals = func_many(images)
+                self.assertEqual(np.uint64, actuals.dtype)
+                self.assertEqual([func(image) for image in images],
+                                 [int(actual) for actual in actuals])
+                self.assertEqual(0, len(func_many([])))
+
+    def test_hamming_distances(self):
+        hashes = np.array([0, 1, 3, 2 ** 64 - 1], dtype=np.uint64)
+        np.testing.assert_array_equal([0, 1, 2, 64],
+                                      hamming_distances(0, hashes))
+        self.assertEqual(64, hamming_distance(0, 2 ** 64 - 1))
+
+
+class TestHashIndex(unittest.TestCase):
+    def test_search(self):
+        index = HashIndex(max_distance=3)
+        rng = np.random.RandomState(0)
+        hashes = [int(h) for h in rng.randint(0, 2 ** 62, size=2000)]
+        for i, hash in enumerate(hashes):
+            index.add(hash, value=i)
+        self.assertEqual(2000, len(index))
+
+        query = hashes[10] ^ 0b101
+        actual = index.search(query)
+        self.assertEqual([(2, hashes[10], 10)], actual)
+        self.assertEqual((2, hashes[10], 10), index.nearest(query))
+        self.assertTrue(index.contains(query, k=2))
+        self.assertFalse(index.contains(query, k=1))
+        self.assertIsNone(index.nearest(query, k=1))
+
+    def test_search_matches_brute_force(self):
+        index = HashIndex(max_distance=4)
+        rng = np.random.RandomState(1)
+        base = int(rng.randint(0, 2 ** 62))
+        hashes = []
+        for _ in range(500):
+            bits = rng.choice(64, size=rng.randint(0, 8), replace=False)
+            hash = base
+            for bit in bits:
+                hash ^= 1 << int(bit)
+            hashes.append(hash)
+            index.add(hash)
+        expectations = sorted(hamming_distance(base, hash) for hash in hashes
+                              if hamming_distance(base, hash) <= 4)
+        actuals = [distance for distance, _, _ in index.search(base)]
+        self.assertEqual(expectations, actuals)
+
+    def test_invalid_distance(self):
+        with self.assertRaises(ValueError):
+            HashIndex(max_distance=64)
+        with self.assertRaises(ValueError):
+            HashIndex(max_distance=2).search(0, k=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,15 @@
+import io
+import tracemalloc
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
-from twissify.image import load_image_url, open_image_binary
+import numpy as np
+import requests
+from PIL import Image, UnidentifiedImageError
+
+from twissify.image import (header_filter, load_image_url, load_image_urls,
+                            probe_image_url, ImageInfo,
+                            open_image_array, open_image_binary)
 
 
 class TestImage(unittest.TestCase):
@@ -19,12 +27,56 @@ class TestImage(unittest.TestCase):
         for expectation in expectations:
             requests_get.return_value.status_code = expectation[1]
             image, status_code = load_image_url(url)
-            requests_get.assert_called_with(expectation_requests_get)
+            requests_get.assert_called_with(expectation_requests_get,
+                                            timeout=None)
             self.assertEqual(expectation[0], image)
             self.assertEqual(expectation[1], status_code)
             if open_image_binary.called:
                 open_image_binary.assert_called_once_with(expectation_oib)
 
+    @patch("twissify.image.open_image_binary", side_effect=lambda x: x)
+    def test_load_image_url_session(self, _):
+        response = Mock(status_code=200, content="bytes")
+        session = Mock(**{"get.return_value": response})
+        actual = load_image_url("url", session=session, timeout=5)
+        self.assertEqual(("bytes", 200), actual)
+        session.get.assert_called_once_with("url", timeout=5)
+
+    @patch("twissify.image.open_image_binary", side_effect=lambda x: x)
+    def test_load_image_url_cache(self, _):
+        session = Mock()
+        cache = Mock(**{"fetch.return_value": ("bytes", 200)})
+        actual = load_image_url("url", session=session, cache=cache)
+        self.assertEqual(("bytes", 200), actual)
+        cache.fetch.assert_called_once_with("url", session=session,
+                                            timeout=None)
+        session.get.assert_not_called()
+
+    @patch("twissify.image.load_image_url")
+    def test_load_image_urls(self, load_image_url):
+        errors = {"timeout": requests.ConnectionError(),
+                  "broken": UnidentifiedImageError()}
+
+        def side_effect(image_url, session, timeout, cache, stream, accept):
+            if image_url in errors:
+                raise errors[image_url]
+            return image_url.upper(), 200
+
+        load_image_url.side_effect = side_effect
+        session = Mock()
+        urls = ["a", "timeout", "b", "broken"]
+        expectations = [("A", 200), (None, errors["timeout"]), ("B", 200),
+                        (None, errors["broken"])]
+        actuals = load_image_urls(urls, max_concurrency=2, timeout=3,
+                                  session=session)
+        self.assertEqual(expectations, actuals)
+        load_image_url.assert_any_call("a", session=session, timeout=3,
+                                       cache=None, stream=False, accept=None)
+        session.close.assert_not_called()
+
+    def test_load_image_urls_empty(self):
+        self.assertEqual([], load_image_urls([]))
+
     @patch("PIL.Image.open", return_value="Success!")
     @patch("io.BytesIO", return_value="bytes")
     def test_open_image_binary(self, io_BytesIO, Image_open):
@@ -37,6 +89,136 @@ class TestImage(unittest.TestCase):
         Image_open.assert_called_once_with(expectation_Image_open)
         self.assertEqual(expectation, actual)
 
+    def test_open_image_array(self):
+        sizes = [(64, 32), (16, 16), (100, 50)]
+        for format in ["JPEG", "PNG"]:
+            buffer = io.BytesIO()
+            Image.new("L", (320, 160), color=128).save(buffer, format=format)
+            for size in sizes:
+                with self.subTest(format=format, size=size):
+                    actual = open_image_array(buffer.getvalue(), size)
+                    self.assertEqual((size[1], size[0], 3), actual.shape)
+                    self.assertEqual(np.uint8, actual.dtype)
+                    self.assertTrue(np.all(np.abs(actual.astype(int) - 128)
+                                           <= 2))
+        actual = open_image_array(buffer.getvalue(), (16, 8), mode="L")
+        self.assertEqual((8, 16), actual.shape)
+
+    def test_probe_image_url(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 480)).save(buffer, format="JPEG")
+        content = buffer.getvalue()
+        chunks = [content[i:i + 64] for i in range(0, 1024, 64)]
+        response = Mock(status_code=206,
+                        headers={"Content-Range": "bytes 0-1023/{}".format(
+                            len(content))},
+                        **{"iter_content.return_value": iter(chunks)})
+        session = Mock(**{"get.return_value": response})
+        info, status_code = probe_image_url("url", session=session,
+                                            max_bytes=1024)
+        self.assertEqual(206, status_code)
+        self.assertEqual(("JPEG", (640, 480), "RGB", len(content)), info)
+        session.get.assert_called_once_with(
+            "url", headers={"Range": "bytes=0-1023"}, timeout=None,
+            stream=True)
+        response.close.assert_called_once_with()
+
+    def test_probe_image_url_unknown(self):
+        response = Mock(status_code=200, headers={},
+                        **{"iter_content.return_value": iter([b"x" * 64])})
+        session = Mock(**{"get.return_value": response})
+        self.assertEqual((None, 200), probe_image_url("url", session=session,
+                                                      max_bytes=64))
+        response = Mock(status_code=404, headers={})
+        session = Mock(**{"get.return_value": response})
+        self.assertEqual((None, 404), probe_image_url("url", session=session))
+
+    def create_stream_response(self, size, format="JPEG"):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, color=(10, 20, 30)).save(buffer, format=format)
+        content = buffer.getvalue()
+        chunks = [content[i:i + 256] for i in range(0, len(content), 256)]
+        consumed = []
+
+        def iter_content(chunk_size):
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+        response = Mock(status_code=200, url="url",
+                        headers={"Content-Length": str(len(content))},
+                        iter_content=iter_content)
+        return response, chunks, consumed
+
+    def test_load_image_url_stream(self):
+        response, chunks, consumed = self.create_stream_response((320, 240))
+        session = Mock(**{"get.return_value": response})
+        image, status_code = load_image_url("url", session=session,
+                                            stream=True,
+                                            accept=header_filter())
+        self.assertEqual(200, status_code)
+        self.assertEqual((320, 240), image.size)
+        self.assertEqual((10, 20, 30), image.getpixel((0, 0)))
+        self.assertEqual(len(chunks), len(consumed))
+        session.get.assert_called_once_with("url", timeout=None, stream=True)
+        response.close.assert_called_once_with()
+
+    def test_load_image_url_stream_buffers_once(self):
+        pixels = np.random.RandomState(0).randint(0, 256, (1024, 1024, 3))
+        buffer = io.BytesIO()
+        Image.fromarray(pixels.astype(np.uint8)).save(buffer, format="JPEG")
+        content = buffer.getvalue()
+        chunks = [content[i:i + 65536]
+                  for i in range(0, len(content), 65536)]
+        response = Mock(status_code=200, url="url",
+                        headers={"Content-Length": str(len(content))},
+                        iter_content=lambda chunk_size: iter(chunks))
+        session = Mock(**{"get.return_value": response})
+        load_image_url("url", session=session, stream=True)
+
+        tracemalloc.start()
+        try:
+            image, _ = load_image_url("url", session=session, stream=True)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual((1024, 1024), image.size)
+        self.assertLess(peak, 1.5 * len(content))
+
+    def test_load_image_url_stream_draft(self):
+        response, _, _ = self.create_stream_response((320, 240))
+        session = Mock(**{"get.return_value": response})
+        image, _ = load_image_url("url", session=session, stream=True,
+                                  draft=("RGB", (80, 60)))
+        self.assertEqual((80, 60), image.size)
+
+    def test_load_image_url_stream_reject(self):
+        for size in [(1600, 200), (90, 400)]:
+            with self.subTest(size=size):
+                response, chunks, consumed = self.create_stream_response(size)
+                session = Mock(**{"get.return_value": response})
+                actual = load_image_url("url", session=session, stream=True,
+                                        accept=header_filter())
+                self.assertEqual((None, 200), actual)
+                self.assertLess(len(consumed), len(chunks))
+                response.close.assert_called_once_with()
+
+    def test_load_image_url_stream_broken(self):
+        response = Mock(status_code=200, url="url", headers={},
+                        **{"iter_content.return_value": iter([b"x" * 64])})
+        session = Mock(**{"get.return_value": response})
+        with self.assertRaises(UnidentifiedImageError):
+            load_image_url("url", session=session, stream=True)
+
+    def test_header_filter(self):
+        accept = header_filter(min_size=(100, 100), max_size=(4096, 4096),
+                               max_aspect_ratio=3.0, modes=("RGB", "L"))
+        self.assertTrue(accept(ImageInfo("JPEG", (640, 480), "RGB", None)))
+        self.assertFalse(accept(ImageInfo("JPEG", (99, 480), "RGB", None)))
+        self.assertFalse(accept(ImageInfo("JPEG", (8000, 4000), "RGB",
+                                          None)))
+        self.assertFalse(accept(ImageInfo("JPEG", (1000, 300), "RGB", None)))
+        self.assertFalse(accept(ImageInfo("PNG", (640, 480), "RGBA", None)))
+
 
 if __name__ == "__main__":
     unittest.main()
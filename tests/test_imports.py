@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("numpy", "PIL", "requests", "sqlalchemy", "tweepy")
+
+# 読み込みにかかる時間の上限(マイクロ秒)。測定した累積時間の中央値のおよそ2倍とし、
+# PIL.Image(約20ms)やrequests(約90ms)を読み込むと超えるようにしている。
+# 共有のCIでは時間がばらつくため、環境変数 TWISSIFY_IMPORT_BUDGETS を
+# 設定したときだけ確認する
+BUDGETS = {"twissify.api": 25000,
+           "twissify.archive": 30000,
+           "twissify.cache": 25000,
+           "twissify.image": 40000,
+           "twissify.metrics": 12000,
+           "twissify.pipeline": 10000,
+           "twissify.ratelimit": 5000,
+           "twissify.service": 90000,
+           "twissify.storages": 40000,
+           "twissify.timeline": 45000}
+
+# 他のプロセスの影響で遅くなったときのために、上限を超えたら測り直す回数
+RETRIES = 2
+
+
+def import_module(module):
+    "新しいプロセスで ``module`` を読み込み、読み込まれた重いモジュールと累積時間を返す"
+    code = ("import sys, {module}\n"
+            "print(','.join(name for name in {heavy!r} "
+            "if name in sys.modules))").format(module=module,
+                                               heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True, cwd=ROOT,
+                            env=env)
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    cumulative = None
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1])
+    return loaded, cumulative
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires 3.7")
+class TestImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        for module in BUDGETS:
+            with self.subTest(module=module):
+                loaded, cumulative = import_module(module)
+                self.assertEqual([], loaded)
+                self.assertIsNotNone(cumulative)
+
+    @unittest.skipUnless(os.environ.get("TWISSIFY_IMPORT_BUDGETS"),
+                         "set TWISSIFY_IMPORT_BUDGETS to check import times")
+    def test_import_budgets(self):
+        for module, budget in BUDGETS.items():
+            with self.subTest(module=module):
+                cumulative = import_module(module)[1]
+                for _ in range(RETRIES):
+                    if cumulative < budget:
+                        break
+                    cumulative = min(cumulative, import_module(module)[1])
+                self.assertLess(cumulative, budget)
+
+
+if __name__ == "__main__":
+    unittest.main()
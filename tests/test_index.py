@@ -0,0 +1,160 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from twissify.index import (BaseIndex, ExactIndex, IVFIndex, kmeans,
+                            load_index)
+
+
+def create_features(n, dim=8, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(5, dim) * 10
+    return (centers[rng.randint(0, 5, size=n)]
+            + rng.randn(n, dim)).astype(np.float32)
+
+
+def brute_force(features, queries, k):
+    distances = ((queries[:, None] - features[None]) ** 2).sum(axis=2)
+    return np.argsort(distances, axis=1, kind="stable")[:, :k]
+
+
+class TestBaseIndex(unittest.TestCase):
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            BaseIndex()
+
+
+class TestExactIndex(unittest.TestCase):
+    def test_query_batch(self):
+        features = create_features(300)
+        queries = create_features(20, seed=1)
+        index = ExactIndex(batch_size=7)
+        index.add(features[:100])
+        index.add(features[100:])
+        distances, indices = index.query_batch(queries, 5)
+        np.testing.assert_array_equal(brute_force(features, queries, 5),
+                                      indices)
+        self.assertTrue(np.all(np.diff(distances, axis=1) >= 0))
+        np.testing.assert_array_equal(np.arange(300), index.labels)
+
+    def test_query_batch_cosine(self):
+        features = np.array([[1, 0], [0, 1], [1, 1]], dtype=np.float32)
+        index = ExactIndex(metric="cosine")
+        index.add(features, labels=["a", "b", "c"])
+        distances, indices = index.query([10, 9], 2)
+        np.testing.assert_array_equal([2, 0], indices)
+        self.assertEqual(["c", "a"], list(index.labels[indices]))
+
+    def test_query_batch_fewer_than_k(self):
+        index = ExactIndex()
+        distances, indices = index.query_batch(np.zeros((2, 3)), 2)
+        np.testing.assert_array_equal(-1, indices)
+        index.add(np.zeros((1, 3)))
+        distances, indices = index.query_batch(np.zeros((2, 3)), 2)
+        np.testing.assert_array_equal([[0, -1], [0, -1]], indices)
+        self.assertTrue(np.isinf(distances[:, 1]).all())
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            ExactIndex(metric="l1")
+        index = ExactIndex()
+        index.add(np.zeros((2, 3)))
+        with self.assertRaises(ValueError):
+            index.add(np.zeros((2, 4)))
+        with self.assertRaises(ValueError):
+            index.add(np.zeros((2, 3)), labels=[0])
+
+
+class TestIVFIndex(unittest.TestCase):
+    def test_query_batch_all_lists(self):
+        features = create_features(500)
+        queries = create_features(30, seed=1)
+        index = IVFIndex(n_lists=10, n_probe=10)
+        index.add(features)
+        _, indices = index.query_batch(queries, 5)
+        np.testing.assert_array_equal(brute_force(features, queries, 5),
+                                      indices)
+
+    def test_query_batch_recall(self):
+        features = create_features(2000)
+        queries = create_features(50, seed=1)
+        index = IVFIndex(n_lists=20, n_probe=5)
+        index.train(features)
+        index.add(features[:1000])
+        index.add(features[1000:])
+        expectations = brute_force(features, queries, 10)
+        _, indices = index.query_batch(queries, 10)
+        recall = np.mean([len(set(expectation) & set(actual)) / 10
+                          for expectation, actual in zip(expectations,
+                                                         indices)])
+        self.assertGreater(recall, 0.9)
+
+    def test_kmeans(self):
+        features = create_features(500)
+        centroids = kmeans(features, 5)
+        self.assertEqual((5, 8), centroids.shape)
+        centroids = kmeans(features, 5, spherical=True)
+        np.testing.assert_allclose(1, np.linalg.norm(centroids, axis=1),
+                                   rtol=1e-5)
+
+    def test_cosine_centroids(self):
+        index = IVFIndex(n_lists=5, metric="cosine")
+        index.add(create_features(500))
+        np.testing.assert_allclose(1, np.linalg.norm(index.centroids, axis=1),
+                                   rtol=1e-5)
+
+    def test_n_lists(self):
+        features = create_features(1600)
+        index = IVFIndex(n_probe=1000)
+        index.add(features[:100])
+        self.assertEqual(10, len(index.centroids))
+        index.add(features[100:300])
+        self.assertEqual(10, len(index.centroids))
+        np.testing.assert_array_equal(
+            np.argsort(index._assignments, kind="stable"), index._order)
+        index.add(features[300:])
+        self.assertEqual(40, len(index.centroids))
+        queries = create_features(20, seed=1)
+        _, indices = index.query_batch(queries, 5)
+        np.testing.assert_array_equal(brute_force(features, queries, 5),
+                                      indices)
+
+
+class TestSaveLoad(unittest.TestCase):
+    def test_save_load(self):
+        features = create_features(200)
+        queries = create_features(10, seed=1)
+        for index in [ExactIndex(), IVFIndex(n_lists=8, n_probe=3)]:
+            with self.subTest(kind=index.kind):
+                index.add(features)
+                expectations = index.query_batch(queries, 4)
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, "index.npz")
+                    index.save(path)
+                    loaded = load_index(path)
+                    self.assertIsInstance(loaded, type(index))
+                    actuals = loaded.query_batch(queries, 4)
+                    other = {"exact": IVFIndex, "ivf": ExactIndex}[index.kind]
+                    with self.assertRaises(ValueError):
+                        other.load(path)
+                np.testing.assert_array_equal(expectations[1], actuals[1])
+                np.testing.assert_allclose(expectations[0], actuals[0])
+
+    def test_save_load_params(self):
+        features = create_features(100)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.npz")
+            index = ExactIndex(batch_size=7)
+            index.add(features)
+            index.save(path)
+            self.assertEqual(7, load_index(path).batch_size)
+            index = IVFIndex()
+            index.add(features)
+            index.save(path)
+            self.assertIsNone(load_index(path).n_lists)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from twissify import metrics
+from twissify.api import filter_retweets
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry(buckets=(0.1, 1.0))
+        self.previous = metrics.REGISTRY
+        metrics.enable(self.registry)
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.REGISTRY = self.previous
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in (0.1, 0.5, 2.0, 3.0):
+            histogram.observe(value)
+        self.assertEqual([1, 1, 2], histogram.counts)
+        self.assertEqual([1, 2, 4], histogram.cumulative_counts())
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(5.6, histogram.sum)
+        self.assertEqual(1.0, histogram.quantile(0.5))
+        self.assertEqual(float("inf"), histogram.quantile(0.99))
+        self.assertIsNone(metrics.Histogram().quantile(0.5))
+
+
+class TestInstrument(MetricsTestCase):
+    def test_instrument(self):
+        @metrics.instrument("double", items=len, nbytes=len)
+        def double(values):
+            return values * 2
+
+        self.assertEqual(b"abab", double(b"ab"))
+        counter = self.registry.counter
+        self.assertEqual(1, counter("twissify_double_calls_total"))
+        self.assertEqual(4, counter("twissify_double_items_total"))
+        self.assertEqual(2, counter("twissify_double_bytes_total"))
+        self.assertEqual(1, self.registry.histogram("twissify_double_seconds")
+                         .count)
+
+    def test_error(self):
+        @metrics.instrument("fail")
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            fail()
+        counter = self.registry.counter
+        self.assertEqual(1, counter("twissify_fail_calls_total"))
+        self.assertEqual(1, counter("twissify_fail_errors_total"))
+        self.assertEqual(1, self.registry.histogram("twissify_fail_seconds")
+                         .count)
+
+    def test_disabled(self):
+        metrics.disable()
+        self.assertFalse(metrics.is_enabled())
+        tweets = [Mock(retweeted_status=None), Mock(spec=[])]
+        self.assertEqual(1, len(filter_retweets(tweets)))
+        metrics.add("photos", 3)
+        chunks = [b"ab"]
+        self.assertIs(chunks, metrics.count_bytes("load", chunks))
+        self.assertEqual({"counters": [], "histograms": []},
+                         self.registry.snapshot())
+
+    def test_api(self):
+        tweets = [Mock(retweeted_status=None), Mock(spec=[])]
+        filter_retweets(tweets)
+        self.assertEqual(1, self.registry.counter(
+            "twissify_filter_retweets_calls_total"))
+        self.assertEqual(1, self.registry.counter(
+            "twissify_filter_retweets_items_total"))
+
+    def test_count_bytes(self):
+        chunks = metrics.count_bytes("load", iter([b"ab", b"cde"]))
+        self.assertEqual([b"ab", b"cde"], list(chunks))
+        metrics.add("load_bytes_total", 10)
+        self.assertEqual(15,
+                         self.registry.counter("twissify_load_bytes_total"))
+
+
+class TestExporters(MetricsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry.inc("twissify_calls_total", 2, timeline="home")
+        self.registry.observe("twissify_seconds", 0.5)
+
+    def test_prometheus_text(self):
+        text = metrics.prometheus_text(self.registry)
+        self.assertEqual(
+            "# TYPE twissify_calls_total counter\n"
+            'twissify_calls_total{timeline="home"} 2\n'
+            "# TYPE twissify_seconds histogram\n"
+            'twissify_seconds_bucket{le="0.1"} 0\n'
+            'twissify_seconds_bucket{le="1.0"} 1\n'
+            'twissify_seconds_bucket{le="+Inf"} 1\n'
+            "twissify_seconds_sum 0.5\n"
+            "twissify_seconds_count 1\n", text)
+
+    def test_prometheus_text_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "twissify.prom")
+            metrics.PrometheusTextFileExporter(path)(self.registry)
+            with open(path) as f:
+                self.assertEqual(metrics.prometheus_text(self.registry),
+                                 f.read())
+            self.assertEqual(["twissify.prom"], os.listdir(directory))
+
+    def test_json_log(self):
+        stream = io.StringIO()
+        metrics.JSONLogExporter(stream)(self.registry)
+        metrics.JSONLogExporter(stream)(self.registry)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        record = json.loads(lines[0])
+        self.assertEqual([{"name": "twissify_calls_total",
+                           "labels": {"timeline": "home"}, "value": 2}],
+                         record["counters"])
+        self.assertEqual(1.0, record["histograms"][0]["p50"])
+
+    def test_reporter(self):
+        exporter = Mock()
+        with metrics.Reporter([exporter], interval=60):
+            pass
+        exporter.assert_called_once_with(self.registry)
+
+
+class TestSampler(MetricsTestCase):
+    def test_sample(self):
+        callback = Mock()
+        self.registry.sampler = metrics.Sampler(callback, rate=1.0,
+                                                memory=True)
+
+        @metrics.instrument("work")
+        def work():
+            return sum(range(1000))
+
+        work()
+        callback.assert_called_once()
+        name, stats, snapshot = callback.call_args[0]
+        self.assertEqual("work", name)
+        self.assertGreater(stats.total_calls, 0)
+        self.assertIsNotNone(snapshot)
+
+    def test_rate(self):
+        callback = Mock()
+        sampler = metrics.Sampler(callback, rate=0.0)
+        with sampler.sample("work"):
+            pass
+        callback.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
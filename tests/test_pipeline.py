@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+
+from twissify.pipeline import Pipeline, Stage
+
+
+class TestPipeline(unittest.TestCase):
+    def test_run(self):
+        pipeline = Pipeline([
+            Stage("split", lambda x: [x, x + 100], expand=True),
+            Stage("filter", lambda x: x if x % 2 == 0 else None, workers=3),
+            Stage("square", lambda x: x * x, workers=2)])
+        actuals = sorted(pipeline.run(range(10)))
+        expectations = sorted(x * x for i in range(10) for x in [i, i + 100]
+                              if x % 2 == 0)
+        self.assertEqual(expectations, actuals)
+        stats = pipeline.stats()
+        self.assertEqual(["split", "filter", "square"],
+                         [stat["name"] for stat in stats])
+        self.assertEqual([10, 20, 10], [stat["processed"] for stat in stats])
+        self.assertEqual([20, 10, 10], [stat["emitted"] for stat in stats])
+
+    def test_errors(self):
+        def function(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        stage = Stage("error", function)
+        actuals = list(Pipeline([stage]).run(range(5)))
+        self.assertEqual([0, 1, 2, 4], actuals)
+        self.assertEqual(1, stage.errors)
+        self.assertIsInstance(stage.last_error, ValueError)
+
+    def test_backpressure(self):
+        produced = []
+        release = threading.Event()
+
+        def source():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        def slow(x):
+            release.wait()
+            return x
+
+        pipeline = Pipeline([Stage("fast", lambda x: x, maxsize=2),
+                             Stage("slow", slow, maxsize=2)], maxsize=2)
+        results = pipeline.run(source())
+        thread = threading.Thread(target=lambda: next(results))
+        thread.start()
+        time.sleep(0.3)
+        self.assertLess(len(produced), 10)
+        self.assertGreater(pipeline.stages[1].queue_depth, 0)
+        release.set()
+        thread.join()
+        self.assertEqual(99, len(list(results)))
+        self.assertEqual(100, len(produced))
+
+    def test_close_early(self):
+        pipeline = Pipeline([Stage("identity", lambda x: x, workers=2)])
+        results = pipeline.run(range(1000))
+        self.assertIn(next(results), [0, 1])
+        results.close()
+        self.assertFalse(any(thread.is_alive()
+                             for thread in pipeline._threads))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            Pipeline([])
+        with self.assertRaises(ValueError):
+            Stage("stage", lambda x: x, workers=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from twissify.ratelimit import GAP, POLL, RateLimitBudget
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimitBudget(unittest.TestCase):
+    def create_budget(self, **kwargs):
+        clock = FakeClock()
+        budget = RateLimitBudget(clock=clock, sleep=clock.sleep, **kwargs)
+        return budget, clock
+
+    def test_acquire_paces_calls(self):
+        budget, clock = self.create_budget(window=100, reserve=0.0,
+                                           limits={"home_timeline": 10})
+        for _ in range(3):
+            self.assertTrue(budget.acquire("home_timeline"))
+        # 100秒の期間に残り9回なので約11秒ずつ間隔を空ける
+        self.assertAlmostEqual(100 / 9, clock.sleeps[0])
+        self.assertEqual(2, len(clock.sleeps))
+        self.assertEqual(7, budget.usage()["home_timeline"]["remaining"])
+
+    def test_acquire_non_blocking(self):
+        budget, clock = self.create_budget(window=100, reserve=0.0)
+        self.assertTrue(budget.acquire("home_timeline", block=False))
+        self.assertFalse(budget.acquire("home_timeline", block=False))
+        self.assertGreater(budget.delay("home_timeline"), 0)
+        clock.now += 100
+        self.assertTrue(budget.acquire("home_timeline", block=False))
+
+    def test_acquire_interrupted(self):
+        budget = RateLimitBudget(window=100, reserve=0.0,
+                                 sleep=lambda seconds: True)
+        budget.exhaust("home_timeline")
+        self.assertFalse(budget.acquire("home_timeline"))
+        self.assertEqual(0, budget.usage()["home_timeline"]["remaining"])
+
+    def test_reserve_for_gaps(self):
+        budget, clock = self.create_budget(window=100, reserve=0.2,
+                                           limits={"home_timeline": 10})
+        budget.update("home_timeline", {"x-rate-limit-limit": "10",
+                                        "x-rate-limit-remaining": "2",
+                                        "x-rate-limit-reset": "1050"})
+        self.assertEqual(50, budget.delay("home_timeline", POLL))
+        self.assertEqual(0, budget.delay("home_timeline", GAP))
+        self.assertTrue(budget.acquire("home_timeline", GAP, block=False))
+
+    def test_update_and_usage(self):
+        budget, clock = self.create_budget()
+        budget.update("home_timeline", {"x-rate-limit-limit": "15",
+                                        "x-rate-limit-remaining": "12",
+                                        "x-rate-limit-reset": "1600"})
+        budget.update("home_timeline", {})
+        usage = budget.usage()["home_timeline"]
+        self.assertEqual({"limit": 15, "remaining": 12, "used": 3,
+                          "used_ratio": 0.2, "reset_in": 600.0}, usage)
+
+        budget.exhaust("home_timeline", reset=1200)
+        self.assertEqual(200, budget.delay("home_timeline", GAP))
+        budget.acquire("home_timeline", GAP)
+        self.assertEqual([200], clock.sleeps)
+        self.assertEqual(14, budget.usage()["home_timeline"]["remaining"])
+
+    def test_invalid_reserve(self):
+        with self.assertRaises(ValueError):
+            RateLimitBudget(reserve=1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
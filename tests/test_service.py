@@ -0,0 +1,153 @@
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+from twissify.ratelimit import RateLimitBudget
+from twissify.service import AdaptiveInterval, Service, serve
+from twissify.storages import TimelineIndexStorage
+from twissify.timeline import Timeline
+
+
+class Page(list):
+    @property
+    def since_id(self):
+        return max(tweet["id"] for tweet in self) if self else None
+
+    @property
+    def max_id(self):
+        return min(tweet["id"] for tweet in self) - 1 if self else None
+
+
+def create_fake_timeline(tweet_ids):
+    "IDのリストをタイムラインとして返す ``home_timeline`` の代わりの関数"
+    def timeline(count, since_id=None, max_id=None):
+        ids = [i for i in sorted(tweet_ids, reverse=True)
+               if (since_id is None or i > since_id)
+               and (max_id is None or i <= max_id)]
+        return Page({"id": i} for i in ids[:count])
+    return timeline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+    def test_observe(self):
+        interval = AdaptiveInterval(target=50, min_interval=10,
+                                    max_interval=600, alpha=0.5)
+        self.assertEqual(10, interval.interval)
+        self.assertEqual(100, interval.observe(50, 100))
+        self.assertEqual(0.5, interval.rate)
+        # 到着率が上がると間隔が短くなる
+        self.assertAlmostEqual(50 / 1.25, interval.observe(200, 100))
+        self.assertEqual(10, interval.observe(10000, 100))
+        self.assertEqual(600, AdaptiveInterval(max_interval=600)
+                         .observe(0, 100))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            AdaptiveInterval(min_interval=100, max_interval=10)
+        with self.assertRaises(ValueError):
+            AdaptiveInterval(alpha=0)
+
+
+class TestService(unittest.TestCase):
+    def test_run(self):
+        clock = FakeClock()
+        polls = [[3, 2, 1], [], ConnectionError(), [5, 4]]
+
+        def poll(count, names):
+            clock.now += 1
+            result = polls.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        timeline = Mock(**{"poll.side_effect": poll,
+                           "backfill.return_value": []})
+        handler = Mock()
+        storage = Mock()
+        session = Mock()
+        interval = AdaptiveInterval(target=10, min_interval=1e-3,
+                                    max_interval=1e-3)
+        service = Service(timeline, handler=handler, interval=interval,
+                          count=100, names=["home_timeline"], storage=storage,
+                          session=session, clock=clock)
+        service.run(max_cycles=4)
+
+        self.assertEqual(4, service.cycles)
+        self.assertEqual(1, service.errors)
+        self.assertIsInstance(service.last_error, ConnectionError)
+        self.assertEqual(3, handler.call_count)
+        handler.assert_called_with([5, 4])
+        timeline.poll.assert_called_with(count=100, names=["home_timeline"])
+        timeline.backfill.assert_called_with(count=100,
+                                             names=["home_timeline"],
+                                             max_pages=1)
+        self.assertEqual(1.0, service.last_cycle_seconds)
+        self.assertIsNotNone(service.stats()["rate"])
+        self.assertEqual(3, storage.flush_if_due.call_count)
+        storage.close.assert_called_once_with()
+        session.close.assert_called_once_with()
+
+    def test_backfill(self):
+        tweet_ids = [1, 2]
+        api = Mock(home_timeline=create_fake_timeline(tweet_ids))
+        timeline = Timeline(api, TimelineIndexStorage("sqlite:///:memory:"))
+        delivered = []
+        service = Service(timeline, handler=delivered.extend, count=3,
+                          interval=AdaptiveInterval(min_interval=1e-3,
+                                                    max_interval=1e-3))
+        service.cycle()
+        tweet_ids.extend(range(3, 11))
+        for _ in range(3):
+            service.cycle()
+        self.assertEqual(0, service.errors)
+        ids = [tweet["id"] for tweet in delivered]
+        self.assertEqual(list(range(1, 11)), sorted(ids))
+
+    def test_stop(self):
+        service = Service(Mock(**{"poll.return_value": [],
+                                  "backfill.return_value": []}),
+                          interval=AdaptiveInterval(min_interval=60))
+        service.handler = lambda tweets: service.stop()
+        service.run()
+        self.assertTrue(service.stopped)
+        self.assertEqual(1, service.cycles)
+
+    def test_stop_interrupts_rate_limit_wait(self):
+        api = Mock(**{"home_timeline.return_value": []})
+        service = None
+        budget = RateLimitBudget(sleep=lambda seconds: service.wait(seconds))
+        budget.exhaust("home_timeline")
+        service = Service(Timeline(api, Mock(), budget=budget))
+        threading.Timer(0.1, service.stop).start()
+
+        started_at = time.monotonic()
+        service.run()
+        self.assertLess(time.monotonic() - started_at, 10)
+        self.assertEqual(0, service.errors)
+        api.home_timeline.assert_not_called()
+        self.assertEqual(0, service.cycle())
+
+    def test_serve_signal(self):
+        def handler(tweets, session):
+            os.kill(os.getpid(), signal.SIGTERM)
+        previous = signal.getsignal(signal.SIGTERM)
+        api = Mock(**{"home_timeline.return_value": []})
+        service = serve(api, "sqlite:///:memory:", handler=handler,
+                        min_interval=60)
+        self.assertTrue(service.stopped)
+        self.assertEqual(1, service.cycles)
+        self.assertEqual(previous, signal.getsignal(signal.SIGTERM))
+
+
+if __name__ == "__main__":
+    unittest.main()
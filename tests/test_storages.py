@@ -1,9 +1,14 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
+
+import numpy as np
 
 from test_tables import test_ids, insert_test_db
 from twissify.tables import TimelineIndex
-from twissify.storages import TimelineIndexStorage
+from twissify.storages import (FeatureStore, ProcessedTweetStorage,
+                               TimelineIndexStorage)
 
 
 class TestTimelineIndexStorage(unittest.TestCase):
@@ -49,6 +54,334 @@ class TestTimelineIndexStorage(unittest.TestCase):
         self.assertEqual(timelineindex.since_id, expectation_ids["since_id"])
         self.assertEqual(timelineindex.max_id, expectation_ids["max_id"])
 
+    def test_save_ids(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        for since_id, max_id in [(10, 5), (20, 15)]:
+            storage.save_ids("timeline", since_id, max_id)
+            timelineindex = storage.get_ids("timeline")
+            self.assertEqual(since_id, timelineindex.since_id)
+            self.assertEqual(max_id, timelineindex.max_id)
+
+    def test_save_ids_single_statement(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("timeline", 1, 0)
+        statements = []
+        with patch.object(storage.session(), "execute",
+                          wraps=storage.session().execute) as execute:
+            storage.save_ids("timeline", 10, 5)
+            statements = execute.call_args_list
+        self.assertEqual(1, len(statements))
+        self.assertEqual(10, storage.get_ids("timeline").since_id)
+
+    def test_write_behind(self):
+        with tempfile.TemporaryDirectory() as directory:
+            url = "sqlite:///" + os.path.join(directory, "test.db")
+            storage = TimelineIndexStorage(url, write_behind=True)
+            storage.save_ids("timeline", 10, 5)
+            storage.save_ids("timeline", 20, 15)
+            self.assertEqual(20, storage.get_ids("timeline").since_id)
+            reader = TimelineIndexStorage(url)
+            self.assertIsNone(reader.get_ids("timeline"))
+
+            storage.close()
+            timelineindex = reader.get_ids("timeline")
+            self.assertEqual((20, 15), (timelineindex.since_id,
+                                        timelineindex.max_id))
+            reader.close()
+
+    def test_write_behind_interval(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:",
+                                       write_behind=True, flush_interval=0)
+        with patch.object(storage, "_write") as write:
+            storage.save_ids("timeline", 10, 5)
+        write.assert_called_once_with([{"name": "timeline", "since_id": 10,
+                                        "max_id": 5}], [])
+
+    def test_flush_single_transaction(self):
+        from sqlalchemy import event
+
+        storage = TimelineIndexStorage("sqlite:///:memory:",
+                                       write_behind=True)
+        storage.save_ids("timeline", 10, 5)
+        storage.advance_ids("other", 20, 15)
+        commits = []
+        event.listen(storage.engine, "commit",
+                     lambda connection: commits.append(connection))
+        storage.flush()
+        self.assertEqual(1, len(commits))
+        self.assertEqual(10, storage.get_ids("timeline").since_id)
+        self.assertEqual(20, storage.get_ids("other").since_id)
+
+    def test_flush_rollback(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:",
+                                       write_behind=True)
+        storage.save_ids("timeline", 10, 5)
+        storage.advance_ids("other", 20, 15)
+        with patch.object(storage, "_execute_advance",
+                          side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                storage.flush()
+        self.assertIsNone(storage.get_ids("timeline"))
+
+    def test_flush_if_due(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:",
+                                       write_behind=True, flush_interval=60)
+        storage.save_ids("timeline", 10, 5)
+        with patch.object(storage, "_write") as write:
+            storage.flush_if_due()
+            write.assert_not_called()
+            storage._flushed_at -= 60
+            storage.flush_if_due()
+        write.assert_called_once_with([{"name": "timeline", "since_id": 10,
+                                        "max_id": 5}], [])
+
+    def test_advance_ids(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        updates = [(10, 5, True), (20, 15, True), (15, 10, False),
+                   (20, 18, False), (30, 25, True)]
+        for since_id, max_id, expectation in updates:
+            with self.subTest(since_id=since_id, max_id=max_id):
+                actual = storage.advance_ids("timeline", since_id, max_id)
+                self.assertEqual(expectation, actual)
+        timelineindex = storage.get_ids("timeline")
+        self.assertEqual((30, 25), (timelineindex.since_id,
+                                    timelineindex.max_id))
+
+    def test_advance_ids_single_statement(self):
+        from sqlalchemy import event
+
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        statements = []
+        event.listen(storage.engine, "before_cursor_execute",
+                     lambda *args: statements.append(args[2]))
+        since_id = 1300000000000000000
+        self.assertTrue(storage.advance_ids("timeline", since_id, 1))
+        self.assertFalse(storage.advance_ids("timeline", since_id - 1, 1))
+        self.assertTrue(storage.advance_ids("timeline", since_id + 1, 2))
+        writes = [statement for statement in statements
+                  if not statement.lstrip().upper().startswith("SELECT")]
+        self.assertEqual(3, len(writes))
+        self.assertTrue(all("ON CONFLICT" in statement
+                            for statement in writes))
+        self.assertEqual(since_id + 1,
+                         storage.get_ids("timeline").since_id)
+
+    def test_advance_ids_shared_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            url = "sqlite:///" + os.path.join(directory, "test.db")
+            fast = TimelineIndexStorage(url)
+            slow = TimelineIndexStorage(url, write_behind=True)
+            self.assertTrue(slow.advance_ids("timeline", 10, 5))
+            self.assertTrue(fast.advance_ids("timeline", 20, 15))
+            slow.close()
+            timelineindex = fast.get_ids("timeline")
+            self.assertEqual((20, 15), (timelineindex.since_id,
+                                        timelineindex.max_id))
+            fast.close()
+
+    def test_gaps(self):
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.add_gap("timeline", 10, 20)
+        storage.add_gap("timeline", 30, 40)
+        storage.add_gap("other", 0, 5)
+        gaps = storage.get_gaps("timeline")
+        self.assertEqual([(30, 40), (10, 20)],
+                         [(gap.since_id, gap.max_id) for gap in gaps])
+
+        storage.update_gap(gaps[0].id, 35)
+        storage.delete_gap(gaps[1].id)
+        gaps = storage.get_gaps("timeline")
+        self.assertEqual([(30, 35)],
+                         [(gap.since_id, gap.max_id) for gap in gaps])
+        with self.assertRaises(ValueError):
+            storage.update_gap(-1, 0)
+
+
+class TestProcessedTweetStorage(unittest.TestCase):
+    def test_contains_many(self):
+        storage = ProcessedTweetStorage("sqlite:///:memory:", capacity=100)
+        storage.add_many([(1, "hash1", "board"), (3, "hash3", "other")])
+        storage.add(5)
+        self.assertEqual({1, 3, 5}, storage.contains_many(range(10)))
+        self.assertIn(3, storage)
+        self.assertNotIn(4, storage)
+        self.assertEqual(set(), storage.contains_many([]))
+
+    def test_contains_many_skips_database(self):
+        storage = ProcessedTweetStorage("sqlite:///:memory:", capacity=100)
+        storage.add(1)
+        with patch.object(storage, "session") as session:
+            self.assertEqual(set(), storage.contains_many([2 ** 40]))
+            session.return_value.query.assert_not_called()
+
+    def test_add_overwrites(self):
+        storage = ProcessedTweetStorage("sqlite:///:memory:")
+        storage.add(1, "hash", "other")
+        storage.add(1, "hash", "board")
+        self.assertEqual("board", storage.get(1).verdict)
+        self.assertIsNone(storage.get(2))
+        self.assertEqual([1], [row.tweet_id for row
+                               in storage.find_by_media_hash("hash")])
+
+    def test_filter_processed_tweets(self):
+        storage = ProcessedTweetStorage("sqlite:///:memory:")
+        storage.add_many([(1, None, None), (2, None, None)])
+        tweets = [Mock(id=i) for i in range(4)]
+        actuals = storage.filter_processed_tweets(tweets)
+        self.assertEqual([tweets[0], tweets[3]], actuals)
+
+    def test_reopen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            url = "sqlite:///" + os.path.join(directory, "test.db")
+            storage = ProcessedTweetStorage(url)
+            storage.add(1)
+            reopened = ProcessedTweetStorage(url)
+            self.assertIn(1, reopened.bloom)
+            self.assertEqual({1}, reopened.contains_many([1, 2]))
+            storage.engine.dispose()
+            reopened.engine.dispose()
+
+    def test_single_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            url = "sqlite:///" + os.path.join(directory, "test.db")
+            reader = ProcessedTweetStorage(url)
+            writer = ProcessedTweetStorage(url)
+            writer.add(1)
+            self.assertEqual(set(), reader.contains_many([1]))
+            reader.refresh()
+            self.assertEqual({1}, reader.contains_many([1]))
+            reader.engine.dispose()
+            writer.engine.dispose()
+
+    def test_refresh_interval(self):
+        with tempfile.TemporaryDirectory() as directory:
+            url = "sqlite:///" + os.path.join(directory, "test.db")
+            reader = ProcessedTweetStorage(url, refresh_interval=0)
+            writer = ProcessedTweetStorage(url)
+            writer.add_many([(1, None, None), (2, None, None)])
+            self.assertEqual({1, 2}, reader.contains_many([1, 2, 3]))
+            writer.add(3)
+            self.assertEqual({1, 2, 3}, reader.contains_many([1, 2, 3]))
+            reader.engine.dispose()
+            writer.engine.dispose()
+
+
+class TestFeatureStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_append_get(self):
+        store = FeatureStore(self.directory, dim=3, dtype="float16")
+        self.assertEqual((0, 3), store.features.shape)
+        features = np.arange(12).reshape(4, 3)
+        store.append([10, 11], features[:2], labels=[1, 0])
+        store.append([12, 13], features[2:])
+        self.assertEqual(4, len(store))
+        self.assertIsInstance(store.features, np.memmap)
+        self.assertEqual(np.float16, store.features.dtype)
+        actual_features, actual_labels = store.get([13, 10])
+        np.testing.assert_array_equal(features[[3, 0]], actual_features)
+        np.testing.assert_array_equal([-1, 1], actual_labels)
+        self.assertIn(12, store)
+        with self.assertRaises(KeyError):
+            store.get([99])
+
+    def test_shared_reader(self):
+        writer = FeatureStore(self.directory, dim=2)
+        reader = FeatureStore(self.directory)
+        writer.append([1], [[1, 2]])
+        self.assertEqual(0, len(reader))
+        self.assertTrue(reader.refresh())
+        self.assertFalse(reader.refresh())
+        np.testing.assert_array_equal([[1, 2]], reader.features)
+
+    def test_index(self):
+        store = FeatureStore(self.directory, dim=1)
+        store.append([30, 10, 20], [[0], [1], [2]])
+        store.append([10, 40], [[3], [4]])
+        reader = FeatureStore(self.directory)
+        np.testing.assert_array_equal([4, 3, 0, 2],
+                                      reader.rows([40, 10, 30, 20]))
+        self.assertNotIn(15, reader)
+        self.assertNotIn(50, reader)
+        with self.assertRaises(KeyError):
+            reader.rows([10, 50])
+        # 2回目の追記では追記した行だけの索引を書き込む
+        self.assertEqual(["delta-0-3-5.bin", "index-0-3.bin"],
+                         sorted(name for name in os.listdir(self.directory)
+                                if name.startswith(("index-", "delta-"))))
+
+        os.remove(os.path.join(self.directory, "delta-0-3-5.bin"))
+        reader = FeatureStore(self.directory)
+        np.testing.assert_array_equal([3], reader.get([10])[0][:, 0])
+
+    def test_index_deltas(self):
+        store = FeatureStore(self.directory, dim=1)
+        store.append(np.arange(100), np.zeros((100, 1)))
+        for i in range(40):
+            store.append([i * 3, 1000 + i], [[i + 1], [i + 1]])
+        # 1つにまとめた索引は書き直さず、差分の数は上限を超えない
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    "index-0-100.bin")))
+        self.assertLessEqual(len(store._deltas), store._max_deltas)
+        reader = FeatureStore(self.directory)
+        for opened in [store, reader]:
+            np.testing.assert_array_equal([[40], [39], [0]],
+                                          opened.get([1039, 38 * 3, 1])[0])
+
+        self.assertEqual(34, store.compact())
+        self.assertEqual([], store._deltas)
+        np.testing.assert_array_equal([[40], [39], [0]],
+                                      store.get([1039, 38 * 3, 1])[0])
+        store.append([2000], [[1]])
+        self.assertEqual(0, store.compact())
+        self.assertEqual([], store._deltas)
+        self.assertIn(2000, store)
+
+    def test_append_discards_partial_rows(self):
+        store = FeatureStore(self.directory, dim=2)
+        store.append([1], [[1, 2]])
+        with open(store._path("features"), "ab") as f:
+            f.write(b"partial")
+        store.append([2], [[3, 4]])
+        np.testing.assert_array_equal([[1, 2], [3, 4]], store.features)
+
+    def test_compact(self):
+        store = FeatureStore(self.directory, dim=2)
+        store.append([1, 2, 3], [[0, 0], [1, 1], [2, 2]], labels=[0, 1, 2])
+        store.append([2], [[5, 5]], labels=[7])
+        reader = FeatureStore(self.directory)
+        self.assertEqual(1, store.compact())
+        # 古い meta.json を読んだプロセスのために次の compact まで残す
+        self.assertEqual(["features-0.bin", "features-1.bin"],
+                         sorted(name for name in os.listdir(self.directory)
+                                if name.startswith("features-")))
+        self.assertEqual(0, store.compact())
+        np.testing.assert_array_equal([1, 3, 2], store.ids)
+        np.testing.assert_array_equal([[5, 5]], store.get([2])[0])
+        self.assertEqual(["features-1.bin", "ids-1.bin", "index-1-3.bin",
+                          "labels-1.bin", "lock", "meta.json"],
+                         sorted(os.listdir(self.directory)))
+        reader.refresh()
+        np.testing.assert_array_equal([0, 2, 7], reader.labels)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            FeatureStore(self.directory)
+        with self.assertRaises(ValueError):
+            FeatureStore(self.directory, dim=2, dtype="int8")
+        store = FeatureStore(self.directory, dim=2)
+        with self.assertRaises(ValueError):
+            FeatureStore(self.directory, dim=3)
+        with self.assertRaises(ValueError):
+            store.append([1], [[1, 2, 3]])
+        with self.assertRaises(ValueError):
+            store.append([1], [[1, 2]], labels=[1, 2])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,11 @@
 import unittest
 import sqlalchemy.orm as orm
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.sql import text
 
-from twissify.tables import TimelineIndex
+from twissify.tables import TimelineGap, TimelineIndex
 
 
 class TestTimelineIndex(unittest.TestCase):
@@ -44,6 +46,16 @@ class TestTimelineIndex(unittest.TestCase):
                 self.assertEqual(actual.max_id, max_id)
 
 
+class TestTimelineGap(unittest.TestCase):
+    def test_ids_are_64bit(self):
+        for table in [TimelineIndex, TimelineGap]:
+            with self.subTest(table=table.__tablename__):
+                ddl = str(CreateTable(table.__table__)
+                          .compile(dialect=postgresql.dialect()))
+                self.assertIn("since_id BIGINT", ddl)
+                self.assertIn("max_id BIGINT", ddl)
+
+
 def test_ids(names, n):
     ids = [iter(range(len(names)*n))]*n
     return list(zip(*ids))
@@ -1,9 +1,39 @@
+import threading
+import time
 import unittest
 from unittest.mock import Mock
 
+from twissify.ratelimit import GAP, POLL
+from twissify.storages import TimelineIndexStorage
 from twissify.timeline import Timeline
 
 
+class Tweet(int):
+    @property
+    def id(self):
+        return int(self)
+
+
+class Page(list):
+    @property
+    def since_id(self):
+        return max(self) if self else None
+
+    @property
+    def max_id(self):
+        return min(self) - 1 if self else None
+
+
+def create_fake_timeline(tweet_ids):
+    "IDのリストをタイムラインとして返す ``home_timeline`` の代わりの関数"
+    def timeline(count, since_id=None, max_id=None):
+        ids = sorted(tweet_ids, reverse=True)
+        ids = [i for i in ids if (since_id is None or i > since_id)
+               and (max_id is None or i <= max_id)]
+        return Page(Tweet(i) for i in ids[:count])
+    return Mock(side_effect=timeline)
+
+
 class TestTimeline(unittest.TestCase):
     def test_home_timeline_api(self):
         expectation_tweets = []
@@ -18,33 +48,20 @@ class TestTimeline(unittest.TestCase):
 
         api.home_timeline.assert_called_once_with(**expectation_kwargs)
 
-    def test_home_timeline_storage_create_ids(self):
-        expectation_tweets = [1]
+    def test_home_timeline_storage_advance_ids(self):
+        expectation_tweets = Page([Tweet(3), Tweet(2)])
         api = Mock(**{"home_timeline.return_value": expectation_tweets})
         storage = Mock()
         timeline = Timeline(api, storage)
-        expectation_kwargs = {"count": 200,
-                              "since_id": 20,
-                              "max_id": 2}
-        actual = timeline.home_timeline(**expectation_kwargs)
-        self.assertEqual(expectation_tweets, actual)
-
-        storage.create_ids.assert_called_once_with("home_timeline",
-                                                   expectation_tweets)
-
-    def test_home_timeline_storage_update_ids(self):
-        expectation_tweets = [2, 3]
-        api = Mock(**{"home_timeline.return_value": expectation_tweets})
-        storage = Mock(**{"create_ids.side_effect": ValueError})
-        timeline = Timeline(api, storage)
         expectation_kwargs = {"count": 300,
                               "since_id": 30,
                               "max_id": 3}
         actual = timeline.home_timeline(**expectation_kwargs)
         self.assertEqual(expectation_tweets, actual)
 
-        storage.update_ids.assert_called_once_with("home_timeline",
-                                                   expectation_tweets)
+        storage.advance_ids.assert_called_once_with("home_timeline", 3, 1)
+        storage.create_ids.assert_not_called()
+        storage.update_ids.assert_not_called()
 
     def test_home_timeline_ids(self):
         expectation = "Success!"
@@ -56,6 +73,188 @@ class TestTimeline(unittest.TestCase):
 
         storage.get_ids.assert_called_once_with("home_timeline")
 
+    def test_iter_home_timeline_first_run(self):
+        api = Mock(home_timeline=create_fake_timeline(range(1, 11)))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        timeline = Timeline(api, storage)
+        pages = list(timeline.iter_home_timeline(count=3))
+        self.assertEqual([[10, 9, 8]], pages)
+        self.assertEqual((10, 7), (timeline.home_timeline_ids.since_id,
+                                   timeline.home_timeline_ids.max_id))
+        self.assertEqual([], storage.get_gaps("home_timeline"))
+
+    def test_iter_home_timeline_paginate(self):
+        api = Mock(home_timeline=create_fake_timeline(range(1, 21)))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("home_timeline", 12, 9)
+        timeline = Timeline(api, storage)
+        pages = list(timeline.iter_home_timeline(count=3))
+        self.assertEqual([[20, 19, 18], [17, 16, 15], [14, 13]], pages)
+        self.assertEqual(20, timeline.home_timeline_ids.since_id)
+        self.assertEqual([], storage.get_gaps("home_timeline"))
+
+    def test_iter_home_timeline_gap(self):
+        tweet_ids = list(range(1, 21))
+        api = Mock(home_timeline=create_fake_timeline(tweet_ids))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("home_timeline", 5, 4)
+        timeline = Timeline(api, storage)
+        pages = list(timeline.iter_home_timeline(count=4, max_pages=2))
+        self.assertEqual([[20, 19, 18, 17], [16, 15, 14, 13]], pages)
+        self.assertEqual(20, timeline.home_timeline_ids.since_id)
+        gaps = storage.get_gaps("home_timeline")
+        self.assertEqual([(5, 12)], [(gap.since_id, gap.max_id)
+                                     for gap in gaps])
+
+        tweet_ids.extend([21, 22])
+        pages = list(timeline.iter_home_timeline(count=4, max_pages=4))
+        self.assertEqual([[22, 21], [12, 11, 10, 9], [8, 7, 6]], pages)
+        self.assertEqual(22, timeline.home_timeline_ids.since_id)
+        self.assertEqual([], storage.get_gaps("home_timeline"))
+
+    def test_iter_home_timeline_error(self):
+        pages = [Page([20, 19]), ConnectionError]
+        api = Mock(**{"home_timeline.side_effect": pages})
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("home_timeline", 10, 9)
+        timeline = Timeline(api, storage)
+        actuals = []
+        with self.assertRaises(ConnectionError):
+            for page in timeline.iter_home_timeline(count=2):
+                actuals.append(page)
+        self.assertEqual([[20, 19]], actuals)
+        gaps = storage.get_gaps("home_timeline")
+        self.assertEqual([(10, 18)], [(gap.since_id, gap.max_id)
+                                      for gap in gaps])
+
+    def test_register(self):
+        expectation_tweets = Page([5])
+        api = Mock(**{"mentions_timeline.return_value": expectation_tweets})
+        user_timeline = Mock(return_value=Page([3]))
+        storage = Mock()
+        timeline = Timeline(api, storage)
+        timeline.register("mentions_timeline")
+        timeline.register("user_timeline:uec", user_timeline,
+                          screen_name="uec")
+        self.assertEqual(["home_timeline", "mentions_timeline",
+                          "user_timeline:uec"], timeline.names)
+
+        actual = timeline.timeline("mentions_timeline", 10)
+        self.assertEqual(expectation_tweets, actual)
+        api.mentions_timeline.assert_called_once_with(count=10, since_id=None,
+                                                      max_id=None)
+        storage.advance_ids.assert_called_once_with("mentions_timeline",
+                                                    5, 4)
+        timeline.timeline("user_timeline:uec", 20, since_id=1)
+        user_timeline.assert_called_once_with(count=20, since_id=1,
+                                              max_id=None, screen_name="uec")
+
+        timeline.unregister("mentions_timeline")
+        with self.assertRaises(KeyError):
+            timeline.timeline("mentions_timeline", 10)
+
+    def test_poll(self):
+        api = Mock(home_timeline=create_fake_timeline([1, 3, 5, 6]),
+                   mentions_timeline=create_fake_timeline([2, 3, 4, 6]))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("mentions_timeline", 2, 1)
+        timeline = Timeline(api, storage)
+        timeline.register("mentions_timeline")
+        self.assertEqual([6, 5, 4, 3, 1], timeline.poll(count=10))
+        api.home_timeline.assert_called_once_with(count=10, since_id=None,
+                                                  max_id=None)
+        api.mentions_timeline.assert_called_once_with(count=10, since_id=2,
+                                                      max_id=None)
+        self.assertEqual(6, timeline.timeline_ids("home_timeline").since_id)
+        self.assertEqual(6,
+                         timeline.timeline_ids("mentions_timeline").since_id)
+
+    def test_poll_gap(self):
+        tweet_ids = [1, 2]
+        api = Mock(home_timeline=create_fake_timeline(tweet_ids))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        timeline = Timeline(api, storage)
+        self.assertEqual([2, 1], timeline.poll(count=3))
+        self.assertEqual([], storage.get_gaps("home_timeline"))
+
+        tweet_ids.extend(range(3, 10))
+        self.assertEqual([9, 8, 7], timeline.poll(count=3))
+        gaps = storage.get_gaps("home_timeline")
+        self.assertEqual([(2, 6)], [(gap.since_id, gap.max_id)
+                                    for gap in gaps])
+        self.assertEqual([[6, 5, 4], [3]],
+                         list(timeline.iter_home_timeline(count=3)))
+        self.assertEqual([], storage.get_gaps("home_timeline"))
+
+    def test_budget(self):
+        headers = {"x-rate-limit-limit": "15"}
+        api = Mock(**{"home_timeline.return_value": Page([Tweet(3)]),
+                      "user_timeline.return_value": Page([Tweet(2)]),
+                      "last_response.headers": headers})
+        budget = Mock()
+        timeline = Timeline(api, Mock(), budget=budget)
+        timeline.register("user_timeline:uec", api.user_timeline,
+                          screen_name="uec")
+        timeline.home_timeline(10)
+        timeline.timeline("user_timeline:uec", 10)
+        budget.acquire.assert_any_call("home_timeline", POLL)
+        budget.acquire.assert_any_call("user_timeline", POLL)
+        budget.update.assert_any_call("home_timeline", headers)
+        budget.update.assert_any_call("user_timeline", headers)
+
+    def test_budget_concurrent_headers(self):
+        api = Mock()
+        started = threading.Event()
+
+        def home_timeline(**kwargs):
+            api.last_response = Mock(headers={"endpoint": "home_timeline"})
+            started.set()
+            time.sleep(0.1)
+            return Page([Tweet(3)])
+
+        def mentions_timeline(**kwargs):
+            api.last_response = Mock(headers={"endpoint":
+                                              "mentions_timeline"})
+            return Page([Tweet(2)])
+
+        api.home_timeline.side_effect = home_timeline
+        api.mentions_timeline.side_effect = mentions_timeline
+        budget = Mock()
+        timeline = Timeline(api, Mock(), budget=budget)
+        thread = threading.Thread(target=timeline.home_timeline, args=(10,))
+        thread.start()
+        started.wait()
+        timeline.register("mentions_timeline")
+        timeline.timeline("mentions_timeline", 10)
+        thread.join()
+        for call in budget.update.call_args_list:
+            endpoint, headers = call[0]
+            self.assertEqual(endpoint, headers["endpoint"])
+
+    def test_budget_gap_priority(self):
+        api = Mock(home_timeline=create_fake_timeline(range(1, 21)))
+        storage = TimelineIndexStorage("sqlite:///:memory:")
+        storage.save_ids("home_timeline", 12, 11)
+        storage.add_gap("home_timeline", 4, 8)
+        budget = Mock()
+        timeline = Timeline(api, storage, budget=budget)
+        list(timeline.iter_home_timeline(count=10))
+        priorities = [call[0][1] for call in budget.acquire.call_args_list]
+        self.assertEqual([POLL, GAP], priorities)
+
+    def test_budget_too_many_requests(self):
+        response = Mock(status_code=429, headers={"x-rate-limit-reset": "9"})
+        error = Exception()
+        error.response = response
+        api = Mock(**{"home_timeline.side_effect": error})
+        budget = Mock()
+        timeline = Timeline(api, Mock(), budget=budget)
+        with self.assertRaises(Exception):
+            timeline.home_timeline(10)
+        budget.update.assert_called_once_with("home_timeline",
+                                              response.headers)
+        budget.exhaust.assert_called_once_with("home_timeline")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,17 +1,36 @@
+import json
+
+from twissify import metrics
+
+
+def _field(obj, name, default=None):
+    "ツイートオブジェクトとAPIの生のJSONの辞書の両方から値を取り出す"
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _has_field(obj, name):
+    "ツイートオブジェクトまたはAPIの生のJSONの辞書が値を持つかを確認する"
+    if isinstance(obj, dict):
+        return name in obj
+    return hasattr(obj, name)
+
+
 def has_media(tweet):
     """メディア情報を含んでいるかを確認する
 
     Parameters
     ----------
-    tweet : tweepy.models.Status
-        ツイートオブジェクト
+    tweet : tweepy.models.Status or dict
+        ツイートオブジェクト、またはAPIの生のJSONの辞書
 
     Returns
     -------
     bool
         メディア情報を含むかどうかの真偽値
     """
-    return "media" in tweet.entities
+    return "media" in _field(tweet, "entities", ())
 
 
 def is_photo(tweet):
@@ -19,8 +38,8 @@ def is_photo(tweet):
 
     Parameters
     ----------
-    tweet : tweepy.models.Status
-        ツイートオブジェクト
+    tweet : tweepy.models.Status or dict
+        ツイートオブジェクト、またはAPIの生のJSONの辞書
 
     Returns
     -------
@@ -32,7 +51,8 @@ def is_photo(tweet):
     Twitterの仕様上、動画やGIFは複数投稿できないため、最初のmediaのみを確認している
     """
     if has_media(tweet):
-        return tweet.extended_entities["media"][0]["type"] == "photo"
+        media = _field(tweet, "extended_entities")["media"]
+        return media[0]["type"] == "photo"
     return False
 
 
@@ -41,17 +61,50 @@ def is_retweet(tweet):
 
     Parameters
     ----------
-    tweet : tweepy.models.Status
-        ツイートオブジェクト
+    tweet : tweepy.models.Status or dict
+        ツイートオブジェクト、またはAPIの生のJSONの辞書
 
     Returns
     -------
     bool
         リツイートかどうかの真偽値
     """
-    return hasattr(tweet, "retweeted_status")
+    return _has_field(tweet, "retweeted_status")
+
+
+def is_protected(tweet):
+    """非公開ツイートであるかを確認する
+
+    Parameters
+    ----------
+    tweet : tweepy.models.Status or dict
+        ツイートオブジェクト、またはAPIの生のJSONの辞書
+
+    Returns
+    -------
+    bool
+        非公開ツイートかどうかの真偽値
+    """
+    return _field(_field(tweet, "user"), "protected")
+
+
+def is_myretweeted(tweet):
+    """自身がリツイート済みのツイートであるかを確認する
+
+    Parameters
+    ----------
+    tweet : tweepy.models.Status or dict
+        ツイートオブジェクト、またはAPIの生のJSONの辞書
+
+    Returns
+    -------
+    bool
+        リツイート済みかどうかの真偽値
+    """
+    return _field(tweet, "retweeted")
 
 
+@metrics.instrument("filter_myretweeted_tweets", items=len)
 def filter_myretweeted_tweets(tweets):
     """自身がリツイート済みのツイートを取り除く
 
@@ -65,9 +118,10 @@ def filter_myretweeted_tweets(tweets):
     list of tweepy.models.Status
         リツイート済みのツイートを含まないツイートオブジェクトを格納したリスト
     """
-    return [tweet for tweet in tweets if not tweet.retweeted]
+    return [tweet for tweet in tweets if not is_myretweeted(tweet)]
 
 
+@metrics.instrument("filter_retweets", items=len)
 def filter_retweets(tweets):
     """リツイートを取り除く
 
@@ -84,6 +138,7 @@ def filter_retweets(tweets):
     return [tweet for tweet in tweets if not is_retweet(tweet)]
 
 
+@metrics.instrument("filter_protected_tweets", items=len)
 def filter_protected_tweets(tweets):
     """非公開ツイートを取り除く
 
@@ -97,9 +152,10 @@ def filter_protected_tweets(tweets):
     list of tweepy.models.Status
         非公開ツイートではないツイートオブジェクトを格納したリスト
     """
-    return [tweet for tweet in tweets if not tweet.user.protected]
+    return [tweet for tweet in tweets if not is_protected(tweet)]
 
 
+@metrics.instrument("extract_photo_tweets", items=len)
 def extract_photo_tweets(tweets):
     """画像のツイートを取り出す
 
@@ -129,37 +185,331 @@ def extract_tweet_ids(tweets):
     list of int
         ツイートIDを格納したリスト
     """
-    return [tweet.id for tweet in tweets]
+    return [_field(tweet, "id") for tweet in tweets]
+
+
+def select_media_size(media, size):
+    """画像のサイズの中から ``size`` 以上の大きさを持つ最も小さいものを選ぶ
+
+    Parameters
+    ----------
+    media : dict
+        ``extended_entities`` の ``media`` の要素
+    size : tuple of int
+        必要な画像の ``(幅, 高さ)``
+
+    Returns
+    -------
+    str or None
+        ``"small"`` や ``"medium"`` などのサイズの名前。
+        十分な大きさのサイズがない、または ``sizes`` がないときは ``None``
+
+    Notes
+    -----
+    ``"thumb"`` のように切り抜かれた(resizeが ``"crop"`` の)サイズは画像の一部が
+    欠けるため選ばない
+    """
+    width, height = size
+    candidates = [(variant["w"] * variant["h"], name)
+                  for name, variant in (media.get("sizes") or {}).items()
+                  if variant.get("resize") == "fit"
+                  and variant["w"] >= width and variant["h"] >= height]
+    return min(candidates)[1] if candidates else None
+
+
+def media_size_url(media, size=None):
+    """画像の ``size`` 以上の大きさを持つ最も小さいサイズのurlを返す
+
+    Parameters
+    ----------
+    media : dict
+        ``extended_entities`` の ``media`` の要素
+    size : tuple of int, default None
+        必要な画像の ``(幅, 高さ)`` 。指定しなければ元の画像のurl
+
+    Returns
+    -------
+    str
+        ``http://pbs.twimg.com/media/xxx.jpg?name=small`` のような画像url
+    """
+    url = media["media_url"]
+    if size is None:
+        return url
+    name = select_media_size(media, size)
+    if name is None:
+        return url
+    return "{url}?name={name}".format(url=url, name=name)
 
 
-def extract_photo_urls(photo_tweet):
+def extract_photo_urls(photo_tweet, size=None):
     """画像のツイートに含まれる複数の画像のurlを取り出す
 
     Parameters
     ----------
-    tweets : tweepy.models.Status
-        画像情報を含むツイートオブジェクト
+    photo_tweet : tweepy.models.Status or dict
+        画像情報を含むツイートオブジェクト、またはAPIの生のJSONの辞書
+    size : tuple of int, default None
+        必要な画像の ``(幅, 高さ)`` 。指定すると ``sizes`` の中から
+        それ以上の大きさを持つ最も小さいサイズのurlを返す
 
     Returns
     -------
     list of str
         最大4つの画像urlを格納したリスト
     """
-    return [media["media_url"]
-            for media in photo_tweet.extended_entities["media"]]
+    return [media_size_url(media, size=size)
+            for media in _field(photo_tweet, "extended_entities")["media"]]
 
 
-def extract_photos_urls(tweets):
+@metrics.instrument("extract_photos_urls", items=len)
+def extract_photos_urls(tweets, size=None):
     """それぞれのツイートに含まれる複数の画像のurlを取り出す
 
     Parameters
     ----------
     tweets : tweepy.models.ResultSet or array-like of tweepy.models.Status
         ツイートオブジェクトを格納したリスト風のオブジェクト
+    size : tuple of int, default None
+        必要な画像の ``(幅, 高さ)``
 
     Returns
     -------
     lift of list of str
         画像urlを格納したリストを格納したリスト
     """
-    return [extract_photo_urls(tweet) for tweet in tweets if is_photo(tweet)]
+    return [extract_photo_urls(tweet, size=size)
+            for tweet in tweets if is_photo(tweet)]
+
+
+def merge_tweets(timelines):
+    """複数のタイムラインのツイートをツイートIDで重複を取り除いてまとめる
+
+    Parameters
+    ----------
+    timelines : iterable of tweepy.models.ResultSet
+        ツイートオブジェクトを格納したリスト風のオブジェクトのイテラブル
+
+    Returns
+    -------
+    list of tweepy.models.Status
+        新しい順に並んだ重複のないツイートオブジェクトを格納したリスト。
+        同じIDのツイートは最初に現れたものを残す
+    """
+    tweets = {}
+    for timeline in timelines:
+        for tweet in timeline:
+            tweets.setdefault(_field(tweet, "id"), tweet)
+    return [tweets[id] for id in sorted(tweets, reverse=True)]
+
+
+class TweetFilter:
+    """複数の条件を1回の走査で評価するツイートのフィルター
+
+    条件は追加した順に評価され、満たさない条件があった時点で残りの条件は評価しない。
+    ``measure=True`` のときは条件ごとの通過率を記録し、 ``reorder`` によって
+    多くのツイートを取り除く条件から先に評価するように並べ替えられる
+
+    Examples
+    --------
+    >>> tweet_filter = (TweetFilter().exclude(is_retweet)
+    ...                 .exclude(is_protected).include(is_photo))
+    >>> for tweet_id, photo_urls in tweet_filter.records(tweets):
+    ...     pass
+    """
+    def __init__(self, measure=False):
+        """
+        Parameters
+        ----------
+        measure : bool, default False
+            条件ごとの評価回数と通過回数を記録するかどうか
+        """
+        self.measure = measure
+        self._conditions = []
+        self._evaluated = []
+        self._passed = []
+
+    def __len__(self):
+        return len(self._conditions)
+
+    @property
+    def predicates(self):
+        "``(条件の関数, 通過させる真偽値)`` を評価する順に格納したリスト"
+        return list(self._conditions)
+
+    def include(self, predicate):
+        """``predicate`` が真となるツイートだけを通過させる条件を追加する
+
+        Parameters
+        ----------
+        predicate : callable
+            ツイートオブジェクトを受け取り真偽値を返す関数
+
+        Returns
+        -------
+        TweetFilter
+            自身
+        """
+        return self._add(predicate, True)
+
+    def exclude(self, predicate):
+        """``predicate`` が真となるツイートを取り除く条件を追加する
+
+        Parameters
+        ----------
+        predicate : callable
+            ツイートオブジェクトを受け取り真偽値を返す関数
+
+        Returns
+        -------
+        TweetFilter
+            自身
+        """
+        return self._add(predicate, False)
+
+    def _add(self, predicate, expected):
+        self._conditions.append((predicate, expected))
+        self._evaluated.append(0)
+        self._passed.append(0)
+        return self
+
+    def __call__(self, tweets):
+        """全ての条件を満たすツイートを順に返す
+
+        Parameters
+        ----------
+        tweets : tweepy.models.ResultSet or iterable of tweepy.models.Status
+            ツイートオブジェクトを格納したイテラブル
+
+        Yields
+        ------
+        tweepy.models.Status
+            全ての条件を満たすツイートオブジェクト
+        """
+        if self.measure:
+            yield from self._measured(tweets)
+            return
+
+        conditions = self._conditions
+        for tweet in tweets:
+            for predicate, expected in conditions:
+                if bool(predicate(tweet)) is not expected:
+                    break
+            else:
+                yield tweet
+
+    def _measured(self, tweets):
+        conditions = list(enumerate(self._conditions))
+        evaluated = self._evaluated
+        passed = self._passed
+        for tweet in tweets:
+            for i, (predicate, expected) in conditions:
+                evaluated[i] += 1
+                if bool(predicate(tweet)) is not expected:
+                    break
+                passed[i] += 1
+            else:
+                yield tweet
+
+    def records(self, tweets, size=None):
+        """全ての条件を満たす画像ツイートのIDと画像urlを順に返す
+
+        Parameters
+        ----------
+        tweets : tweepy.models.ResultSet or iterable of tweepy.models.Status
+            ツイートオブジェクトを格納したイテラブル
+        size : tuple of int, default None
+            必要な画像の ``(幅, 高さ)`` 。 ``extract_photo_urls`` を参照
+
+        Yields
+        ------
+        tuple of int and list of str
+            ツイートIDと最大4つの画像urlを格納したリストのタプル
+
+        Notes
+        -----
+        画像ツイート以外が通過しないように ``is_photo`` を条件に含める必要がある
+        """
+        for tweet in self(tweets):
+            yield _field(tweet, "id"), extract_photo_urls(tweet, size=size)
+
+    def pass_rates(self):
+        """条件ごとの通過率を返す
+
+        Returns
+        -------
+        list of float or None
+            評価する順に並んだ通過率。一度も評価されていない条件は ``None``
+        """
+        return [passed / evaluated if evaluated else None
+                for evaluated, passed in zip(self._evaluated, self._passed)]
+
+    def reorder(self):
+        """通過率の低い条件から評価するように並べ替える
+
+        一度も評価されていない条件は最後に回す
+
+        Returns
+        -------
+        TweetFilter
+            自身
+        """
+        rates = self.pass_rates()
+        order = sorted(range(len(self._conditions)),
+                       key=lambda i: (rates[i] is None, rates[i] or 0.0))
+        self._conditions = [self._conditions[i] for i in order]
+        self._evaluated = [self._evaluated[i] for i in order]
+        self._passed = [self._passed[i] for i in order]
+        return self
+
+
+def photo_tweet_filter(measure=False):
+    """画像ツイートを取り出すフィルターを作成する
+
+    リツイート、非公開ツイート、リツイート済みのツイートは取り除く。
+    ``filter_retweets`` 、 ``filter_protected_tweets`` 、
+    ``filter_myretweeted_tweets`` 、 ``extract_photo_tweets`` を順に適用するのと同じ
+
+    Parameters
+    ----------
+    measure : bool, default False
+        条件ごとの評価回数と通過回数を記録するかどうか
+
+    Returns
+    -------
+    TweetFilter
+        ツイートのフィルター
+    """
+    return (TweetFilter(measure=measure)
+            .exclude(is_retweet)
+            .exclude(is_protected)
+            .exclude(is_myretweeted)
+            .include(is_photo))
+
+
+@metrics.instrument("extract_photo_records", items=len)
+def extract_photo_records(timeline, tweet_filter=None, size=None):
+    """APIの生のJSONのタイムラインから画像ツイートのIDと画像urlを取り出す
+
+    ``tweepy.models.Status`` を作らずに辞書のまま条件を評価するため、
+    ツイートオブジェクトを経由するよりも速く、メモリも少なくて済む
+
+    Parameters
+    ----------
+    timeline : str, bytes or list of dict
+        APIが返したJSONの文字列、またはそれを読み込んだ辞書のリスト。
+        tweepyでは ``parser=tweepy.parsers.JSONParser()`` を指定すると得られる
+    tweet_filter : TweetFilter, default None
+        適用するフィルター。指定しなければ ``photo_tweet_filter()``
+    size : tuple of int, default None
+        必要な画像の ``(幅, 高さ)`` 。 ``extract_photo_urls`` を参照
+
+    Returns
+    -------
+    list of tuple of int and list of str
+        ツイートIDと最大4つの画像urlを格納したリストのタプルのリスト
+    """
+    if isinstance(timeline, (str, bytes)):
+        timeline = json.loads(timeline)
+    if tweet_filter is None:
+        tweet_filter = photo_tweet_filter()
+    return list(tweet_filter.records(timeline, size=size))
@@ -0,0 +1,315 @@
+import bisect
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+
+from twissify.api import _field
+
+
+def _to_json(tweet):
+    "ツイートオブジェクトをAPIの生のJSONの辞書に変換する"
+    if isinstance(tweet, dict):
+        return tweet
+    return tweet._json
+
+
+def _write_json(path, value):
+    "一時ファイルに書き込んでから置き換えることで ``value`` を不可分に保存する"
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+class ReplayPage(list):
+    """アーカイブから読み込んだタイムラインのページ
+
+    ``tweepy.models.ResultSet`` と同じく ``since_id`` と ``max_id`` を持つ
+    """
+    @property
+    def ids(self):
+        return [_field(tweet, "id") for tweet in self]
+
+    @property
+    def since_id(self):
+        "ページで最も新しいツイートID"
+        return max(self.ids) if self else None
+
+    @property
+    def max_id(self):
+        "ページで最も古いツイートIDから1を引いた値"
+        return min(self.ids) - 1 if self else None
+
+
+class TimelineArchive:
+    """取得したタイムラインのページを追記専用のファイルに保存するクラス
+
+    ページはAPIの生のJSONを1行とし、1ページごとにgzipの1メンバーとして
+    セグメントファイルに追記する。セグメントは ``zcat`` でそのままJSON Linesとして読める。
+    セグメントごとのツイートIDの範囲を ``index.json`` に、ページごとの位置と
+    ツイートIDの範囲を ``<セグメント>.pages.json`` に保存するため、
+    ``ReplaySource`` はIDの範囲で読み込むページを絞り込める
+
+    Examples
+    --------
+    >>> archive = TimelineArchive("archive")
+    >>> timeline = Timeline(api, storage, archive=archive)
+    """
+    _index_name = "index.json"
+
+    def __init__(self, directory, segment_size=50000):
+        """
+        Parameters
+        ----------
+        directory : str
+            アーカイブを保存するディレクトリのパス
+        segment_size : int, default 50000
+            1つのセグメントに保存するツイートの数の目安。
+            超えたら次のページから新しいセグメントに保存する
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = _read_json(self._path(self._index_name), [])
+        self._pages = []
+        if self._segments:
+            self._recover(self._segments[-1])
+
+    def __len__(self):
+        "保存したページの数"
+        return sum(segment["pages"] for segment in self._segments)
+
+    @property
+    def segments(self):
+        "セグメントの名前、ツイートIDの範囲、ページ数、ツイート数、バイト数を格納したリスト"
+        return [dict(segment) for segment in self._segments]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _recover(self, segment):
+        """最後のセグメントのページの位置を読み込み、索引に含まれない末尾を切り詰める
+
+        ``<セグメント>.pages.json`` は ``index.json`` より先に書き込むため、
+        その間に中断すると切り詰めた範囲を指すページが残る。
+        そのようなページは取り除いて書き直す
+        """
+        pages = _read_json(self._path(segment["pages_name"]), [])
+        self._pages = [page for page in pages
+                       if page[0] + page[1] <= segment["bytes"]]
+        if len(self._pages) != len(pages):
+            _write_json(self._path(segment["pages_name"]), self._pages)
+        path = self._path(segment["name"])
+        if os.path.exists(path) and os.path.getsize(path) > segment["bytes"]:
+            with open(path, "r+b") as f:
+                f.truncate(segment["bytes"])
+
+    def _new_segment(self):
+        number = len(self._segments)
+        name = "segment-{number:06d}.jsonl.gz".format(number=number)
+        segment = {"name": name,
+                   "pages_name": "segment-{number:06d}.pages.json"
+                                 .format(number=number),
+                   "min_id": None, "max_id": None, "pages": 0, "tweets": 0,
+                   "bytes": 0}
+        self._segments.append(segment)
+        self._pages = []
+        return segment
+
+    def write_page(self, name, tweets):
+        """タイムラインのページを保存する
+
+        Parameters
+        ----------
+        name : str
+            タイムラインの名前
+        tweets : tweepy.models.ResultSet or list of dict
+            ツイートオブジェクト、またはAPIの生のJSONの辞書のリスト。
+            空のページは保存しない
+        """
+        tweets = [_to_json(tweet) for tweet in tweets]
+        if not tweets:
+            return
+        ids = [tweet["id"] for tweet in tweets]
+        line = json.dumps({"name": name, "fetched_at": time.time(),
+                           "tweets": tweets}, separators=(",", ":"))
+        member = gzip.compress((line + "\n").encode("utf-8"))
+
+        with self._lock:
+            if (not self._segments
+                    or self._segments[-1]["tweets"] >= self.segment_size):
+                segment = self._new_segment()
+            else:
+                segment = self._segments[-1]
+            # 新しいセグメントでは索引に含まれない前回のファイルを上書きする
+            mode = "ab" if segment["bytes"] else "wb"
+            with open(self._path(segment["name"]), mode) as f:
+                f.write(member)
+            self._pages.append([segment["bytes"], len(member), min(ids),
+                                max(ids), name])
+            segment["bytes"] += len(member)
+            segment["pages"] += 1
+            segment["tweets"] += len(tweets)
+            segment["min_id"] = min(ids if segment["min_id"] is None
+                                    else ids + [segment["min_id"]])
+            segment["max_id"] = max(ids if segment["max_id"] is None
+                                    else ids + [segment["max_id"]])
+            _write_json(self._path(segment["pages_name"]), self._pages)
+            _write_json(self._path(self._index_name), self._segments)
+
+
+def _overlaps(min_id, max_id, since_id, until_id):
+    "``min_id`` から ``max_id`` の範囲と ``since_id`` を超え ``until_id`` 以下の範囲が重なるか"
+    return ((since_id is None or max_id > since_id)
+            and (until_id is None or min_id <= until_id))
+
+
+class ReplaySource:
+    """``TimelineArchive`` に保存したページを読み込むクラス
+
+    索引を使ってツイートIDの範囲が重なるセグメントとページだけを読み込むため、
+    アーカイブ全体を走査せずに範囲を指定して再処理できる
+
+    Examples
+    --------
+    >>> source = ReplaySource("archive")
+    >>> for page in source.pages("home_timeline", since_id=since_id):
+    ...     records = extract_photo_records(page)
+    """
+    def __init__(self, directory):
+        """
+        Parameters
+        ----------
+        directory : str
+            ``TimelineArchive`` が保存したディレクトリのパス
+        """
+        self.directory = directory
+        self.refresh()
+
+    def refresh(self):
+        "索引を読み込み直す"
+        self._segments = _read_json(
+            os.path.join(self.directory, TimelineArchive._index_name), [])
+
+    def _read_pages(self, segment, since_id, max_id, name):
+        path = os.path.join(self.directory, segment["pages_name"])
+        pages = _read_json(path, [])
+        with open(os.path.join(self.directory, segment["name"]), "rb") as f:
+            for offset, length, min_id, page_max_id, page_name in pages:
+                if name is not None and page_name != name:
+                    continue
+                if not _overlaps(min_id, page_max_id, since_id, max_id):
+                    continue
+                f.seek(offset)
+                record = json.loads(gzip.decompress(f.read(length)))
+                yield page_name, record["tweets"]
+
+    def pages(self, name=None, since_id=None, max_id=None):
+        """保存した順にページを返す
+
+        Parameters
+        ----------
+        name : str, default None
+            タイムラインの名前。指定しなければ全てのタイムライン
+        since_id : int, default None
+            この値を超えるIDのツイートだけを返す
+        max_id : int, default None
+            この値以下のIDのツイートだけを返す
+
+        Yields
+        ------
+        ReplayPage
+            APIの生のJSONの辞書を格納したページ。範囲外のツイートは取り除かれる
+        """
+        for segment in self._segments:
+            if segment["min_id"] is None or not _overlaps(
+                    segment["min_id"], segment["max_id"], since_id, max_id):
+                continue
+            for _, tweets in self._read_pages(segment, since_id, max_id,
+                                              name):
+                page = ReplayPage(
+                    tweet for tweet in tweets
+                    if (since_id is None or tweet["id"] > since_id)
+                    and (max_id is None or tweet["id"] <= max_id))
+                if page:
+                    yield page
+
+    def tweets(self, name=None, since_id=None, max_id=None):
+        """保存した順にツイートを返す
+
+        Yields
+        ------
+        dict
+            APIの生のJSONの辞書。引数は ``pages`` と同じ
+        """
+        for page in self.pages(name=name, since_id=since_id, max_id=max_id):
+            yield from page
+
+
+class ReplayAPI:
+    """``ReplaySource`` を ``tweepy.API`` の代わりに使うためのクラス
+
+    属性として参照したタイムラインの名前のツイートを保存したページから集め、
+    ``count`` 、 ``since_id`` 、 ``max_id`` を受け取るメソッドとして返す。
+    ``Timeline`` に渡すと、ネットワークを使わずに負荷試験や再処理ができる。
+    HTTPのレスポンスはないため、 ``last_response`` は常に ``None``
+
+    Examples
+    --------
+    >>> api = ReplayAPI(ReplaySource("archive"))
+    >>> timeline = Timeline(api, storage)
+    >>> tweets = timeline.home_timeline(count=200)
+    """
+    def __init__(self, source, parse=None):
+        """
+        Parameters
+        ----------
+        source : ReplaySource
+            ページを読み込むソース
+        parse : callable, default None
+            APIの生のJSONの辞書をツイートオブジェクトに変換する関数。
+            指定しなければ辞書のまま返す
+        """
+        self.source = source
+        self.parse = parse
+        self.last_response = None
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+    def _timeline(self, name):
+        "``name`` の全てのツイートをIDの昇順に並べる"
+        with self._lock:
+            if name not in self._timelines:
+                tweets = {tweet["id"]: tweet
+                          for tweet in self.source.tweets(name=name)}
+                ids = sorted(tweets)
+                self._timelines[name] = (ids, [tweets[id] for id in ids])
+            return self._timelines[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def endpoint(count=20, since_id=None, max_id=None, **params):
+            ids, tweets = self._timeline(name)
+            start = 0 if since_id is None else bisect.bisect_right(ids,
+                                                                   since_id)
+            stop = (len(ids) if max_id is None
+                    else bisect.bisect_right(ids, max_id))
+            selected = tweets[max(start, stop - count):stop][::-1]
+            if self.parse is not None:
+                selected = [self.parse(tweet) for tweet in selected]
+            return ReplayPage(selected)
+        return endpoint
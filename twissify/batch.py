@@ -0,0 +1,204 @@
+import numpy as np
+
+from twissify.api import (_field, extract_photo_urls, is_myretweeted,
+                          is_photo, is_protected, is_retweet)
+
+
+class TweetBatch:
+    """ツイートの判定に必要な情報だけを列ごとのNumPy配列で保持するクラス
+
+    ツイートオブジェクトを保持しないため、大量のツイートを少ないメモリで保持でき、
+    フィルターは真偽値配列による一括の操作になる
+
+    Attributes
+    ----------
+    ids : numpy.ndarray of int64
+        ツイートID
+    retweet : numpy.ndarray of bool
+        リツイートかどうか
+    protected : numpy.ndarray of bool
+        非公開ツイートかどうか
+    retweeted : numpy.ndarray of bool
+        自身がリツイート済みかどうか
+    photo : numpy.ndarray of bool
+        画像ツイートかどうか
+    url_offsets : numpy.ndarray of int64
+        ``i`` 番目のツイートの画像urlが ``urls[url_offsets[i]:url_offsets[i+1]]``
+        となる長さ ``len(ids) + 1`` の配列
+    urls : numpy.ndarray of object
+        全てのツイートの画像urlを連結した配列
+    """
+    _columns = ("ids", "retweet", "protected", "retweeted", "photo")
+
+    def __init__(self, ids, retweet, protected, retweeted, photo, url_offsets,
+                 urls):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.retweet = np.asarray(retweet, dtype=bool)
+        self.protected = np.asarray(protected, dtype=bool)
+        self.retweeted = np.asarray(retweeted, dtype=bool)
+        self.photo = np.asarray(photo, dtype=bool)
+        self.url_offsets = np.asarray(url_offsets, dtype=np.int64)
+        self.urls = np.empty(len(urls), dtype=object)
+        self.urls[:] = urls
+
+        if len(self.url_offsets) != len(self.ids) + 1:
+            raise ValueError("`url_offsets` must have len(ids) + 1 elements.")
+        for name in self._columns[1:]:
+            if len(getattr(self, name)) != len(self.ids):
+                raise ValueError(("`{name}` must have the same length as "
+                                  "`ids`.").format(name=name))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return ("{cls}(size={size}, photos={photos})"
+                .format(cls=self.__class__.__name__, size=len(self),
+                        photos=int(self.photo.sum())))
+
+    @property
+    def nbytes(self):
+        "配列が使用しているバイト数。 ``urls`` は文字列の大きさを含まない"
+        return sum(getattr(self, name).nbytes
+                   for name in self._columns + ("url_offsets", "urls"))
+
+    @classmethod
+    def from_statuses(cls, tweets):
+        """ツイートオブジェクトから作成する
+
+        Parameters
+        ----------
+        tweets : tweepy.models.ResultSet or iterable of tweepy.models.Status
+            ツイートオブジェクトを格納したイテラブル
+
+        Returns
+        -------
+        TweetBatch
+        """
+        return cls._from_tweets(tweets)
+
+    @classmethod
+    def from_json(cls, tweets):
+        """Twitter APIが返すJSONを変換した辞書から作成する
+
+        Parameters
+        ----------
+        tweets : iterable of dict
+            ツイートのJSONを変換した辞書を格納したイテラブル
+
+        Returns
+        -------
+        TweetBatch
+        """
+        return cls._from_tweets(tweets)
+
+    @classmethod
+    def _from_tweets(cls, tweets):
+        "``twissify.api`` の判定関数を使い、ツイートオブジェクトと辞書の両方から作成する"
+        columns = ([], [], [], [], [])
+        url_offsets = [0]
+        urls = []
+        for tweet in tweets:
+            photo = is_photo(tweet)
+            for column, value in zip(columns,
+                                     (_field(tweet, "id"), is_retweet(tweet),
+                                      is_protected(tweet),
+                                      is_myretweeted(tweet), photo)):
+                column.append(value)
+            if photo:
+                urls.extend(extract_photo_urls(tweet))
+            url_offsets.append(len(urls))
+        return cls(*columns, url_offsets=url_offsets, urls=urls)
+
+    @classmethod
+    def concatenate(cls, batches):
+        """複数の ``TweetBatch`` を連結する
+
+        Parameters
+        ----------
+        batches : iterable of TweetBatch
+
+        Returns
+        -------
+        TweetBatch
+        """
+        batches = list(batches)
+        if not batches:
+            return cls([], [], [], [], [], [0], [])
+        columns = [np.concatenate([getattr(batch, name) for batch in batches])
+                   for name in cls._columns]
+        starts = np.cumsum([0] + [len(batch.urls) for batch in batches[:-1]])
+        url_offsets = np.concatenate(
+            [[0]] + [batch.url_offsets[1:] + start
+                     for batch, start in zip(batches, starts)])
+        urls = np.concatenate([batch.urls for batch in batches])
+        return cls(*columns, url_offsets=url_offsets, urls=urls)
+
+    def select(self, mask):
+        """真偽値配列が ``True`` となるツイートだけを取り出す
+
+        Parameters
+        ----------
+        mask : numpy.ndarray of bool
+            長さ ``len(self)`` の真偽値配列
+
+        Returns
+        -------
+        TweetBatch
+        """
+        mask = np.asarray(mask, dtype=bool)
+        counts = np.diff(self.url_offsets)[mask]
+        url_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=url_offsets[1:])
+        starts = self.url_offsets[:-1][mask]
+        index = (np.repeat(starts - url_offsets[:-1], counts)
+                 + np.arange(url_offsets[-1]))
+        columns = [getattr(self, name)[mask] for name in self._columns]
+        return self.__class__(*columns, url_offsets=url_offsets,
+                              urls=self.urls[index])
+
+    def filter_myretweeted_tweets(self):
+        "自身がリツイート済みのツイートを取り除く"
+        return self.select(~self.retweeted)
+
+    def filter_retweets(self):
+        "リツイートを取り除く"
+        return self.select(~self.retweet)
+
+    def filter_protected_tweets(self):
+        "非公開ツイートを取り除く"
+        return self.select(~self.protected)
+
+    def extract_photo_tweets(self):
+        "画像のツイートを取り出す"
+        return self.select(self.photo)
+
+    def extract_tweet_ids(self):
+        """ツイートIDを取り出す
+
+        Returns
+        -------
+        numpy.ndarray of int64
+            ツイートIDの配列。コピーではなく ``ids`` そのもの
+        """
+        return self.ids
+
+    def extract_photo_urls(self, i):
+        """``i`` 番目のツイートに含まれる画像のurlを取り出す
+
+        Returns
+        -------
+        list of str
+            最大4つの画像urlを格納したリスト
+        """
+        return list(self.urls[self.url_offsets[i]:self.url_offsets[i + 1]])
+
+    def extract_photos_urls(self):
+        """それぞれの画像ツイートに含まれる画像のurlを取り出す
+
+        Returns
+        -------
+        list of list of str
+            画像urlを格納したリストを格納したリスト
+        """
+        return [self.extract_photo_urls(i) for i in np.flatnonzero(self.photo)]
@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+
+
+class BloomFilter:
+    """整数のIDを対象としたBloomフィルター
+
+    偽陽性はあるが偽陰性はないため、 ``False`` と判定されたIDは確実に追加されていない。
+    ハッシュ値の計算はNumPyでまとめて行う
+
+    Attributes
+    ----------
+    size : int
+        ビット配列の長さ
+    n_hashes : int
+        1つのIDあたりに使うハッシュ関数の数
+    """
+    _mask = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Parameters
+        ----------
+        capacity : int
+            追加するIDの想定数
+        error_rate : float, default 0.01
+            ``capacity`` 個のIDを追加したときの偽陽性率
+        """
+        if capacity <= 0:
+            raise ValueError("`capacity` must be positive.")
+        if not 0 < error_rate < 1:
+            raise ValueError("`error_rate` must be between 0 and 1.")
+
+        size = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(int(math.ceil(size)), 8)
+        self.n_hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _mix(values, seed):
+        "splitmix64によるハッシュ値"
+        with np.errstate(over="ignore"):
+            z = values + np.uint64(seed)
+            z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            return z ^ (z >> np.uint64(31))
+
+    def _positions(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).astype(np.uint64).reshape(-1)
+        h1 = self._mix(ids, 0x9E3779B97F4A7C15)
+        h2 = self._mix(ids, 0x632BE59BD9B4E019) | np.uint64(1)
+        i = np.arange(self.n_hashes, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            hashes = h1[:, None] + i[None, :] * h2[:, None]
+        return (hashes % np.uint64(self.size)).astype(np.int64)
+
+    def add_many(self, ids):
+        """IDをまとめて追加する
+
+        Parameters
+        ----------
+        ids : array-like of int
+            ツイートIDなどの整数
+        """
+        positions = self._positions(ids).reshape(-1)
+        np.bitwise_or.at(self._bits, positions >> 3,
+                         (1 << (positions & 7)).astype(np.uint8))
+        self.count += len(positions) // self.n_hashes
+
+    def add(self, id):
+        "IDを追加する"
+        self.add_many([id])
+
+    def contains_many(self, ids):
+        """IDが追加されている可能性があるかをまとめて確認する
+
+        Parameters
+        ----------
+        ids : array-like of int
+            ツイートIDなどの整数
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            追加されている可能性があるかどうかの真偽値配列
+        """
+        positions = self._positions(ids)
+        bits = (self._bits[positions >> 3] >> (positions & 7)) & 1
+        return bits.all(axis=1)
+
+    def __contains__(self, id):
+        return bool(self.contains_many([id])[0])
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class ImageCache:
+    """画像のバイナリデータをディスク上に保存するLRUキャッシュ
+
+    バイナリデータは内容のハッシュ値をファイル名として保存されるため、
+    同じ画像を指す複数のurlはディスク上で1つのファイルを共有する。
+    エントリの一覧(索引)は変更のたびではなく、前回の書き出しから
+    ``save_interval`` 秒が経過した後に変更したとき、 ``save`` を呼び出したとき、
+    または ``close`` したときに書き出す。書き出す前に異常終了したときは
+    索引にないバイナリデータを次に開いたときに削除する
+
+    Attributes
+    ----------
+    hits : int
+        キャッシュから返した回数
+    misses : int
+        ネットワークから取得した回数
+    revalidations : int
+        条件付きリクエストで変更がないことを確認した回数
+    """
+    _index_name = "index.json"
+    _objects_name = "objects"
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_age=None,
+                 save_interval=60):
+        """
+        Parameters
+        ----------
+        directory : str
+            キャッシュを保存するディレクトリのパス
+        max_bytes : int, default 256MiB
+            保存するバイナリデータの合計の上限バイト数
+        max_age : float, default None
+            エントリを再検証せずに使う秒数。 ``None`` なら再検証しない
+        save_interval : float, default 60
+            索引を書き出す間隔の秒数。 ``None`` なら ``save`` と ``close`` でだけ書き出す
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._refcounts = {}
+        self._sizes = {}
+        self._total_bytes = 0
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(directory, self._objects_name), exist_ok=True)
+        self._load_index()
+        self._remove_orphans()
+
+    @property
+    def total_bytes(self):
+        "保存しているバイナリデータの合計バイト数"
+        return self._total_bytes
+
+    @property
+    def hit_rate(self):
+        "キャッシュから返した割合。一度も参照されていなければ ``0.0``"
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    def digest(self, url):
+        """``url`` に対応するバイナリデータのハッシュ値を返す
+
+        Returns
+        -------
+        str or None
+            SHA-256の16進数文字列。保存されていなければ ``None``
+        """
+        entry = self._entries.get(url)
+        return None if entry is None else entry["digest"]
+
+    def get(self, url):
+        """``url`` に対応するバイナリデータを返す
+
+        ファイルはロックの外で読むため、複数のスレッドから同時に読み込める
+
+        Returns
+        -------
+        bytes or None
+            保存されているバイナリデータ。保存されていなければ ``None``
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            self._entries.move_to_end(url)
+            digest = entry["digest"]
+        try:
+            with open(self._object_path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # 読み込む前に他のスレッドが削除したときは、そのエントリを取り除く
+            with self._lock:
+                entry = self._entries.get(url)
+                if entry is not None and entry["digest"] == digest:
+                    self._remove(url)
+                    self._changed()
+            return None
+
+    def put(self, url, content, etag=None, last_modified=None):
+        """``url`` に対応するバイナリデータを保存する
+
+        保存後に合計バイト数が ``max_bytes`` を超えたときは、
+        最も長く参照されていないエントリから順に削除する
+
+        Parameters
+        ----------
+        url : str
+            画像urlの文字列
+        content : bytes
+            画像のバイナリデータ
+        etag : str, default None
+            レスポンスの ``ETag`` ヘッダーの値
+        last_modified : str, default None
+            レスポンスの ``Last-Modified`` ヘッダーの値
+        """
+        if len(content) > self.max_bytes:
+            return
+
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if url in self._entries:
+                self._remove(url)
+            if digest not in self._sizes:
+                self._write_object(digest, content)
+                self._sizes[digest] = len(content)
+                self._total_bytes += len(content)
+            self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+            self._entries[url] = {"digest": digest, "etag": etag,
+                                  "last_modified": last_modified,
+                                  "checked_at": time.time()}
+            while self.total_bytes > self.max_bytes:
+                oldest_url = next(iter(self._entries))
+                self._remove(oldest_url)
+            self._changed()
+
+    def fetch(self, url, session=None, timeout=None):
+        """``url`` のバイナリデータをキャッシュ、またはネットワークから得る
+
+        鮮度の切れたエントリは ``ETag`` と ``Last-Modified`` を使った
+        条件付きリクエストで再検証する
+
+        Parameters
+        ----------
+        url : str
+            画像urlの文字列
+        session : requests.Session, default None
+            通信に使うセッション。指定しなければ ``requests.get`` を使う
+        timeout : float or tuple of float, default None
+            ``requests`` に渡すタイムアウトの秒数
+
+        Returns
+        -------
+        tuple of bytes and int
+            バイナリデータ(または ``None`` )とHTTPステータスコードのタプル。
+            キャッシュから返したときのステータスコードは ``200``
+        """
+        entry = self._entries.get(url)
+        if entry is not None and self._is_fresh(entry):
+            content = self.get(url)
+            if content is not None:
+                self._count(hit=True)
+                return content, 200
+
+        requester = session
+        if requester is None:
+            import requests
+            requester = requests
+        headers = self._conditional_headers(entry)
+        if headers:
+            response = requester.get(url, headers=headers, timeout=timeout)
+        else:
+            response = requester.get(url, timeout=timeout)
+
+        if response.status_code == 304:
+            content = self._revalidate(url, entry)
+            if content is not None:
+                return content, 200
+            response = requester.get(url, timeout=timeout)
+
+        self._count(hit=False)
+        if response.status_code != 200:
+            return None, response.status_code
+
+        content = response.content
+        self.put(url, content, etag=response.headers.get("ETag"),
+                 last_modified=response.headers.get("Last-Modified"))
+        return content, response.status_code
+
+    def save(self):
+        "参照順を含むエントリの一覧をディスクに書き出す"
+        with self._lock:
+            self._save_index()
+
+    def close(self):
+        "書き出していない変更があれば索引を書き出す"
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def _conditional_headers(self, entry):
+        "鮮度の切れたエントリを再検証するための条件付きリクエストのヘッダー"
+        headers = {}
+        if entry is None or self._is_fresh(entry):
+            return headers
+        if entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _revalidate(self, url, entry):
+        """変更がないと確認できたエントリの確認時刻を更新して内容を返す
+
+        再起動後も再検証をやり直さないように、確認時刻は索引に書き出す
+        """
+        content = self.get(url)
+        if content is None:
+            return None
+        with self._lock:
+            entry["checked_at"] = time.time()
+            self.revalidations += 1
+            self._changed()
+        self._count(hit=True)
+        return content
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _is_fresh(self, entry):
+        if self.max_age is None:
+            return True
+        return time.time() - entry["checked_at"] < self.max_age
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, self._objects_name, digest)
+
+    def _write_object(self, digest, content):
+        path = self._object_path(digest)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _remove(self, url):
+        digest = self._entries.pop(url)["digest"]
+        self._refcounts[digest] -= 1
+        if self._refcounts[digest] == 0:
+            del self._refcounts[digest]
+            self._total_bytes -= self._sizes.pop(digest)
+            try:
+                os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self):
+        path = os.path.join(self.directory, self._index_name)
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        for url, entry in entries:
+            digest = entry["digest"]
+            if digest not in self._sizes:
+                try:
+                    self._sizes[digest] = os.path.getsize(
+                        self._object_path(digest))
+                except FileNotFoundError:
+                    continue
+                self._total_bytes += self._sizes[digest]
+            self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+            self._entries[url] = entry
+
+    def _remove_orphans(self):
+        "索引を書き出す前に異常終了したときに残ったバイナリデータを削除する"
+        directory = os.path.join(self.directory, self._objects_name)
+        for name in os.listdir(directory):
+            if name not in self._sizes:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _changed(self):
+        "索引が変わったことを記録し、前回の書き出しから ``save_interval`` 秒経っていれば書き出す"
+        self._dirty = True
+        if (self.save_interval is not None
+                and time.monotonic() - self._saved_at >= self.save_interval):
+            self._save_index()
+
+    def _save_index(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp_path, os.path.join(self.directory, self._index_name))
+        self._dirty = False
+        self._saved_at = time.monotonic()
@@ -0,0 +1,190 @@
+import abc
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class Classifier(abc.ABC):
+    """画像をまとめて分類する分類器の基底クラス
+
+    ``predict`` は ``(N, 高さ, 幅, チャンネル数)`` でdtypeが ``uint8`` の配列を受け取り、
+    長さ ``N`` の分類結果を返す
+    """
+    @abc.abstractmethod
+    def predict(self, images):
+        """画像をまとめて分類する
+
+        Parameters
+        ----------
+        images : numpy.ndarray of uint8
+            ``(N, 高さ, 幅, チャンネル数)`` の画像
+
+        Returns
+        -------
+        array-like
+            長さ ``N`` の分類結果
+        """
+
+
+class FunctionClassifier(Classifier):
+    "関数を ``Classifier`` として扱うためのクラス"
+    def __init__(self, function):
+        """
+        Parameters
+        ----------
+        function : callable
+            ``(N, 高さ, 幅, チャンネル数)`` の画像を受け取り、
+            長さ ``N`` の分類結果を返す関数。Kerasのモデルの ``predict`` など
+        """
+        self.function = function
+
+    def predict(self, images):
+        return self.function(images)
+
+
+class MicroBatcher:
+    """複数のスレッドから送られた画像をまとめて分類器に渡すクラス
+
+    画像が ``max_batch_size`` 個集まるか、最初の画像が届いてから
+    ``max_latency_ms`` ミリ秒が経過したら分類器を1回呼び出し、
+    結果をそれぞれの ``Future`` に返す
+
+    Attributes
+    ----------
+    batches : int
+        分類器を呼び出した回数
+    images : int
+        分類した画像の数
+    """
+    _stop = object()
+
+    def __init__(self, classifier, max_batch_size=32, max_latency_ms=10):
+        """
+        Parameters
+        ----------
+        classifier : Classifier
+            分類器
+        max_batch_size : int, default 32
+            1回に分類する画像の最大数
+        max_latency_ms : float, default 10
+            最初の画像が届いてから分類器を呼び出すまでに待つ最大のミリ秒数
+        """
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.batches = 0
+        self.images = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def mean_batch_size(self):
+        "1回あたりに分類した画像の平均数"
+        return self.images / self.batches if self.batches else 0.0
+
+    def submit(self, image):
+        """画像の分類を予約する
+
+        Parameters
+        ----------
+        image : numpy.ndarray of uint8
+            ``(高さ, 幅, チャンネル数)`` の画像。
+            ``open_image_array`` や ``image_to_array`` で作成する
+
+        Returns
+        -------
+        concurrent.futures.Future
+            分類結果を受け取るための ``Future``
+
+        Raises
+        ------
+        RuntimeError
+            ``close`` した後に呼び出したとき
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed.")
+            self._queue.put((np.asarray(image, dtype=np.uint8), future))
+        return future
+
+    def classify(self, image, timeout=None):
+        """画像を分類し、結果が得られるまで待つ
+
+        Returns
+        -------
+        object
+            分類結果
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def close(self):
+        "予約済みの画像を分類してからスレッドを止める"
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(self._stop)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is self._stop:
+                self._queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._stop:
+                return
+            batch = self._collect(item)
+            groups = {}
+            for image, future in batch:
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault(image.shape, []).append((image, future))
+            for items in groups.values():
+                self._predict(items)
+
+    def _predict(self, items):
+        futures = [future for _, future in items]
+        try:
+            results = self.classifier.predict(
+                np.stack([image for image, _ in items]))
+            if len(results) != len(futures):
+                raise ValueError(("`predict` returned {actual} results for "
+                                  "{expected} images.")
+                                 .format(actual=len(results),
+                                         expected=len(futures)))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.images += len(futures)
+        for future, result in zip(futures, results):
+            future.set_result(result)
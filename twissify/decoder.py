@@ -0,0 +1,143 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from twissify.image import open_image_array
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7以前
+    shared_memory = None
+
+
+def _decode_into(name, shape, index, image_binary, mode):
+    "ワーカープロセスで画像をデコードし、共有メモリの ``index`` 番目に書き込む"
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        images = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        images[index] = open_image_array(image_binary, (shape[2], shape[1]),
+                                         mode=mode)
+        del images
+        return True
+    except Exception:
+        return False
+    finally:
+        shm.close()
+
+
+class DecodedBatch:
+    """共有メモリ上にデコードされた画像のバッチ
+
+    ``images`` は共有メモリを直接参照しているため、 ``close`` した後は使えない。
+    ``close`` の後も使うときは ``images.copy()`` でコピーする
+
+    Attributes
+    ----------
+    images : numpy.ndarray of uint8
+        ``(N, 高さ, 幅, 3)`` 、モードが ``"L"`` のときは ``(N, 高さ, 幅)`` の画像
+    ok : numpy.ndarray of bool
+        それぞれの画像をデコードできたかどうか。失敗した画像は0で埋められる
+    """
+    def __init__(self, shm, shape, ok):
+        self._shm = shm
+        self.images = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        self.ok = np.asarray(ok, dtype=bool)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        "共有メモリを解放する"
+        if self._shm is not None:
+            self.images = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+class ProcessDecoder:
+    """複数のプロセスで画像をデコード、縮小するクラス
+
+    ワーカープロセスは結果を ``multiprocessing.shared_memory`` のバッチに直接書き込むため、
+    デコードした配列をpickleして親プロセスに送り返すことはない。
+    デコードはGILに縛られず、CPUのコア数に応じて速くなる
+
+    Notes
+    -----
+    ``multiprocessing.shared_memory`` を使うため、Python 3.8以降が必要
+    """
+    def __init__(self, size, mode="RGB", processes=None):
+        """
+        Parameters
+        ----------
+        size : tuple of int
+            出力する画像の ``(幅, 高さ)``
+        mode : str, default "RGB"
+            出力する画像のモード。 ``"RGB"`` か ``"L"``
+        processes : int, default None
+            ワーカープロセスの数。指定しなければCPUのコア数
+
+        Raises
+        ------
+        RuntimeError
+            ``multiprocessing.shared_memory`` が使えないとき
+        """
+        if shared_memory is None:
+            raise RuntimeError("ProcessDecoder requires Python 3.8 or later.")
+        if mode not in ("RGB", "L"):
+            raise ValueError("`mode` must be 'RGB' or 'L'.")
+        self.size = tuple(size)
+        self.mode = mode
+        self._executor = ProcessPoolExecutor(max_workers=processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _shape(self, n):
+        if self.mode == "L":
+            return (n, self.size[1], self.size[0])
+        return (n, self.size[1], self.size[0], 3)
+
+    def decode(self, image_binaries):
+        """画像のバイナリデータをまとめてデコードする
+
+        Parameters
+        ----------
+        image_binaries : array-like of bytes
+            画像のバイナリデータ
+
+        Returns
+        -------
+        DecodedBatch
+            デコードした画像を共有メモリ上に持つバッチ。使い終わったら ``close`` する
+        """
+        image_binaries = list(image_binaries)
+        shape = self._shape(len(image_binaries))
+        nbytes = max(int(np.prod(shape)), 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        try:
+            futures = [self._executor.submit(_decode_into, shm.name, shape, i,
+                                             image_binary, self.mode)
+                       for i, image_binary in enumerate(image_binaries)]
+            ok = [future.result() for future in futures]
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+        batch = DecodedBatch(shm, shape, ok)
+        batch.images[~batch.ok] = 0
+        return batch
+
+    def close(self):
+        "ワーカープロセスを終了する"
+        self._executor.shutdown()
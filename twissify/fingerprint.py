@@ -0,0 +1,271 @@
+import numpy as np
+from PIL import Image
+
+
+def _grayscale_arrays(images, size):
+    "画像を指定した大きさのグレースケールの配列に変換して重ねる"
+    arrays = []
+    for image in images:
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        image = image.convert("L").resize(size, Image.BILINEAR)
+        arrays.append(np.asarray(image, dtype=np.float64))
+    return np.stack(arrays) if arrays else np.empty((0, size[1], size[0]))
+
+
+def _pack_bits(bits):
+    "(N, ...) の真偽値配列をそれぞれ1つの整数にまとめる"
+    bits = bits.reshape(len(bits), int(np.prod(bits.shape[1:])))
+    if bits.shape[1] > 64:
+        raise ValueError("`hash_size` must be 8 or less.")
+    weights = np.left_shift(np.uint64(1),
+                            np.arange(bits.shape[1] - 1, -1, -1,
+                                      dtype=np.uint64))
+    return (bits.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+
+def _dct_matrix(n):
+    "正規直交なDCT-IIの変換行列"
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def dhash_many(images, hash_size=8):
+    """複数の画像のdHash(差分ハッシュ)をまとめて計算する
+
+    Parameters
+    ----------
+    images : iterable of PIL.Image.Image or numpy.ndarray
+        ``open_image_binary`` が返すImageオブジェクト、
+        または ``open_image_array`` が返す配列
+    hash_size : int, default 8
+        ハッシュの1辺の長さ。ハッシュは ``hash_size ** 2`` ビットになる
+
+    Returns
+    -------
+    numpy.ndarray of uint64
+        それぞれの画像のハッシュ値
+    """
+    pixels = _grayscale_arrays(images, (hash_size + 1, hash_size))
+    return _pack_bits(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+
+def phash_many(images, hash_size=8, highfreq_factor=4):
+    """複数の画像のpHash(知覚ハッシュ)をまとめて計算する
+
+    縮小したグレースケール画像の離散コサイン変換の低周波成分が
+    その中央値より大きいかどうかをビットにする
+
+    Parameters
+    ----------
+    images : iterable of PIL.Image.Image or numpy.ndarray
+        ``open_image_binary`` が返すImageオブジェクト、
+        または ``open_image_array`` が返す配列
+    hash_size : int, default 8
+        ハッシュの1辺の長さ。ハッシュは ``hash_size ** 2`` ビットになる
+    highfreq_factor : int, default 4
+        離散コサイン変換をする画像の1辺の長さの ``hash_size`` に対する倍率
+
+    Returns
+    -------
+    numpy.ndarray of uint64
+        それぞれの画像のハッシュ値
+    """
+    size = hash_size * highfreq_factor
+    pixels = _grayscale_arrays(images, (size, size))
+    dct = _dct_matrix(size)
+    coefficients = np.einsum("ij,njk,lk->nil", dct, pixels, dct)
+    low = coefficients[:, :hash_size, :hash_size]
+    medians = np.median(low.reshape(len(low), hash_size ** 2), axis=1)
+    return _pack_bits(low > medians[:, None, None])
+
+
+def dhash(image, hash_size=8):
+    """画像のdHash(差分ハッシュ)を計算する
+
+    Parameters
+    ----------
+    image : PIL.Image.Image or numpy.ndarray
+        ``open_image_binary`` が返すImageオブジェクト、
+        または ``open_image_array`` が返す配列
+    hash_size : int, default 8
+        ハッシュの1辺の長さ
+
+    Returns
+    -------
+    int
+        ハッシュ値
+    """
+    return int(dhash_many([image], hash_size=hash_size)[0])
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """画像のpHash(知覚ハッシュ)を計算する
+
+    Parameters
+    ----------
+    image : PIL.Image.Image or numpy.ndarray
+        ``open_image_binary`` が返すImageオブジェクト、
+        または ``open_image_array`` が返す配列
+    hash_size : int, default 8
+        ハッシュの1辺の長さ
+    highfreq_factor : int, default 4
+        離散コサイン変換をする画像の1辺の長さの ``hash_size`` に対する倍率
+
+    Returns
+    -------
+    int
+        ハッシュ値
+    """
+    return int(phash_many([image], hash_size=hash_size,
+                          highfreq_factor=highfreq_factor)[0])
+
+
+def hamming_distance(a, b):
+    "2つのハッシュ値の異なるビットの数を返す"
+    return bin(int(a) ^ int(b)).count("1")
+
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hash, hashes):
+    """1つのハッシュ値と複数のハッシュ値とのハミング距離をまとめて計算する
+
+    Parameters
+    ----------
+    hash : int
+        ハッシュ値
+    hashes : numpy.ndarray of uint64
+        ハッシュ値の配列
+
+    Returns
+    -------
+    numpy.ndarray of int
+        それぞれのハミング距離
+    """
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(hash))
+    counts = _POPCOUNT8[xor.view(np.uint8)].reshape(len(xor), 8)
+    return counts.sum(axis=1, dtype=np.int64)
+
+
+class HashIndex:
+    """ハミング距離で近いハッシュ値を検索するためのインデックス
+
+    ハッシュ値を ``max_distance + 1`` 個の部分に分割し、部分ごとに辞書を作る
+    (Multi-Index Hashing)。ハミング距離が ``max_distance`` 以下のハッシュ値は
+    鳩の巣原理によって少なくとも1つの部分が一致するため、
+    一致した候補だけを距離の計算で確かめればよい
+    """
+    def __init__(self, max_distance=4, bits=64):
+        """
+        Parameters
+        ----------
+        max_distance : int, default 4
+            検索できるハミング距離の最大値
+        bits : int, default 64
+            ハッシュ値のビット数
+        """
+        if not 0 <= max_distance < bits:
+            raise ValueError("`max_distance` must be between 0 and bits - 1.")
+
+        self.max_distance = max_distance
+        self.bits = bits
+        n_chunks = max_distance + 1
+        bounds = np.linspace(0, bits, n_chunks + 1).astype(int)
+        self._chunks = [(int(start), (1 << int(end - start)) - 1)
+                        for start, end in zip(bounds[:-1], bounds[1:])]
+        self._tables = [{} for _ in self._chunks]
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._values = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def _keys(self, hash):
+        return [(hash >> start) & mask for start, mask in self._chunks]
+
+    def add(self, hash, value=None):
+        """ハッシュ値を追加する
+
+        Parameters
+        ----------
+        hash : int
+            ハッシュ値
+        value : object, default None
+            ハッシュ値に対応付ける分類結果などの値
+        """
+        hash = int(hash)
+        position = len(self._values)
+        if position == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes,
+                                           np.empty_like(self._hashes)])
+        self._hashes[position] = hash
+        self._values.append(value)
+        for table, key in zip(self._tables, self._keys(hash)):
+            table.setdefault(key, []).append(position)
+
+    def _candidates(self, hash):
+        "部分が一致するハッシュ値の位置と距離を返す"
+        positions = set()
+        for table, key in zip(self._tables, self._keys(hash)):
+            positions.update(table.get(key, ()))
+        positions = np.fromiter(positions, dtype=np.int64,
+                                count=len(positions))
+        return positions, hamming_distances(hash, self._hashes[positions])
+
+    def _check_distance(self, k):
+        if k is None:
+            return self.max_distance
+        if k > self.max_distance:
+            raise ValueError("`k` must be less than or equal to "
+                             "`max_distance`.")
+        return k
+
+    def search(self, hash, k=None):
+        """ハミング距離が ``k`` 以下のハッシュ値を返す
+
+        Parameters
+        ----------
+        hash : int
+            検索するハッシュ値
+        k : int, default None
+            ハミング距離の最大値。指定しなければ ``max_distance``
+
+        Returns
+        -------
+        list of tuple of int, int and object
+            距離の近い順に並んだ、距離、ハッシュ値、対応付けた値のタプルのリスト
+        """
+        k = self._check_distance(k)
+        positions, distances = self._candidates(int(hash))
+        matched = distances <= k
+        positions, distances = positions[matched], distances[matched]
+        order = np.argsort(distances, kind="stable")
+        return [(int(distances[i]), int(self._hashes[positions[i]]),
+                 self._values[positions[i]]) for i in order]
+
+    def nearest(self, hash, k=None):
+        """ハミング距離が ``k`` 以下で最も近いハッシュ値を1つ返す
+
+        Returns
+        -------
+        tuple of int, int and object or None
+            距離、ハッシュ値、対応付けた値のタプル。見つからなければ ``None``
+        """
+        results = self.search(hash, k=k)
+        return results[0] if results else None
+
+    def contains(self, hash, k=None):
+        """ハミング距離が ``k`` 以下のハッシュ値が追加されているかを確認する
+
+        Returns
+        -------
+        bool
+        """
+        k = self._check_distance(k)
+        _, distances = self._candidates(int(hash))
+        return bool((distances <= k).any())
@@ -1,9 +1,57 @@
 import io
-import requests
-from PIL import Image
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+from twissify import metrics
 
-def load_image_url(image_url):
+# requests、PillowとNumPyは読み込みに時間がかかるため、
+# それぞれの関数を最初に呼び出したときに読み込む
+
+
+ImageInfo = namedtuple("ImageInfo", ["format", "size", "mode",
+                                     "content_length"])
+ImageInfo.__doc__ = """画像のヘッダーから読み取った情報
+
+Attributes
+----------
+format : str
+    ``"JPEG"`` や ``"PNG"`` などの画像の形式
+size : tuple of int
+    画像の ``(幅, 高さ)``
+mode : str
+    ``"RGB"`` や ``"L"`` などの画像のモード
+content_length : int or None
+    画像全体のバイト数。サーバーが返さなかったときは ``None``
+"""
+
+
+def create_session(pool_maxsize=10):
+    """画像を取得するためのkeep-aliveなセッションを作成する
+
+    Parameters
+    ----------
+    pool_maxsize : int, default 10
+        ホストごとに保持するコネクションの最大数
+
+    Returns
+    -------
+    requests.Session
+        コネクションプールを持つセッション
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_maxsize,
+                          pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@metrics.instrument("load_image_url")
+def load_image_url(image_url, session=None, timeout=None, cache=None,
+                   stream=False, accept=None, chunk_size=65536, draft=None):
     """画像urlからImageオブジェクトとHTTPステータスコードを得る
 
     画像urlに正常にアクセスできたときはImageオブジェクトとHTTPステータスコードを得る
@@ -13,6 +61,24 @@ def load_image_url(image_url):
     ----------
     image_url : str
         画像urlの文字列
+    session : requests.Session, default None
+        通信に使うセッション。指定しなければ ``requests.get`` を使う
+    timeout : float or tuple of float, default None
+        ``requests`` に渡すタイムアウトの秒数
+    cache : twissify.cache.ImageCache, default None
+        画像のバイナリデータのキャッシュ。指定すると保存済みのurlは通信せずに読み込む
+    stream : bool, default False
+        チャンクごとに受信するかどうか。ヘッダーを読んだ時点で ``accept`` を確かめ、
+        受け入れた画像だけ残りを1つのバッファに受信してデコードする。
+        ``cache`` を指定したときは無視する
+    accept : callable, default None
+        ``ImageInfo`` を受け取り、読み込みを続けるかを返す関数。
+        ``False`` を返したときは残りのデータを受信せずに ``None`` を返す
+    chunk_size : int, default 65536
+        ``stream=True`` のときに1度に受信するバイト数
+    draft : tuple of str and tuple of int, default None
+        ``(mode, (幅, 高さ))`` 。指定するとJPEGは ``PIL.Image.Image.draft`` によって
+        この大きさ以上の範囲で縮小しながらデコードする
 
     Returns
     -------
@@ -24,13 +90,280 @@ def load_image_url(image_url):
     urlが存在しないときは ``ConnectionError`` が呼ばれる
     また、画像url以外のurlでは ``UnidentifiedImageError`` が呼ばれる
     """
+    import requests
+
     image = None
-    response = requests.get(image_url)
+    if cache is not None:
+        content, status_code = cache.fetch(image_url, session=session,
+                                           timeout=timeout)
+        if content is not None:
+            image = _open_draft(content, draft)
+            if accept is not None and not accept(
+                    ImageInfo(image.format, image.size, image.mode,
+                              len(content))):
+                image = None
+        return image, status_code
+
+    requester = requests if session is None else session
+    if stream:
+        response = requester.get(image_url, timeout=timeout, stream=True)
+        try:
+            if response.status_code == 200:
+                image = _stream_image(response, accept, chunk_size, draft)
+        finally:
+            response.close()
+        return image, response.status_code
+
+    response = requester.get(image_url, timeout=timeout)
+    metrics.add("load_image_url_bytes_total", len(response.content))
     if response.status_code == 200:
-        image = open_image_binary(response.content)
+        image = _open_draft(response.content, draft)
+        if accept is not None and not accept(
+                ImageInfo(image.format, image.size, image.mode,
+                          len(response.content))):
+            image = None
     return image, response.status_code
 
 
+def _open_draft(image_binary, draft):
+    "画像のバイナリデータを開き、 ``draft`` を指定したときは縮小してデコードさせる"
+    image = open_image_binary(image_binary)
+    if draft is not None:
+        image.draft(*draft)
+    return image
+
+
+def _stream_image(response, accept, chunk_size, draft):
+    """レスポンスのヘッダーを読んで ``accept`` が拒否したら中断し、
+    受け入れたときは残りを受信してから1度だけデコードする
+
+    ``PIL.ImageFile.Parser`` はJPEGを逐次デコードできず、与えたチャンクを
+    連結し続けるため、ヘッダーを読むまでしか使わない
+    """
+    from PIL import Image, ImageFile, UnidentifiedImageError
+
+    buffer = io.BytesIO()
+    chunks = iter(metrics.count_bytes(
+        "load_image_url", response.iter_content(chunk_size=chunk_size)))
+    header = _parse_header(ImageFile.Parser(), _write_chunks(chunks, buffer))
+    if header is None:
+        raise UnidentifiedImageError(
+            "cannot identify image file from {url}".format(url=response.url))
+    if accept is not None and not accept(
+            ImageInfo(header.format, header.size, header.mode,
+                      _content_length(response))):
+        return None
+
+    for chunk in chunks:
+        buffer.write(chunk)
+    buffer.seek(0)
+    try:
+        image = Image.open(buffer)
+        if draft is not None:
+            image.draft(*draft)
+        image.load()
+        return image
+    except OSError as e:
+        raise UnidentifiedImageError(
+            "cannot decode image file from {url}".format(url=response.url)
+        ) from e
+
+
+def header_filter(min_size=(100, 100), max_size=None, max_aspect_ratio=4.0,
+                  modes=None):
+    """画像のヘッダーの情報から掲示板の画像になりえないものを拒否する関数を作成する
+
+    ``load_image_url`` の ``accept`` に渡すと、条件を満たさない画像は
+    ヘッダーを読んだ時点で受信を打ち切る
+
+    Parameters
+    ----------
+    min_size : tuple of int, default (100, 100)
+        画像の ``(幅, 高さ)`` の最小値
+    max_size : tuple of int, default None
+        画像の ``(幅, 高さ)`` の最大値。指定しなければ上限なし
+    max_aspect_ratio : float, default 4.0
+        長辺と短辺の比の最大値。指定しなければ上限なし
+    modes : container of str, default None
+        受け入れる画像のモード。指定しなければ全てのモード
+
+    Returns
+    -------
+    callable
+        ``ImageInfo`` を受け取り、受け入れるかどうかの真偽値を返す関数
+    """
+    def accept(info):
+        width, height = info.size
+        if width < min_size[0] or height < min_size[1]:
+            return False
+        if max_size is not None and (width > max_size[0]
+                                     or height > max_size[1]):
+            return False
+        long_side, short_side = max(width, height), min(width, height)
+        if (max_aspect_ratio is not None
+                and long_side > max_aspect_ratio * short_side):
+            return False
+        return modes is None or info.mode in modes
+    return accept
+
+
+def _parse_header(parser, chunks, max_bytes=None):
+    """画像のヘッダーを読めるまでチャンクを ``parser`` に与える
+
+    Parameters
+    ----------
+    parser : PIL.ImageFile.Parser
+        チャンクを与えるパーサー
+    chunks : iterator of bytes
+        画像のバイナリデータのチャンク。ヘッダーを読めた時点で残りは消費しない
+    max_bytes : int, default None
+        与えるバイト数の上限
+
+    Returns
+    -------
+    PIL.Image.Image or None
+        ヘッダーを読み込んだImageオブジェクト。読めなかったときは ``None``
+    """
+    n_bytes = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.image is not None:
+            return parser.image
+        n_bytes += len(chunk)
+        if max_bytes is not None and n_bytes >= max_bytes:
+            break
+    return None
+
+
+def _write_chunks(chunks, buffer):
+    "``chunks`` を ``buffer`` に書き込みながら返す"
+    for chunk in chunks:
+        buffer.write(chunk)
+        yield chunk
+
+
+def _content_length(response):
+    "レスポンスのヘッダーから画像全体のバイト数を得る"
+    content_range = response.headers.get("Content-Range", "")
+    total = content_range.rpartition("/")[2]
+    if total.isdigit():
+        return int(total)
+    if response.status_code == 200:
+        content_length = response.headers.get("Content-Length", "")
+        if content_length.isdigit():
+            return int(content_length)
+    return None
+
+
+def probe_image_url(image_url, session=None, timeout=None, max_bytes=16384):
+    """画像urlの先頭だけを取得して画像の形式と大きさを得る
+
+    Rangeリクエストで先頭の ``max_bytes`` バイトだけを要求するため、
+    画像全体をダウンロードする前に必要な大きさかどうかを確かめられる
+
+    Parameters
+    ----------
+    image_url : str
+        画像urlの文字列
+    session : requests.Session, default None
+        通信に使うセッション。指定しなければ ``requests.get`` を使う
+    timeout : float or tuple of float, default None
+        ``requests`` に渡すタイムアウトの秒数
+    max_bytes : int, default 16384
+        読み込むバイト数の上限
+
+    Returns
+    -------
+    tuple of ImageInfo and int
+        画像の情報(または ``None`` )とHTTPステータスコードのタプル。
+        ``max_bytes`` 以内にヘッダーを読めなかったときも画像の情報は ``None``
+    """
+    import requests
+    from PIL import ImageFile
+
+    requester = requests if session is None else session
+    headers = {"Range": "bytes=0-{end}".format(end=max_bytes - 1)}
+    response = requester.get(image_url, headers=headers, timeout=timeout,
+                             stream=True)
+    try:
+        if response.status_code not in (200, 206):
+            return None, response.status_code
+        image = _parse_header(ImageFile.Parser(),
+                              response.iter_content(chunk_size=4096),
+                              max_bytes=max_bytes)
+    finally:
+        response.close()
+
+    if image is None:
+        return None, response.status_code
+    info = ImageInfo(image.format, image.size, image.mode,
+                     _content_length(response))
+    return info, response.status_code
+
+
+def load_image_urls(image_urls, max_concurrency=8, timeout=10, session=None,
+                    cache=None, stream=False, accept=None):
+    """複数の画像urlから並行してImageオブジェクトとHTTPステータスコードを得る
+
+    Parameters
+    ----------
+    image_urls : array-like of str
+        画像urlの文字列を格納したリスト風のオブジェクト
+    max_concurrency : int, default 8
+        同時に通信する最大数
+    timeout : float or tuple of float, default 10
+        1つのurlあたりのタイムアウトの秒数
+    session : requests.Session, default None
+        通信に使うセッション。指定しなければ ``max_concurrency`` 分の
+        コネクションプールを持つセッションを作成する
+    cache : twissify.cache.ImageCache, default None
+        画像のバイナリデータのキャッシュ
+    stream : bool, default False
+        受信したチャンクから順にデコードするかどうか
+    accept : callable, default None
+        ``ImageInfo`` を受け取り、読み込みを続けるかを返す関数
+
+    Returns
+    -------
+    list of tuple
+        ``image_urls`` と同じ順番で並んだ、Imageオブジェクト(または ``None`` )と
+        HTTPステータスコード(または発生した例外)のタプルを格納したリスト
+
+    Notes
+    -----
+    通信に失敗したurlや画像として読み込めなかったurlは、他のurlの取得を止めずに
+    ``(None, 発生した例外)`` として返る。 ``requests.RequestException`` は
+    タイムアウトなど再試行すれば取得できる可能性がある失敗、
+    ``UnidentifiedImageError`` はステータスコード200で受信したデータを
+    画像として読み込めなかった失敗を表す
+    """
+    import requests
+    from PIL import UnidentifiedImageError
+
+    image_urls = list(image_urls)
+    if not image_urls:
+        return []
+
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_maxsize=max_concurrency)
+
+    def load(image_url):
+        try:
+            return load_image_url(image_url, session=session, timeout=timeout,
+                                  cache=cache, stream=stream, accept=accept)
+        except (requests.RequestException, UnidentifiedImageError) as e:
+            return None, e
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return list(executor.map(load, image_urls))
+    finally:
+        if own_session:
+            session.close()
+
+
+@metrics.instrument("open_image_binary", nbytes=len)
 def open_image_binary(image_binary):
     """画像のバイナリデータをImageオブジェクトとして得る
 
@@ -44,4 +377,63 @@ def open_image_binary(image_binary):
     a inheritance of PIL.ImageFile.ImageFile
         Imageオブジェクト
     """
+    from PIL import Image
+
     return Image.open(io.BytesIO(image_binary))
+
+
+def open_image_array(image_binary, size, mode="RGB"):
+    """画像のバイナリデータを指定した大きさのNumPy配列として得る
+
+    JPEGは ``PIL.Image.Image.draft`` によって ``size`` 以上の範囲で縮小しながら
+    デコードするため、全画素をデコードしてから縮小するより速く、メモリも少ない
+
+    Parameters
+    ----------
+    image_binary : bytes
+        画像のバイナリデータ
+    size : tuple of int
+        出力する画像の ``(幅, 高さ)``
+    mode : str, default "RGB"
+        出力する画像のモード
+
+    Returns
+    -------
+    numpy.ndarray
+        dtypeが ``uint8`` の配列。形状は ``(高さ, 幅, チャンネル数)`` 、
+        ``"L"`` などの1チャンネルのモードでは ``(高さ, 幅)``
+    """
+    image = open_image_binary(image_binary)
+    image.draft(mode, tuple(size))
+    return image_to_array(image, size, mode=mode)
+
+
+def image_to_array(image, size, mode="RGB"):
+    """Imageオブジェクトを指定した大きさのNumPy配列に変換する
+
+    ``load_image_url`` で得たImageオブジェクトを分類器に入力するときに使う
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        Imageオブジェクト
+    size : tuple of int
+        出力する画像の ``(幅, 高さ)``
+    mode : str, default "RGB"
+        出力する画像のモード
+
+    Returns
+    -------
+    numpy.ndarray
+        dtypeが ``uint8`` の配列。形状は ``(高さ, 幅, チャンネル数)`` 、
+        ``"L"`` などの1チャンネルのモードでは ``(高さ, 幅)``
+    """
+    import numpy as np
+    from PIL import Image
+
+    size = tuple(size)
+    if image.mode != mode:
+        image = image.convert(mode)
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return np.array(image, dtype=np.uint8)
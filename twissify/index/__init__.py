@@ -0,0 +1,28 @@
+import numpy as np
+
+from twissify.index.base import BaseIndex
+from twissify.index.exact import ExactIndex
+from twissify.index.ivf import IVFIndex, kmeans
+
+
+_index_classes = {cls.kind: cls for cls in (ExactIndex, IVFIndex)}
+
+
+def load_index(path):
+    """``save`` で保存したインデックスを種類に合わせて読み込む
+
+    Parameters
+    ----------
+    path : str
+        保存したファイルのパス
+
+    Returns
+    -------
+    ExactIndex or IVFIndex
+    """
+    with np.load(path, allow_pickle=False) as data:
+        kind = str(data["kind"])
+    return _index_classes[kind].load(path)
+
+
+__all__ = ["BaseIndex", "ExactIndex", "IVFIndex", "kmeans", "load_index"]
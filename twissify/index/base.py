@@ -0,0 +1,168 @@
+import abc
+
+import numpy as np
+
+
+class BaseIndex(abc.ABC):
+    """特徴量の近傍探索を行うインデックスの基底クラス
+
+    Attributes
+    ----------
+    features : numpy.ndarray of float32
+        追加した特徴量を格納した ``(N, D)`` の配列
+    labels : numpy.ndarray
+        特徴量に対応するラベルを格納した ``(N,)`` の配列
+    metric : str
+        距離の種類。 ``"l2"`` (ユークリッド距離の2乗)か ``"cosine"`` (1 - コサイン類似度)
+    """
+    kind = None
+    _metrics = ("l2", "cosine")
+
+    def __init__(self, metric="l2"):
+        if metric not in self._metrics:
+            raise ValueError(("`metric` must be one of {metrics}.")
+                             .format(metrics=self._metrics))
+        self.metric = metric
+        self.features = None
+        self.labels = None
+
+    def __len__(self):
+        return 0 if self.features is None else len(self.features)
+
+    @property
+    def dim(self):
+        "特徴量の次元数。特徴量を追加していなければ ``None``"
+        return None if self.features is None else self.features.shape[1]
+
+    def _prepare(self, features):
+        features = np.asarray(features, dtype=np.float32)
+        if features.ndim != 2:
+            raise ValueError("`features` must be a 2-dimensional array.")
+        if self.dim is not None and features.shape[1] != self.dim:
+            raise ValueError(("`features` must have {dim} columns.")
+                             .format(dim=self.dim))
+        if self.metric == "cosine":
+            norms = np.linalg.norm(features, axis=1, keepdims=True)
+            features = features / np.maximum(norms, 1e-12)
+        return np.ascontiguousarray(features)
+
+    def _distances(self, queries, features, feature_norms):
+        "``queries`` と ``features`` の全ての組の距離を計算する"
+        products = queries @ features.T
+        if self.metric == "cosine":
+            return 1 - products
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        distances = query_norms[:, None] - 2 * products + feature_norms
+        return np.maximum(distances, 0)
+
+    @staticmethod
+    def _top_k(distances, k):
+        "各行で距離の小さい ``k`` 個の位置を近い順に返す"
+        k = min(k, distances.shape[1])
+        if k == 0:
+            return np.empty((len(distances), 0), dtype=np.int64)
+        positions = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(distances, positions, axis=1),
+                           axis=1, kind="stable")
+        return np.take_along_axis(positions, order, axis=1)
+
+    def add(self, features, labels=None):
+        """特徴量を追加する
+
+        Parameters
+        ----------
+        features : array-like of float
+            ``(N, D)`` の特徴量
+        labels : array-like, default None
+            ``(N,)`` のラベル。指定しなければ追加した順番の番号
+        """
+        features = self._prepare(features)
+        if labels is None:
+            labels = np.arange(len(self), len(self) + len(features))
+        labels = np.asarray(labels)
+        if len(labels) != len(features):
+            raise ValueError("`labels` must have the same length as "
+                             "`features`.")
+
+        if self.features is None:
+            self.features, self.labels = features, labels
+        else:
+            self.features = np.concatenate([self.features, features])
+            self.labels = np.concatenate([self.labels, labels])
+        self._added(len(self) - len(features))
+
+    def _added(self, start):
+        "``start`` 番目以降の特徴量が追加されたときに呼ばれる"
+
+    @abc.abstractmethod
+    def query_batch(self, features, k):
+        """複数の特徴量の近傍をまとめて探索する
+
+        Parameters
+        ----------
+        features : array-like of float
+            ``(M, D)`` の検索する特徴量
+        k : int
+            1つの特徴量あたりに返す近傍の数
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            ``(M, k)`` の距離と、 ``(M, k)`` の近傍の位置のタプル。
+            近傍が ``k`` 個に満たないときは距離が ``inf`` 、位置が ``-1`` で埋められる
+        """
+
+    def query(self, feature, k):
+        """1つの特徴量の近傍を探索する
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            ``(k,)`` の距離と、 ``(k,)`` の近傍の位置のタプル
+        """
+        distances, indices = self.query_batch(np.asarray(feature)[None], k)
+        return distances[0], indices[0]
+
+    def _state(self):
+        return {}
+
+    def _load_state(self, state):
+        pass
+
+    def save(self, path):
+        """インデックスを ``.npz`` 形式で保存する
+
+        Parameters
+        ----------
+        path : str
+            保存するファイルのパス
+        """
+        if self.features is None:
+            raise ValueError("The index is empty.")
+        np.savez(path, kind=self.kind, metric=self.metric,
+                 features=self.features, labels=self.labels, **self._state())
+
+    @classmethod
+    def load(cls, path):
+        """``save`` で保存したインデックスを読み込む
+
+        Parameters
+        ----------
+        path : str
+            保存したファイルのパス
+
+        Returns
+        -------
+        BaseIndex
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["kind"]) != cls.kind:
+                raise ValueError(("'{path}' is not a {kind} index.")
+                                 .format(path=path, kind=cls.kind))
+            state = {name: data[name] for name in data.files}
+        index = cls.__new__(cls)
+        BaseIndex.__init__(index, metric=str(state.pop("metric")))
+        index.features = state.pop("features")
+        index.labels = state.pop("labels")
+        index._load_state(state)
+        return index
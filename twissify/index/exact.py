@@ -0,0 +1,54 @@
+import numpy as np
+
+from twissify.index.base import BaseIndex
+
+
+class ExactIndex(BaseIndex):
+    """全ての特徴量との距離を計算する厳密な近傍探索のインデックス
+
+    距離は行列積でまとめて計算し、メモリを抑えるため検索する特徴量を
+    ``batch_size`` 個ずつに分けて処理する
+    """
+    kind = "exact"
+
+    def __init__(self, metric="l2", batch_size=256):
+        """
+        Parameters
+        ----------
+        metric : str, default "l2"
+            ``"l2"`` (ユークリッド距離の2乗)か ``"cosine"`` (1 - コサイン類似度)
+        batch_size : int, default 256
+            1度にまとめて距離を計算する検索する特徴量の数
+        """
+        super().__init__(metric=metric)
+        self.batch_size = batch_size
+        self._norms = None
+
+    def _added(self, start):
+        self._norms = np.einsum("ij,ij->i", self.features, self.features)
+
+    def _state(self):
+        return {"batch_size": np.array(self.batch_size)}
+
+    def _load_state(self, state):
+        # batch_sizeを保存していなかったときのファイルは既定値で読み込む
+        self.batch_size = int(state.get("batch_size", 256))
+        self._added(0)
+
+    def query_batch(self, features, k):
+        queries = self._prepare(features)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.features is None:
+            return distances, indices
+
+        n = min(k, len(self))
+        for start in range(0, len(queries), self.batch_size):
+            batch = queries[start:start + self.batch_size]
+            all_distances = self._distances(batch, self.features, self._norms)
+            positions = self._top_k(all_distances, k)
+            end = start + len(batch)
+            indices[start:end, :n] = positions
+            distances[start:end, :n] = np.take_along_axis(all_distances,
+                                                          positions, axis=1)
+        return distances, indices
@@ -0,0 +1,233 @@
+import numpy as np
+
+from twissify.index.base import BaseIndex
+
+
+def kmeans(features, n_clusters, n_iter=20, seed=0, spherical=False):
+    """k-means法で特徴量をクラスタリングする
+
+    Parameters
+    ----------
+    features : numpy.ndarray of float32
+        ``(N, D)`` の特徴量
+    n_clusters : int
+        クラスタの数
+    n_iter : int, default 20
+        更新の最大回数
+    seed : int, default 0
+        初期値を選ぶときの乱数のシード
+    spherical : bool, default False
+        更新するたびにクラスタの中心を単位ベクトルに正規化するかどうか。
+        正規化した特徴量をコサイン類似度でクラスタリングするときに指定する
+
+    Returns
+    -------
+    numpy.ndarray of float32
+        ``(n_clusters, D)`` のクラスタの中心
+    """
+    rng = np.random.RandomState(seed)
+    n_clusters = min(n_clusters, len(features))
+    centroids = features[rng.choice(len(features), n_clusters,
+                                    replace=False)].copy()
+    norms = np.einsum("ij,ij->i", features, features)
+    assignments = None
+    for _ in range(n_iter):
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        distances = (norms[:, None] - 2 * features @ centroids.T
+                     + centroid_norms)
+        new_assignments = distances.argmin(axis=1)
+        if assignments is not None and np.array_equal(assignments,
+                                                      new_assignments):
+            break
+        assignments = new_assignments
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, features)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = features[rng.choice(len(features), len(empty),
+                                                   replace=False)]
+        if spherical:
+            centroid_norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.maximum(centroid_norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(BaseIndex):
+    """転置ファイル(IVF)による近似最近傍探索のインデックス
+
+    特徴量をk-means法で ``n_lists`` 個のクラスタに分け、検索時は
+    中心が近い ``n_probe`` 個のクラスタに属する特徴量とだけ距離を計算する。
+    1回の検索で計算する距離の数はおおよそ ``N * n_probe / n_lists`` になるため、
+    ``n_lists`` を指定しなければ ``sqrt(N)`` 程度に増やし、特徴量が増えても
+    検索時間の増加を緩やかにする。
+    ``add`` した特徴量は既存のクラスタに割り当てるだけで、クラスタの数が
+    ``sqrt(N)`` の半分を下回ったときだけ学習し直す
+    """
+    kind = "ivf"
+
+    def __init__(self, n_lists=None, n_probe=8, metric="l2", n_train=100000,
+                 seed=0):
+        """
+        Parameters
+        ----------
+        n_lists : int, default None
+            クラスタの数。指定しなければ特徴量の数の平方根に合わせて増やす
+        n_probe : int, default 8
+            検索するクラスタの数。大きいほど再現率が上がり、遅くなる
+        metric : str, default "l2"
+            ``"l2"`` (ユークリッド距離の2乗)か ``"cosine"`` (1 - コサイン類似度)
+        n_train : int, default 100000
+            クラスタリングに使う特徴量の最大数
+        seed : int, default 0
+            乱数のシード
+        """
+        super().__init__(metric=metric)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_train = n_train
+        self.seed = seed
+        self.centroids = None
+        self._assignments = None
+        self._order = None
+        self._offsets = None
+        self._norms = None
+
+    def train(self, features):
+        """クラスタの中心を学習する
+
+        ``add`` の前に呼ばなければ、最初に ``add`` した特徴量で学習する
+
+        Parameters
+        ----------
+        features : array-like of float
+            ``(N, D)`` の学習に使う特徴量
+        """
+        features = self._prepare(features)
+        n_lists = self._n_lists(len(features))
+        if len(features) > self.n_train:
+            rng = np.random.RandomState(self.seed)
+            features = features[rng.choice(len(features), self.n_train,
+                                           replace=False)]
+        self.centroids = kmeans(features, n_lists, seed=self.seed,
+                                spherical=self.metric == "cosine")
+
+    def _n_lists(self, n):
+        "``n`` 個の特徴量に対するクラスタの数"
+        if self.n_lists is not None:
+            return self.n_lists
+        return max(int(np.sqrt(n)), 1)
+
+    def _assign(self, features):
+        centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        return self._distances(features, self.centroids,
+                               centroid_norms).argmin(axis=1)
+
+    def _added(self, start):
+        if self.centroids is None or (
+                self.n_lists is None
+                and self._n_lists(len(self)) >= 2 * len(self.centroids)):
+            self.train(self.features)
+            start = 0
+        assignments = self._assign(self.features[start:])
+        if self._assignments is None or start == 0:
+            self._assignments = assignments
+            self._build_lists()
+        else:
+            self._insert_lists(start, assignments)
+
+    def _insert_lists(self, start, assignments):
+        "``start`` 番目以降の特徴量を並べ直さずに各クラスタの末尾に加える"
+        order = np.argsort(assignments, kind="stable")
+        self._order = np.insert(self._order,
+                                self._offsets[1:][assignments[order]],
+                                start + order)
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self._offsets = self._offsets + np.concatenate([[0],
+                                                        np.cumsum(counts)])
+        self._assignments = np.concatenate([self._assignments, assignments])
+        features = self.features[start:]
+        self._norms = np.concatenate([self._norms,
+                                      np.einsum("ij,ij->i", features,
+                                                features)])
+
+    def _build_lists(self):
+        self._order = np.argsort(self._assignments, kind="stable")
+        counts = np.bincount(self._assignments, minlength=len(self.centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._norms = np.einsum("ij,ij->i", self.features, self.features)
+
+    def _state(self):
+        return {"centroids": self.centroids,
+                "assignments": self._assignments,
+                "params": np.array([self.n_lists or 0, self.n_probe,
+                                    self.n_train, self.seed])}
+
+    def _load_state(self, state):
+        n_lists, self.n_probe, self.n_train, self.seed = (
+            int(value) for value in state["params"])
+        # 0はクラスタの数を指定していないことを表す
+        self.n_lists = n_lists or None
+        self.centroids = state["centroids"]
+        self._assignments = state["assignments"]
+        self._build_lists()
+
+    def query_batch(self, features, k, n_probe=None):
+        """複数の特徴量の近傍をまとめて探索する
+
+        Parameters
+        ----------
+        features : array-like of float
+            ``(M, D)`` の検索する特徴量
+        k : int
+            1つの特徴量あたりに返す近傍の数
+        n_probe : int, default None
+            検索するクラスタの数。指定しなければ ``self.n_probe``
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            ``(M, k)`` の距離と、 ``(M, k)`` の近傍の位置のタプル。
+            近傍が ``k`` 個に満たないときは距離が ``inf`` 、位置が ``-1`` で埋められる
+        """
+        queries = self._prepare(features)
+        if self.features is None:
+            return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+
+        n_probe = min(self.n_probe if n_probe is None else n_probe,
+                      len(self.centroids))
+        centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        probes = self._top_k(self._distances(queries, self.centroids,
+                                             centroid_norms), n_probe)
+        # クラスタごとに、そのクラスタを検索する特徴量をまとめて距離を計算し、
+        # 各クラスタの上位k個を (M, n_probe * k) の候補に書き込んでから選び直す
+        candidate_distances = np.full((len(queries), n_probe * k), np.inf,
+                                      dtype=np.float32)
+        candidate_indices = np.full((len(queries), n_probe * k), -1,
+                                    dtype=np.int64)
+        query_order = np.argsort(probes, axis=None, kind="stable")
+        lists = probes.reshape(-1)[query_order]
+        bounds = np.searchsorted(lists, np.arange(len(self.centroids) + 1))
+        for j in np.flatnonzero(np.diff(bounds)):
+            members = self._order[self._offsets[j]:self._offsets[j + 1]]
+            if len(members) == 0:
+                continue
+            rows, slots = np.divmod(query_order[bounds[j]:bounds[j + 1]],
+                                    n_probe)
+            list_distances = self._distances(queries[rows],
+                                             self.features[members],
+                                             self._norms[members])
+            positions = self._top_k(list_distances, k)
+            columns = slots[:, None] * k + np.arange(positions.shape[1])
+            candidate_distances[rows[:, None], columns] = np.take_along_axis(
+                list_distances, positions, axis=1)
+            candidate_indices[rows[:, None], columns] = members[positions]
+
+        positions = self._top_k(candidate_distances, k)
+        distances = np.take_along_axis(candidate_distances, positions, axis=1)
+        indices = np.take_along_axis(candidate_indices, positions, axis=1)
+        indices[np.isinf(distances)] = -1
+        return distances, indices
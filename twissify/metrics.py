@@ -0,0 +1,503 @@
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """値の分布を上限ごとの累積の個数で保持するヒストグラム
+
+    Attributes
+    ----------
+    buckets : tuple of float
+        各区間の上限。最後に上限のない区間が続く
+    counts : list of int
+        各区間に入った値の個数
+    count : int
+        記録した値の個数
+    sum : float
+        記録した値の合計
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        "各上限以下の値の個数。最後は全ての値の個数"
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def quantile(self, q):
+        """区間の上限から近似した分位数を返す
+
+        Returns
+        -------
+        float or None
+            ``q`` の分位数を含む区間の上限。値がなければ ``None`` 、
+            上限のない区間に含まれるときは ``inf``
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for bound, count in zip(self.buckets + (float("inf"),),
+                                self.cumulative_counts()):
+            if count >= rank:
+                return bound
+        return float("inf")
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    """カウンターとヒストグラムを名前とラベルごとに保持するクラス
+
+    Attributes
+    ----------
+    sampler : Sampler or None
+        計測する関数の呼び出しをサンプリングしてプロファイルする ``Sampler``
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Parameters
+        ----------
+        buckets : tuple of float, default DEFAULT_BUCKETS
+            ヒストグラムの各区間の上限
+        """
+        self.buckets = buckets
+        self.sampler = None
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """カウンターを増やす
+
+        Parameters
+        ----------
+        name : str
+            カウンターの名前
+        value : float, default 1
+            増やす値
+        **labels
+            ラベルの名前と値
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに値を記録する
+
+        Parameters
+        ----------
+        name : str
+            ヒストグラムの名前
+        value : float
+            記録する値
+        **labels
+            ラベルの名前と値
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def counter(self, name, **labels):
+        "カウンターの値を返す。記録されていなければ ``0``"
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def histogram(self, name, **labels):
+        "ヒストグラムを返す。記録されていなければ ``None``"
+        with self._lock:
+            return self._histograms.get(_key(name, labels))
+
+    def reset(self):
+        "全てのカウンターとヒストグラムを削除する"
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """現在の値を辞書として返す
+
+        Returns
+        -------
+        dict
+            ``counters`` と ``histograms`` のそれぞれに、名前、ラベル、値を
+            格納した辞書のリストを持つ辞書
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value
+                        in sorted(self._counters.items())]
+            histograms = [{"name": name, "labels": dict(labels),
+                           "count": histogram.count, "sum": histogram.sum,
+                           "buckets": list(histogram.buckets),
+                           "counts": histogram.cumulative_counts(),
+                           "p50": histogram.quantile(0.5),
+                           "p95": histogram.quantile(0.95),
+                           "p99": histogram.quantile(0.99)}
+                          for (name, labels), histogram
+                          in sorted(self._histograms.items())]
+        return {"counters": counters, "histograms": histograms}
+
+
+REGISTRY = Registry()
+
+_enabled = False
+
+
+def enable(registry=None):
+    """計測を有効にする
+
+    Parameters
+    ----------
+    registry : Registry, default None
+        記録先。指定しなければ ``REGISTRY``
+    """
+    global REGISTRY, _enabled
+    if registry is not None:
+        REGISTRY = registry
+    _enabled = True
+
+
+def disable():
+    "計測を無効にする"
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    "計測が有効かどうか"
+    return _enabled
+
+
+def add(name, value=1):
+    """計測が有効なときだけ ``twissify_<name>`` のカウンターを増やす
+
+    Parameters
+    ----------
+    name : str
+        記録する名前
+    value : float, default 1
+        増やす値
+    """
+    if _enabled:
+        REGISTRY.inc("twissify_" + name, value)
+
+
+def count_bytes(name, chunks):
+    """``chunks`` のバイト数を ``twissify_<name>_bytes_total`` に加えながら返す
+
+    計測が無効のときは ``chunks`` をそのまま返す
+
+    Parameters
+    ----------
+    name : str
+        記録する名前
+    chunks : iterable of bytes
+        受信したチャンクのイテラブル
+
+    Returns
+    -------
+    iterable of bytes
+        ``chunks`` と同じチャンクを返すイテラブル
+    """
+    if not _enabled:
+        return chunks
+    return _count_bytes("twissify_" + name + "_bytes_total", chunks)
+
+
+def _count_bytes(name, chunks):
+    registry = REGISTRY
+    for chunk in chunks:
+        registry.inc(name, len(chunk))
+        yield chunk
+
+
+def instrument(name, items=None, nbytes=None):
+    """関数の呼び出し回数、例外の回数、所要時間を記録するデコレーター
+
+    計測が無効のときはフラグを1回確認するだけで元の関数を呼び出す。
+    記録する名前は ``twissify_<name>_calls_total`` 、
+    ``twissify_<name>_errors_total`` 、 ``twissify_<name>_seconds`` 、
+    ``twissify_<name>_items_total`` 、 ``twissify_<name>_bytes_total``
+
+    Parameters
+    ----------
+    name : str
+        記録する名前
+    items : callable, default None
+        戻り値を受け取り、処理した要素の数を返す関数
+    nbytes : callable, default None
+        関数と同じ引数を受け取り、処理したバイト数を返す関数
+    """
+    prefix = "twissify_" + name
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            registry = REGISTRY
+            sampler = registry.sampler
+            start = time.perf_counter()
+            try:
+                if sampler is not None:
+                    with sampler.sample(name):
+                        result = function(*args, **kwargs)
+                else:
+                    result = function(*args, **kwargs)
+            except Exception:
+                registry.inc(prefix + "_errors_total")
+                raise
+            finally:
+                registry.observe(prefix + "_seconds",
+                                 time.perf_counter() - start)
+                registry.inc(prefix + "_calls_total")
+            if items is not None:
+                registry.inc(prefix + "_items_total", items(result))
+            if nbytes is not None:
+                registry.inc(prefix + "_bytes_total", nbytes(*args, **kwargs))
+            return result
+        return wrapper
+    return decorator
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels.items()) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{key}="{value}"'.format(
+        key=key, value=str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in pairs) + "}"
+
+
+def prometheus_text(registry=None):
+    """Prometheusのテキスト形式に変換する
+
+    Parameters
+    ----------
+    registry : Registry, default None
+        変換する値。指定しなければ ``REGISTRY``
+
+    Returns
+    -------
+    str
+        Prometheusのテキスト形式の文字列
+    """
+    snapshot = (REGISTRY if registry is None else registry).snapshot()
+    lines = []
+    typed = set()
+    for counter in snapshot["counters"]:
+        if counter["name"] not in typed:
+            typed.add(counter["name"])
+            lines.append("# TYPE {name} counter".format(name=counter["name"]))
+        lines.append("{name}{labels} {value}".format(
+            name=counter["name"], labels=_format_labels(counter["labels"]),
+            value=counter["value"]))
+    for histogram in snapshot["histograms"]:
+        name = histogram["name"]
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE {name} histogram".format(name=name))
+        bounds = [repr(float(bound)) for bound in histogram["buckets"]]
+        for bound, count in zip(bounds + ["+Inf"], histogram["counts"]):
+            lines.append("{name}_bucket{labels} {count}".format(
+                name=name, count=count,
+                labels=_format_labels(histogram["labels"], [("le", bound)])))
+        labels = _format_labels(histogram["labels"])
+        lines.append("{name}_sum{labels} {value}".format(
+            name=name, labels=labels, value=histogram["sum"]))
+        lines.append("{name}_count{labels} {value}".format(
+            name=name, labels=labels, value=histogram["count"]))
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusTextFileExporter:
+    """node_exporterのtextfile collectorが読み込むファイルに書き出すクラス"""
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            書き出すファイルのパス。拡張子は ``.prom`` にする
+        """
+        self.path = path
+
+    def __call__(self, registry):
+        "一時ファイルに書き込んでから置き換える"
+        import tempfile
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(prometheus_text(registry))
+        os.replace(tmp_path, self.path)
+
+
+class JSONLogExporter:
+    "現在の値を1行のJSONとしてストリームに書き出すクラス"
+    def __init__(self, stream=None):
+        """
+        Parameters
+        ----------
+        stream : file-like object, default None
+            書き出す先。指定しなければ標準エラー出力
+        """
+        self.stream = stream
+
+    def __call__(self, registry):
+        import json
+
+        stream = sys.stderr if self.stream is None else self.stream
+        record = dict(registry.snapshot(), time=time.time())
+        stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+        stream.flush()
+
+
+class Reporter:
+    """一定の間隔で ``exporters`` に現在の値を渡すクラス
+
+    Examples
+    --------
+    >>> enable()
+    >>> with Reporter([PrometheusTextFileExporter("twissify.prom")]):
+    ...     service.run()
+    """
+    def __init__(self, exporters, interval=60, registry=None):
+        """
+        Parameters
+        ----------
+        exporters : list of callable
+            ``Registry`` を受け取る関数
+        interval : float, default 60
+            書き出す間隔の秒数
+        registry : Registry, default None
+            書き出す値。指定しなければ ``REGISTRY``
+        """
+        self.exporters = list(exporters)
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def export(self):
+        "全ての ``exporters`` に現在の値を渡す"
+        registry = REGISTRY if self.registry is None else self.registry
+        for exporter in self.exporters:
+            exporter(registry)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        "スレッドを止め、最後にもう一度書き出す"
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.export()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class Sampler:
+    """計測する関数の呼び出しの一部を ``cProfile`` と ``tracemalloc`` で記録するクラス
+
+    ``Registry.sampler`` に設定すると、 ``instrument`` した関数の呼び出しのうち
+    ``rate`` の割合をプロファイルし、結果を ``callback`` に渡す。
+    プロファイラーは1つしか動かせないため、記録中の呼び出しと重なった呼び出しは記録しない
+    """
+    def __init__(self, callback, rate=0.01, profile=True, memory=False,
+                 seed=None):
+        """
+        Parameters
+        ----------
+        callback : callable
+            名前、 ``pstats.Stats`` (または ``None`` )、
+            ``tracemalloc.Snapshot`` (または ``None`` )を受け取る関数
+        rate : float, default 0.01
+            記録する呼び出しの割合
+        profile : bool, default True
+            ``cProfile`` で記録するかどうか
+        memory : bool, default False
+            ``tracemalloc`` のスナップショットを記録するかどうか
+        seed : int, default None
+            サンプリングの乱数のシード
+        """
+        import random
+
+        self.callback = callback
+        self.rate = rate
+        self.profile = profile
+        self.memory = memory
+        self._random = random.Random(seed)
+        self._busy = threading.Lock()
+
+    @contextmanager
+    def sample(self, name):
+        "``rate`` の割合で ``with`` ブロック内の処理を記録する"
+        if (self._random.random() >= self.rate
+                or not self._busy.acquire(blocking=False)):
+            yield
+            return
+
+        import cProfile
+        import pstats
+        import tracemalloc
+
+        profiler = cProfile.Profile() if self.profile else None
+        started_tracemalloc = self.memory and not tracemalloc.is_tracing()
+        try:
+            if started_tracemalloc:
+                tracemalloc.start()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                snapshot = (tracemalloc.take_snapshot() if self.memory
+                            else None)
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            stats = None if profiler is None else pstats.Stats(profiler)
+            self.callback(name, stats, snapshot)
+        finally:
+            self._busy.release()
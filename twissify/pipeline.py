@@ -0,0 +1,260 @@
+import queue
+import threading
+import time
+
+
+class Stage:
+    """パイプラインの1つの処理段階
+
+    ``function`` が返した値が次の段階に渡される。 ``None`` を返したときは
+    次の段階に渡さず、 ``expand=True`` のときは返した値の要素を1つずつ渡す。
+    例外が発生した要素は ``errors`` を数えて取り除く
+
+    Attributes
+    ----------
+    processed : int
+        処理した要素の数
+    emitted : int
+        次の段階に渡した要素の数
+    errors : int
+        例外が発生した要素の数
+    last_error : Exception or None
+        最後に発生した例外
+    """
+    def __init__(self, name, function, workers=1, maxsize=16, expand=False):
+        """
+        Parameters
+        ----------
+        name : str
+            段階の名前
+        function : callable
+            要素を1つ受け取り、処理した値を返す関数
+        workers : int, default 1
+            この段階を処理するスレッドの数
+        maxsize : int, default 16
+            この段階の入力キューの最大長。前の段階はキューが空くまで待たされる
+        expand : bool, default False
+            ``function`` が返したイテラブルの要素を1つずつ次の段階に渡すかどうか
+        """
+        if workers < 1:
+            raise ValueError("`workers` must be positive.")
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.maxsize = maxsize
+        self.expand = expand
+        self.processed = 0
+        self.emitted = 0
+        self.errors = 0
+        self.last_error = None
+        self.busy_seconds = 0.0
+        self.queue = None
+        self._started_at = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ("{cls}(name={name}, workers={workers}, maxsize={maxsize})"
+                .format(cls=self.__class__.__name__, name=self.name,
+                        workers=self.workers, maxsize=self.maxsize))
+
+    @property
+    def queue_depth(self):
+        "入力キューに溜まっている要素の数"
+        return 0 if self.queue is None else self.queue.qsize()
+
+    @property
+    def throughput(self):
+        "開始してから1秒あたりに処理した要素の数"
+        if self._started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self._started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        """処理状況を返す
+
+        Returns
+        -------
+        dict
+            キューの長さ、処理数、エラー数、スループット、稼働率を格納した辞書
+        """
+        elapsed = (0.0 if self._started_at is None
+                   else time.monotonic() - self._started_at)
+        utilization = (self.busy_seconds / (elapsed * self.workers)
+                       if elapsed > 0 else 0.0)
+        return {"name": self.name, "workers": self.workers,
+                "queue_depth": self.queue_depth, "maxsize": self.maxsize,
+                "processed": self.processed, "emitted": self.emitted,
+                "errors": self.errors, "throughput": self.throughput,
+                "utilization": utilization}
+
+    def _reset(self):
+        self.queue = queue.Queue(maxsize=self.maxsize)
+        self.processed = self.emitted = self.errors = 0
+        self.busy_seconds = 0.0
+        self.last_error = None
+        self._started_at = time.monotonic()
+
+    def _process(self, item):
+        start = time.monotonic()
+        try:
+            result = self.function(item)
+            if result is None:
+                results = ()
+            elif self.expand:
+                results = list(result)
+            else:
+                results = (result,)
+        except Exception as e:
+            results = ()
+            with self._lock:
+                self.errors += 1
+                self.last_error = e
+        with self._lock:
+            self.processed += 1
+            self.emitted += len(results)
+            self.busy_seconds += time.monotonic() - start
+        return results
+
+
+class Pipeline:
+    """段階ごとにスレッドとキューを持つ生産者/消費者型のパイプライン
+
+    各段階の間のキューは長さに上限があるため、後ろの段階が遅いと前の段階は待たされ、
+    一度に大量の画像ツイートが届いてもメモリの使用量は一定に保たれる。
+    ダウンロードのようなI/O待ちの段階とデコードや分類のようなCPUを使う段階が
+    並行して進む
+
+    Examples
+    --------
+    >>> pipeline = Pipeline([
+    ...     Stage("download", download, workers=8, expand=True),
+    ...     Stage("decode", decode, workers=2),
+    ...     Stage("classify", classify)])
+    >>> for result in pipeline.run(photo_records):
+    ...     pass
+    """
+    _done = object()
+    _poll_interval = 0.1
+
+    def __init__(self, stages, maxsize=16):
+        """
+        Parameters
+        ----------
+        stages : list of Stage
+            処理する順に並んだ段階
+        maxsize : int, default 16
+            最後の段階の出力キューの最大長
+        """
+        if not stages:
+            raise ValueError("`stages` must not be empty.")
+        self.stages = list(stages)
+        self.maxsize = maxsize
+        self._output = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def stats(self):
+        """各段階の処理状況を返す
+
+        Returns
+        -------
+        list of dict
+            段階の順に並んだ ``Stage.stats`` の結果
+        """
+        return [stage.stats() for stage in self.stages]
+
+    def _put(self, target, item):
+        "停止するまで ``target`` が空くのを待って ``item`` を入れる"
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=self._poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, source):
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=self._poll_interval)
+            except queue.Empty:
+                pass
+        return self._done
+
+    def _next_queue(self, index):
+        if index + 1 < len(self.stages):
+            return self.stages[index + 1].queue, self.stages[index + 1].workers
+        return self._output, 1
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for item in items:
+                if not self._put(first.queue, item):
+                    return
+        except Exception as e:
+            with first._lock:
+                first.errors += 1
+                first.last_error = e
+        for _ in range(first.workers):
+            self._put(first.queue, self._done)
+
+    def _work(self, index, remaining):
+        stage = self.stages[index]
+        target, n_done = self._next_queue(index)
+        while True:
+            item = self._get(stage.queue)
+            if item is self._done:
+                break
+            for result in stage._process(item):
+                if not self._put(target, result):
+                    return
+        with stage._lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            for _ in range(n_done):
+                self._put(target, self._done)
+
+    def run(self, items):
+        """要素をパイプラインに流し、最後の段階の結果を順に返す
+
+        Parameters
+        ----------
+        items : iterable
+            最初の段階に渡す要素。別のスレッドから読み込まれる
+
+        Yields
+        ------
+        object
+            最後の段階が返した値。処理が終わった順に返るため、入力の順番とは限らない
+        """
+        self._stop.clear()
+        for stage in self.stages:
+            stage._reset()
+        self._output = queue.Queue(maxsize=self.maxsize)
+        remaining = [stage.workers for stage in self.stages]
+
+        self._threads = [threading.Thread(target=self._feed, args=(items,),
+                                          daemon=True)]
+        for index, stage in enumerate(self.stages):
+            self._threads.extend(
+                threading.Thread(target=self._work, args=(index, remaining),
+                                 name="{name}-{i}".format(name=stage.name,
+                                                          i=i),
+                                 daemon=True)
+                for i in range(stage.workers))
+        for thread in self._threads:
+            thread.start()
+
+        try:
+            while True:
+                result = self._output.get()
+                if result is self._done:
+                    break
+                yield result
+        finally:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,197 @@
+import threading
+import time
+
+
+POLL = "poll"
+GAP = "gap"
+
+
+class _Window:
+    "1つのエンドポイントのレート制限の期間の状態"
+    def __init__(self, limit, remaining, reset):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.last_call = None
+
+
+class RateLimitBudget:
+    """エンドポイントごとのAPIの呼び出し回数の予算を管理するクラス
+
+    レスポンスヘッダーの ``x-rate-limit-limit`` 、 ``x-rate-limit-remaining`` 、
+    ``x-rate-limit-reset`` から残りの回数とリセットされる時刻を記録し、
+    呼び出しをリセットまでの時間に均等に割り振る。
+    残りの回数のうち ``reserve`` の割合は取得できていない範囲の取得( ``GAP`` )のために
+    取っておき、定期的な取得( ``POLL`` )では使わない
+
+    Examples
+    --------
+    >>> budget = RateLimitBudget()
+    >>> timeline = Timeline(api, storage, budget=budget)
+    >>> budget.usage()["home_timeline"]["used"]
+    3
+    """
+    default_limits = {"home_timeline": 15, "mentions_timeline": 75,
+                      "user_timeline": 900, "list_timeline": 900}
+
+    def __init__(self, window=900, reserve=0.2, limits=None, clock=time.time,
+                 sleep=time.sleep):
+        """
+        Parameters
+        ----------
+        window : float, default 900
+            レート制限の期間の秒数
+        reserve : float, default 0.2
+            ``GAP`` のために取っておく残りの回数の割合
+        limits : dict of str to int, default None
+            ヘッダーを受け取る前に使うエンドポイントごとの上限。
+            ``default_limits`` を上書きする
+        clock : callable, default time.time
+            現在のUNIX時間を返す関数
+        sleep : callable, default time.sleep
+            指定した秒数だけ待つ関数。真を返したときは待つのを中断する。
+            ``threading.Event.wait`` を渡すと、イベントをセットして待機を中断できる
+        """
+        if not 0 <= reserve < 1:
+            raise ValueError("`reserve` must be between 0 and 1.")
+        self.window = window
+        self.reserve = reserve
+        self.limits = dict(self.default_limits)
+        if limits is not None:
+            self.limits.update(limits)
+        self._clock = clock
+        self._sleep = sleep
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _window(self, endpoint, now):
+        window = self._windows.get(endpoint)
+        if window is None or now >= window.reset:
+            limit = (self.limits.get(endpoint, 15) if window is None
+                     else window.limit)
+            last_call = None if window is None else window.last_call
+            window = _Window(limit, limit, now + self.window)
+            window.last_call = last_call
+            self._windows[endpoint] = window
+        return window
+
+    def _delay(self, window, priority, now):
+        "次に呼び出せるまでの秒数"
+        until_reset = max(window.reset - now, 0.0)
+        available = window.remaining
+        if priority != GAP:
+            available -= int(window.limit * self.reserve)
+        if available <= 0:
+            return until_reset
+        if window.last_call is None:
+            return 0.0
+        interval = until_reset / available
+        return max(window.last_call + interval - now, 0.0)
+
+    def delay(self, endpoint, priority=POLL):
+        """次に呼び出せるまでの秒数を返す
+
+        Parameters
+        ----------
+        endpoint : str
+            エンドポイントの名前
+        priority : str, default POLL
+            ``POLL`` または ``GAP``
+
+        Returns
+        -------
+        float
+            待つ必要のある秒数
+        """
+        with self._lock:
+            now = self._clock()
+            return self._delay(self._window(endpoint, now), priority, now)
+
+    def acquire(self, endpoint, priority=POLL, block=True):
+        """呼び出しの予算を1回分確保する
+
+        Parameters
+        ----------
+        endpoint : str
+            エンドポイントの名前
+        priority : str, default POLL
+            ``POLL`` または ``GAP``
+        block : bool, default True
+            呼び出せるようになるまで待つかどうか
+
+        Returns
+        -------
+        bool
+            確保できたかどうか。 ``block=False`` で待つ必要があるときや、
+            ``sleep`` が真を返して待機を中断したときは ``False``
+        """
+        while True:
+            with self._lock:
+                now = self._clock()
+                window = self._window(endpoint, now)
+                delay = self._delay(window, priority, now)
+                if delay <= 0:
+                    window.remaining -= 1
+                    window.last_call = now
+                    return True
+            if not block or self._sleep(delay):
+                return False
+
+    def update(self, endpoint, headers):
+        """レスポンスヘッダーから残りの回数とリセットされる時刻を記録する
+
+        Parameters
+        ----------
+        endpoint : str
+            エンドポイントの名前
+        headers : mapping
+            レスポンスヘッダー。レート制限のヘッダーがなければ何もしない
+        """
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset = float(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._lock:
+            window = self._window(endpoint, self._clock())
+            window.limit = limit
+            window.remaining = remaining
+            window.reset = reset
+
+    def exhaust(self, endpoint, reset=None):
+        """レート制限に達したときに残りの回数を0にする
+
+        Parameters
+        ----------
+        endpoint : str
+            エンドポイントの名前
+        reset : float, default None
+            リセットされるUNIX時間。指定しなければ現在の期間の終わり
+        """
+        with self._lock:
+            window = self._window(endpoint, self._clock())
+            window.remaining = 0
+            if reset is not None:
+                window.reset = reset
+
+    def usage(self):
+        """エンドポイントごとの予算の使用状況を返す
+
+        Returns
+        -------
+        dict of str to dict
+            上限、残りの回数、使った回数、使った割合、リセットまでの秒数を格納した辞書
+        """
+        with self._lock:
+            now = self._clock()
+            usage = {}
+            for endpoint in list(self._windows):
+                window = self._window(endpoint, now)
+                used = window.limit - window.remaining
+                usage[endpoint] = {
+                    "limit": window.limit, "remaining": window.remaining,
+                    "used": used,
+                    "used_ratio": used / window.limit if window.limit else 0.0,
+                    "reset_in": max(window.reset - now, 0.0)}
+            return usage
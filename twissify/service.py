@@ -0,0 +1,316 @@
+import signal
+import threading
+import time
+
+from twissify.api import merge_tweets
+from twissify.image import create_session
+from twissify.ratelimit import RateLimitBudget
+from twissify.storages import TimelineIndexStorage
+from twissify.timeline import Timeline
+
+
+class AdaptiveInterval:
+    """ツイートの到着率に合わせて取得の間隔を決めるクラス
+
+    到着率(1秒あたりのツイート数)を指数移動平均で推定し、1回の取得で
+    ``target`` 件程度のツイートが届くように間隔を ``min_interval`` から
+    ``max_interval`` の範囲で調整する
+
+    Attributes
+    ----------
+    rate : float or None
+        推定した1秒あたりのツイート数。まだ観測していなければ ``None``
+    interval : float
+        次の取得までの秒数
+    """
+    def __init__(self, target=50, min_interval=60, max_interval=900,
+                 alpha=0.3, initial=None):
+        """
+        Parameters
+        ----------
+        target : float, default 50
+            1回の取得で届いてほしいツイートの数。1ページの件数より小さくすると
+            取得できない範囲ができにくい
+        min_interval : float, default 60
+            間隔の最小の秒数
+        max_interval : float, default 900
+            間隔の最大の秒数
+        alpha : float, default 0.3
+            指数移動平均で新しい観測に掛ける重み
+        initial : float, default None
+            最初の間隔の秒数。指定しなければ ``min_interval``
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("`min_interval` must be positive and less than "
+                             "or equal to `max_interval`.")
+        if not 0 < alpha <= 1:
+            raise ValueError("`alpha` must be between 0 and 1.")
+        self.target = target
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.rate = None
+        self.interval = min_interval if initial is None else initial
+
+    def observe(self, n_tweets, elapsed):
+        """取得したツイートの数と前回の取得からの秒数を記録する
+
+        Parameters
+        ----------
+        n_tweets : int
+            取得したツイートの数
+        elapsed : float
+            前回の取得からの秒数
+
+        Returns
+        -------
+        float
+            次の取得までの秒数
+        """
+        if elapsed <= 0:
+            return self.interval
+        rate = n_tweets / elapsed
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = self.alpha * rate + (1 - self.alpha) * self.rate
+        interval = (self.max_interval if self.rate <= 0
+                    else self.target / self.rate)
+        self.interval = min(max(interval, self.min_interval),
+                            self.max_interval)
+        return self.interval
+
+
+class Service:
+    """タイムラインを定期的に取得し続ける常駐サービス
+
+    ストレージのエンジンとセッション、HTTPのコネクションプールを
+    プロセスが終了するまで使い回すため、cronで毎回起動するのと比べて
+    1回あたりの取得にかかる時間が短い。
+    ``stop`` を呼び出すか、 ``install_signal_handlers`` の後にSIGTERMかSIGINTを
+    受け取ると、実行中の取得を終えてからストレージを閉じて終了する
+
+    Attributes
+    ----------
+    cycles : int
+        取得した回数
+    errors : int
+        取得中に例外が発生した回数
+    last_error : Exception or None
+        最後に発生した例外
+    last_cycle_seconds : float or None
+        最後の取得と ``handler`` の処理にかかった秒数
+    """
+    def __init__(self, timeline, handler=None, interval=None, count=200,
+                 names=None, storage=None, session=None, clock=time.monotonic,
+                 gap_pages=1):
+        """
+        Parameters
+        ----------
+        timeline : Timeline
+            ツイートを取得するタイムライン
+        handler : callable, default None
+            取得したツイートのリストを受け取る関数
+        interval : AdaptiveInterval, default None
+            取得の間隔。指定しなければ既定の設定の ``AdaptiveInterval``
+        count : int, default 200
+            それぞれのタイムラインで取得するツイートの数
+        names : list of str, default None
+            取得するタイムラインの名前。指定しなければ登録した全てのタイムライン
+        storage : TimelineIndexStorage, default None
+            終了するときに閉じるストレージ
+        session : requests.Session, default None
+            ``handler`` が画像の取得に使うセッション。終了するときに閉じる
+        clock : callable, default time.monotonic
+            経過時間を測る関数
+        gap_pages : int, default 1
+            1回の取得で、それぞれのタイムラインの取得できていない範囲から
+            取得する最大のページ数。 ``0`` のときは取得しない
+        """
+        self.timeline = timeline
+        self.handler = handler
+        self.interval = AdaptiveInterval() if interval is None else interval
+        self.count = count
+        self.names = names
+        self.storage = storage
+        self.session = session
+        self.cycles = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_cycle_seconds = None
+        self.gap_pages = gap_pages
+        self._clock = clock
+        self._last_polled_at = None
+        self._stop = threading.Event()
+
+    @property
+    def stopped(self):
+        "``stop`` が呼び出されたかどうか"
+        return self._stop.is_set()
+
+    def stop(self, *args):
+        "実行中の取得を終えた後にサービスを終了する。レート制限の待機は中断する"
+        self._stop.set()
+
+    def wait(self, timeout):
+        """``stop`` が呼び出されるまで最大 ``timeout`` 秒待つ
+
+        ``RateLimitBudget`` の ``sleep`` に渡すと、レート制限の待機を
+        ``stop`` で中断できる
+
+        Returns
+        -------
+        bool
+            ``stop`` が呼び出されたかどうか
+        """
+        return self._stop.wait(timeout)
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        """シグナルを受け取ったときに ``stop`` を呼び出すようにする
+
+        メインスレッドから呼び出す必要がある
+
+        Returns
+        -------
+        dict
+            シグナルと元のハンドラーの辞書。 ``signal.signal`` で元に戻せる
+        """
+        return {signum: signal.signal(signum, self.stop) for signum in signals}
+
+    def cycle(self):
+        """タイムラインを1回取得して ``handler`` に渡す
+
+        新しいツイートに加えて、1ページに収まらずに取得できていない範囲を
+        ``gap_pages`` ページまで取得し、まとめて ``handler`` に渡す。
+        取得できていない範囲は ``GAP`` の優先度で取得するため、
+        レート制限の残りが少ないときは新しいツイートの取得が優先される
+
+        新しいツイートがなくても ``storage`` に保持している値を書き込めるように、
+        取得のたびに ``flush_if_due`` を呼び出す
+
+        Returns
+        -------
+        float
+            次の取得までの秒数。 ``stop`` が呼び出されていたときは ``0``
+        """
+        if self.stopped:
+            return 0
+        started_at = self._clock()
+        try:
+            tweets = self.timeline.poll(count=self.count, names=self.names)
+            n_new = len(tweets)
+            if self.gap_pages:
+                backfilled = self.timeline.backfill(count=self.count,
+                                                    names=self.names,
+                                                    max_pages=self.gap_pages)
+                if backfilled:
+                    tweets = merge_tweets([tweets, backfilled])
+            if self.handler is not None:
+                self.handler(tweets)
+            if self.storage is not None:
+                self.storage.flush_if_due()
+        except Exception as e:
+            if isinstance(e, InterruptedError) and self.stopped:
+                return 0
+            self.errors += 1
+            self.last_error = e
+            return self.interval.interval
+        finally:
+            self.cycles += 1
+            self.last_cycle_seconds = self._clock() - started_at
+
+        if self._last_polled_at is not None:
+            self.interval.observe(n_new,
+                                  started_at - self._last_polled_at)
+        self._last_polled_at = started_at
+        return self.interval.interval
+
+    def run(self, max_cycles=None):
+        """``stop`` が呼び出されるまで取得を繰り返す
+
+        Parameters
+        ----------
+        max_cycles : int, default None
+            取得する最大の回数。指定しなければ制限しない
+        """
+        try:
+            while not self._stop.is_set():
+                wait = self.cycle()
+                if max_cycles is not None and self.cycles >= max_cycles:
+                    break
+                self.wait(wait)
+        finally:
+            self.close()
+
+    def close(self):
+        "ストレージに保留中の値を書き込んで閉じ、セッションを閉じる"
+        if self.storage is not None:
+            self.storage.close()
+        if self.session is not None:
+            self.session.close()
+
+    def stats(self):
+        """サービスの状態を返す
+
+        Returns
+        -------
+        dict
+            取得回数、例外の回数、到着率、取得の間隔、最後の取得にかかった秒数を格納した辞書
+        """
+        return {"cycles": self.cycles, "errors": self.errors,
+                "rate": self.interval.rate,
+                "interval": self.interval.interval,
+                "last_cycle_seconds": self.last_cycle_seconds}
+
+
+def serve(api, url, handler=None, names=None, flush_interval=60,
+          pool_maxsize=10, max_cycles=None, **interval_kwargs):
+    """ストレージ、タイムライン、セッションを作成してサービスを実行する
+
+    Parameters
+    ----------
+    api : tweepy.api.API
+        tweepyでユーザー認証したTwitterAPIのラッパー
+    url : str
+        ストレージのデータベースのurl
+    handler : callable, default None
+        取得したツイートのリストとHTTPのセッションを受け取る関数
+    names : list of str, default None
+        ``home_timeline`` 以外に登録するタイムラインの名前
+    flush_interval : float, default 60
+        ストレージに書き込む間隔の秒数
+    pool_maxsize : int, default 10
+        HTTPのセッションが保持するコネクションの最大数
+    max_cycles : int, default None
+        取得する最大の回数。指定しなければシグナルを受け取るまで続ける
+    **interval_kwargs
+        ``AdaptiveInterval`` に渡すキーワード引数
+
+    Returns
+    -------
+    Service
+        終了したサービス
+    """
+    storage = TimelineIndexStorage(url, write_behind=True,
+                                   flush_interval=flush_interval)
+    # レート制限の待機中でもシグナルを受け取ったらすぐに終了する
+    budget = RateLimitBudget(sleep=lambda seconds: service.wait(seconds))
+    timeline = Timeline(api, storage, budget=budget)
+    for name in names or ():
+        timeline.register(name)
+    session = create_session(pool_maxsize=pool_maxsize)
+
+    def handle(tweets):
+        if handler is not None:
+            handler(tweets, session)
+
+    service = Service(timeline, handler=handle,
+                      interval=AdaptiveInterval(**interval_kwargs),
+                      storage=storage, session=session)
+    handlers = service.install_signal_handlers()
+    try:
+        service.run(max_cycles=max_cycles)
+    finally:
+        for signum, previous in handlers.items():
+            signal.signal(signum, previous)
+    return service
@@ -1,15 +1,77 @@
-import sqlalchemy.orm as orm
-from sqlalchemy import create_engine
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
-from twissify.tables import TimelineIndex
+from twissify import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# SQLAlchemy、NumPyとテーブルの定義は読み込みに時間がかかるため、
+# それぞれのクラスを最初に使うときに読み込む
+
+
+def _create_session(url, table):
+    "データベースのエンジンと ``table`` のメタデータのテーブルを作成する"
+    import sqlalchemy.orm as orm
+    from sqlalchemy import create_engine
+
+    engine = create_engine(url)
+    table.metadata.create_all(engine)
+    return engine, orm.scoped_session(orm.sessionmaker(bind=engine))
+
+
+def _upsert_dialect(engine):
+    "``INSERT ... ON CONFLICT`` を使えるデータベースのdialectを返す。使えなければ ``None``"
+    name = engine.dialect.name
+    if name not in ("sqlite", "postgresql"):
+        return None
+    return importlib.import_module("sqlalchemy.dialects." + name)
 
 
 class TimelineIndexStorage:
-    "各タイムラインの ``since_id`` と ``max_id`` の保存、更新を行うクラス"
-    def __init__(self, url):
-        self.engine = create_engine(url)
-        TimelineIndex.metadata.create_all(self.engine)
-        self.session = orm.scoped_session(orm.sessionmaker(bind=self.engine))
+    """各タイムラインの ``since_id`` と ``max_id`` の保存、更新を行うクラス
+
+    ``write_behind=True`` のときは ``save_ids`` と ``advance_ids`` で保存した値をメモリ上に保持し、
+    ``flush`` を呼び出したとき、前回の書き込みから ``flush_interval`` 秒が
+    経過した後に保存したか ``flush_if_due`` を呼び出したとき、または ``close`` したときに
+    1つのトランザクションでまとめて書き込む。
+    タイマーは使わないため、保存が止まると ``flush_if_due`` を呼び出すまで書き込まれない。
+    書き込みが保証されるのは ``flush`` か ``close`` を呼び出したときだけである
+    """
+    def __init__(self, url, write_behind=False, flush_interval=None):
+        """
+        Parameters
+        ----------
+        url : str
+            SQLAlchemyのデータベースurl
+        write_behind : bool, default False
+            ``save_ids`` の書き込みをまとめて行うかどうか
+        flush_interval : float, default None
+            ``write_behind=True`` のときに書き込む間隔の秒数。
+            指定しなければ ``flush`` か ``close`` を呼び出すまで書き込まない
+        """
+        from twissify.tables import TimelineIndex
+
+        self.engine, self.session = _create_session(url, TimelineIndex)
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _create(self, name, since_id=None, max_id=None):
         """
@@ -18,6 +80,8 @@ class TimelineIndexStorage:
         ValueError
             既に同一の ``name`` が存在するとき
         """
+        from twissify.tables import TimelineIndex
+
         session = self.session()
         timelineindex = TimelineIndex.find_by_name(name, session)
         if timelineindex is not None:
@@ -35,17 +99,118 @@ class TimelineIndexStorage:
         ValueError
             対応する ``name`` が存在しないとき
         """
+        from twissify.tables import TimelineIndex
+
         session = self.session()
         timelineindex = TimelineIndex.find_by_name(name, session)
         if timelineindex is None:
             raise ValueError(("`name`: '{name}' dosen't exist.")
                              .format(name=name))
 
-        row = TimelineIndex.find_by_name(name, session)
-        row.since_id = since_id
-        row.max_id = max_id
+        timelineindex.since_id = since_id
+        timelineindex.max_id = max_id
         session.commit()
 
+    def _write(self, upserts, advances):
+        """``upserts`` と ``advances`` を1つのトランザクションで書き込む
+
+        Returns
+        -------
+        list of bool
+            ``advances`` のそれぞれのレコードを作成、または更新したかどうか
+        """
+        session = self.session()
+        try:
+            if upserts:
+                self._execute_upsert(session, upserts)
+            results = self._execute_advance(session, advances)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return results
+
+    def _upsert(self, rows):
+        "``rows`` の全てのレコードを1つのトランザクションで作成、または更新する"
+        self._write(rows, [])
+
+    def _advance(self, rows):
+        """``rows`` のレコードを ``since_id`` が大きくなるときだけ作成、または更新する
+
+        Returns
+        -------
+        list of bool
+            それぞれのレコードを作成、または更新したかどうか
+        """
+        return self._write([], rows)
+
+    def _execute_upsert(self, session, rows):
+        """``rows`` の全てのレコードを作成、または更新する
+
+        SQLiteとPostgreSQLでは ``INSERT ... ON CONFLICT`` の1文で書き込み、
+        それ以外のデータベースでは ``Session.merge`` を使う
+        """
+        from twissify.tables import TimelineIndex
+
+        dialect = _upsert_dialect(self.engine)
+        if dialect is not None:
+            statement = dialect.insert(TimelineIndex.__table__)
+            statement = statement.on_conflict_do_update(
+                index_elements=[TimelineIndex.name],
+                set_={"since_id": statement.excluded.since_id,
+                      "max_id": statement.excluded.max_id})
+            session.execute(statement, rows)
+        else:
+            for row in rows:
+                session.merge(TimelineIndex(**row))
+
+    def _execute_advance(self, session, rows):
+        """``rows`` のレコードを ``since_id`` が大きくなるときだけ作成、または更新する
+
+        SQLiteとPostgreSQLでは条件付きの ``INSERT ... ON CONFLICT DO UPDATE`` の1文で
+        比較と書き込みを行うため、最初のレコードを同時に作成しようとしても
+        大きい ``since_id`` が失われない
+
+        Returns
+        -------
+        list of bool
+            それぞれのレコードを作成、または更新したかどうか
+        """
+        from sqlalchemy import exc, or_
+        from twissify.tables import TimelineIndex
+
+        table = TimelineIndex.__table__
+        dialect = _upsert_dialect(self.engine)
+        results = []
+        for row in rows:
+            if dialect is not None:
+                statement = dialect.insert(table).values(**row)
+                statement = statement.on_conflict_do_update(
+                    index_elements=["name"],
+                    set_={"since_id": statement.excluded.since_id,
+                          "max_id": statement.excluded.max_id},
+                    where=or_(table.c.since_id.is_(None),
+                              table.c.since_id < statement.excluded.since_id))
+                results.append(session.execute(statement).rowcount == 1)
+                continue
+
+            update = (table.update()
+                      .where(table.c.name == row["name"])
+                      .where(or_(table.c.since_id.is_(None),
+                                 table.c.since_id < row["since_id"]))
+                      .values(since_id=row["since_id"], max_id=row["max_id"]))
+            won = session.execute(update).rowcount == 1
+            if not won:
+                try:
+                    with session.begin_nested():
+                        session.execute(table.insert().values(**row))
+                    won = True
+                except exc.IntegrityError:
+                    # 他の書き込みが先に作成したときは、改めて比較して更新する
+                    won = session.execute(update).rowcount == 1
+            results.append(won)
+        return results
+
     def create_ids(self, name, tweets):
         """タイムラインから ``name`` に対応するレコードを新しく作成する
 
@@ -70,6 +235,7 @@ class TimelineIndexStorage:
         """
         self._update(name, tweets.since_id, tweets.max_id)
 
+    @metrics.instrument("storage_get_ids")
     def get_ids(self, name):
         """``name`` に対応するレコードを返す
 
@@ -83,5 +249,840 @@ class TimelineIndexStorage:
         TimelineIndex
             ``since_id`` と ``max_id`` をフィールドとして持つレコード
         """
+        from twissify.tables import TimelineIndex
+
+        if self.write_behind:
+            with self._pending_lock:
+                ids = self._pending.get(name)
+            if ids is not None:
+                return TimelineIndex(name=name, since_id=ids[0],
+                                     max_id=ids[1])
+
         session = self.session()
         return TimelineIndex.find_by_name(name, session)
+
+    @metrics.instrument("storage_save_ids")
+    def save_ids(self, name, since_id, max_id):
+        """``name`` に対応するレコードを作成、または更新する
+
+        ``write_behind=True`` のときはメモリ上に保持するだけで書き込まない
+
+        Parameters
+        ----------
+        name : str
+            名前の文字列
+        since_id : int
+            保存する ``since_id``
+        max_id : int
+            保存する ``max_id``
+        """
+        if not self.write_behind:
+            self._upsert([{"name": name, "since_id": since_id,
+                           "max_id": max_id}])
+            return
+
+        with self._pending_lock:
+            self._pending[name] = (since_id, max_id, False)
+        self.flush_if_due()
+
+    @metrics.instrument("storage_advance_ids")
+    def advance_ids(self, name, since_id, max_id):
+        """``since_id`` が保存されている値より大きいときだけレコードを作成、または更新する
+
+        複数のプロセスが同じデータベースを使うときに、遅れて書き込んだプロセスが
+        ``since_id`` を巻き戻さないように、比較と更新を1つのUPDATE文で行う
+
+        Parameters
+        ----------
+        name : str
+            名前の文字列
+        since_id : int
+            保存する ``since_id``
+        max_id : int
+            保存する ``max_id``
+
+        Returns
+        -------
+        bool
+            作成、または更新したかどうか
+
+        Notes
+        -----
+        ``write_behind=True`` のときはメモリ上に保持している値とだけ比較し、
+        データベースとの比較は書き込むときに行う
+        """
+        if not self.write_behind:
+            return self._advance([{"name": name, "since_id": since_id,
+                                   "max_id": max_id}])[0]
+
+        with self._pending_lock:
+            current = self._pending.get(name)
+            if (current is not None and current[0] is not None
+                    and since_id <= current[0]):
+                return False
+            conditional = True if current is None else current[2]
+            self._pending[name] = (since_id, max_id, conditional)
+        self.flush_if_due()
+        return True
+
+    def flush_if_due(self):
+        """前回の書き込みから ``flush_interval`` 秒が経過していれば書き込む
+
+        保存が止まった後も定期的に書き込むように、常駐するプロセスは
+        取得のたびに呼び出す
+        """
+        if (self.flush_interval is not None
+                and time.monotonic() - self._flushed_at
+                >= self.flush_interval):
+            self.flush()
+
+    @metrics.instrument("storage_flush")
+    def flush(self):
+        "メモリ上に保持している ``since_id`` と ``max_id`` を1つのトランザクションで書き込む"
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        rows = {False: [], True: []}
+        for name, (since_id, max_id, conditional) in pending.items():
+            rows[conditional].append({"name": name, "since_id": since_id,
+                                      "max_id": max_id})
+        if rows[False] or rows[True]:
+            self._write(rows[False], rows[True])
+
+    @metrics.instrument("storage_close")
+    def close(self):
+        "保持している値を書き込み、データベースとの接続を閉じる"
+        self.flush()
+        self.session.remove()
+        self.engine.dispose()
+
+    @metrics.instrument("storage_add_gap")
+    def add_gap(self, name, since_id, max_id):
+        """``name`` のタイムラインで取得できていない範囲を保存する
+
+        Parameters
+        ----------
+        name : str
+            名前の文字列
+        since_id : int
+            取得できていない範囲の下限。この値を超えるIDが範囲に含まれる
+        max_id : int
+            取得できていない範囲の上限。この値以下のIDが範囲に含まれる
+        """
+        from twissify.tables import TimelineGap
+
+        session = self.session()
+        session.add(TimelineGap(name=name, since_id=since_id, max_id=max_id))
+        session.commit()
+
+    @metrics.instrument("storage_get_gaps")
+    def get_gaps(self, name):
+        """``name`` のタイムラインで取得できていない範囲を新しい順に返す
+
+        Parameters
+        ----------
+        name : str
+            名前の文字列
+
+        Returns
+        -------
+        list of TimelineGap
+            ``since_id`` と ``max_id`` をフィールドとして持つレコード
+        """
+        from twissify.tables import TimelineGap
+
+        session = self.session()
+        return TimelineGap.find_by_name(name, session)
+
+    @metrics.instrument("storage_update_gap")
+    def update_gap(self, id, max_id):
+        """取得できていない範囲の上限を更新する
+
+        Parameters
+        ----------
+        id : int
+            ``TimelineGap`` のID
+        max_id : int
+            新しい上限
+
+        Raises
+        ------
+        ValueError
+            対応する ``id`` が存在しないとき
+        """
+        from twissify.tables import TimelineGap
+
+        session = self.session()
+        row = TimelineGap.find_by_id(id, session)
+        if row is None:
+            raise ValueError(("`id`: '{id}' dosen't exist.").format(id=id))
+        row.max_id = max_id
+        session.commit()
+
+    @metrics.instrument("storage_delete_gap")
+    def delete_gap(self, id):
+        """取得し終えた範囲を削除する
+
+        Parameters
+        ----------
+        id : int
+            ``TimelineGap`` のID
+        """
+        from twissify.tables import TimelineGap
+
+        session = self.session()
+        session.query(TimelineGap).filter(TimelineGap.id == id).delete()
+        session.commit()
+
+
+class ProcessedTweetStorage:
+    """処理済みのツイートと分類結果の保存、確認を行うクラス
+
+    保存済みのツイートIDをBloomフィルターにも保持しておき、
+    フィルターで処理済みの可能性があると判定されたIDだけをデータベースで確認する。
+    Bloomフィルターには作成したときに保存されていたIDと、このオブジェクトで
+    保存したIDしか追加されないため、既定では1つのプロセスだけが書き込むことを前提とする。
+    複数のプロセスが同じデータベースに書き込むときは ``refresh_interval`` を指定すると、
+    確認する前に他のプロセスが保存したIDをBloomフィルターに追加する
+    """
+    _chunk_size = 500
+    # 書き込みの遅れと時計のずれを吸収するため、前回の読み込みより前に遡る秒数
+    _refresh_overlap = 60
+
+    def __init__(self, url, capacity=1000000, error_rate=0.01,
+                 refresh_interval=None):
+        """
+        Parameters
+        ----------
+        url : str
+            SQLAlchemyのデータベースurl
+        capacity : int, default 1000000
+            Bloomフィルターに追加するツイートIDの想定数
+        error_rate : float, default 0.01
+            Bloomフィルターの偽陽性率
+        refresh_interval : float, default None
+            他のプロセスが保存したIDをBloomフィルターに追加する間隔の秒数。
+            指定しなければ追加しない
+        """
+        from twissify.bloom import BloomFilter
+        from twissify.tables import ProcessedTweet
+
+        self.engine, self.session = _create_session(url, ProcessedTweet)
+        self.bloom = BloomFilter(capacity, error_rate=error_rate)
+        self.refresh_interval = refresh_interval
+        self._load_bloom()
+
+    def _load_bloom(self, since=None):
+        from twissify.tables import ProcessedTweet
+
+        self._loaded_at = datetime.utcnow()
+        self._refreshed_at = time.monotonic()
+        session = self.session()
+        query = session.query(ProcessedTweet.tweet_id)
+        if since is not None:
+            query = query.filter(ProcessedTweet.processed_at >= since)
+        chunk = []
+        for (tweet_id,) in query.yield_per(10000):
+            chunk.append(tweet_id)
+            if len(chunk) == 10000:
+                self.bloom.add_many(chunk)
+                chunk = []
+        if chunk:
+            self.bloom.add_many(chunk)
+        session.commit()
+
+    def refresh(self):
+        "前回の読み込みの後に他のプロセスが保存したツイートIDをBloomフィルターに追加する"
+        self._load_bloom(since=self._loaded_at
+                         - timedelta(seconds=self._refresh_overlap))
+
+    def _refresh_if_due(self):
+        if (self.refresh_interval is not None
+                and time.monotonic() - self._refreshed_at
+                >= self.refresh_interval):
+            self.refresh()
+
+    def add(self, tweet_id, media_hash=None, verdict=None):
+        """処理済みのツイートを保存する
+
+        Parameters
+        ----------
+        tweet_id : int
+            ツイートID
+        media_hash : str, default None
+            画像urlのハッシュ値
+        verdict : str, default None
+            分類結果
+        """
+        self.add_many([(tweet_id, media_hash, verdict)])
+
+    def add_many(self, records):
+        """処理済みのツイートをまとめて保存する
+
+        既に保存されているツイートIDは上書きする
+
+        Parameters
+        ----------
+        records : iterable of tuple of int, str and str
+            ツイートID、画像urlのハッシュ値、分類結果のタプルのイテラブル
+        """
+        from twissify.tables import ProcessedTweet
+
+        rows = [{"tweet_id": tweet_id, "media_hash": media_hash,
+                 "verdict": verdict, "processed_at": datetime.utcnow()}
+                for tweet_id, media_hash, verdict in records]
+        if not rows:
+            return
+
+        session = self.session()
+        dialect = _upsert_dialect(self.engine)
+        if dialect is not None:
+            statement = dialect.insert(ProcessedTweet.__table__)
+            statement = statement.on_conflict_do_update(
+                index_elements=[ProcessedTweet.tweet_id],
+                set_={name: getattr(statement.excluded, name)
+                      for name in ("media_hash", "verdict", "processed_at")})
+            session.execute(statement, rows)
+        else:
+            for row in rows:
+                session.merge(ProcessedTweet(**row))
+        session.commit()
+        self.bloom.add_many([row["tweet_id"] for row in rows])
+
+    def contains_many(self, tweet_ids):
+        """保存済みのツイートIDをまとめて確認する
+
+        ``refresh_interval`` を指定したときは、前回の読み込みから
+        その秒数が経過していれば先にBloomフィルターを更新する
+
+        Parameters
+        ----------
+        tweet_ids : iterable of int
+            ツイートID
+
+        Returns
+        -------
+        set of int
+            ``tweet_ids`` のうち保存済みのツイートID
+        """
+        from twissify.tables import ProcessedTweet
+
+        tweet_ids = list(tweet_ids)
+        if not tweet_ids:
+            return set()
+
+        self._refresh_if_due()
+        maybe = self.bloom.contains_many(tweet_ids)
+        candidates = [int(tweet_id)
+                      for tweet_id, flag in zip(tweet_ids, maybe) if flag]
+        found = set()
+        session = self.session()
+        for i in range(0, len(candidates), self._chunk_size):
+            chunk = candidates[i:i + self._chunk_size]
+            query = (session.query(ProcessedTweet.tweet_id)
+                     .filter(ProcessedTweet.tweet_id.in_(chunk)))
+            found.update(tweet_id for (tweet_id,) in query)
+        session.commit()
+        return found
+
+    def __contains__(self, tweet_id):
+        return bool(self.contains_many([tweet_id]))
+
+    def filter_processed_tweets(self, tweets):
+        """保存済みのツイートを取り除く
+
+        Parameters
+        ----------
+        tweets : tweepy.models.ResultSet or array-like of tweepy.models.Status
+            ツイートオブジェクトを格納したリスト風のオブジェクト
+
+        Returns
+        -------
+        list of tweepy.models.Status
+            保存済みではないツイートオブジェクトを格納したリスト
+        """
+        tweets = list(tweets)
+        processed = self.contains_many(tweet.id for tweet in tweets)
+        return [tweet for tweet in tweets if tweet.id not in processed]
+
+    def get(self, tweet_id):
+        """ツイートIDに対応するレコードを返す
+
+        Returns
+        -------
+        ProcessedTweet or None
+            画像urlのハッシュ値と分類結果をフィールドとして持つレコード
+        """
+        from twissify.tables import ProcessedTweet
+
+        session = self.session()
+        rows = ProcessedTweet.find_by_tweet_ids([tweet_id], session)
+        return rows[0] if rows else None
+
+    def find_by_media_hash(self, media_hash):
+        """画像urlのハッシュ値が一致するレコードを新しい順に返す
+
+        同じ画像の分類結果を再利用するために使う
+
+        Returns
+        -------
+        list of ProcessedTweet
+        """
+        from twissify.tables import ProcessedTweet
+
+        session = self.session()
+        return ProcessedTweet.find_by_media_hash(media_hash, session)
+
+
+def _build_index(ids, rows):
+    """IDの昇順に並べた重複のないIDと、それぞれの最後の行番号を返す
+
+    ``rows`` が昇順のとき、同じIDの中では最後に追記した行が残る
+    """
+    import numpy as np
+
+    order = np.argsort(ids, kind="stable")
+    ids = np.asarray(ids)[order]
+    rows = np.asarray(rows)[order]
+    if len(ids) == 0:
+        return ids, rows
+    last = np.append(ids[1:] != ids[:-1], True)
+    return ids[last], rows[last]
+
+
+class FeatureStore:
+    """特徴量とラベルを追記専用のファイルに保存し、 ``numpy.memmap`` で読み込むクラス
+
+    特徴量、ID、ラベルはそれぞれ固定長のバイナリファイルに追記され、
+    有効な行数は ``meta.json`` に記録される。 ``meta.json`` は書き込みの最後に
+    ``os.replace`` で置き換えるため、読み込み側が書き込み途中の行を見ることはない。
+    IDの昇順に並べたIDと行番号は索引ファイルとして保存され、 ``numpy.searchsorted`` で引く。
+    追記したときは追記した行だけの索引(差分)を書き込み、差分の行数が元の索引を
+    超えたときと ``compact`` したときに1つの索引にまとめる。
+    複数のプロセスが索引を含む同じファイルをページキャッシュ経由で共有できるため、
+    起動時に索引を作る必要がない。
+    ``compact`` で置き換えた古いファイルは、開こうとしているプロセスのために
+    次の ``compact`` まで残す
+
+    Attributes
+    ----------
+    directory : str
+        ファイルを保存するディレクトリのパス
+    dim : int
+        特徴量の次元数
+    dtype : numpy.dtype
+        特徴量の型。 ``float16`` か ``float32``
+    """
+    _dtypes = ("float16", "float32")
+    _meta_name = "meta.json"
+    _lock_name = "lock"
+    # 差分の索引の最大数。超えたときは差分どうしをまとめる
+    _max_deltas = 16
+
+    def __init__(self, directory, dim=None, dtype="float32"):
+        """
+        Parameters
+        ----------
+        directory : str
+            ファイルを保存するディレクトリのパス
+        dim : int, default None
+            特徴量の次元数。新しく作成するときは必須
+        dtype : str, default "float32"
+            新しく作成するときの特徴量の型。 ``"float16"`` か ``"float32"``
+
+        Raises
+        ------
+        ValueError
+            ``dim`` や ``dtype`` が保存されているものと異なるとき
+        """
+        import numpy as np
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta = self._read_meta()
+        if meta is None:
+            if dim is None:
+                raise ValueError("`dim` is required to create a store.")
+            if str(dtype) not in self._dtypes:
+                raise ValueError(("`dtype` must be one of {dtypes}.")
+                                 .format(dtypes=self._dtypes))
+            meta = {"dim": int(dim), "dtype": str(dtype), "count": 0,
+                    "generation": 0}
+            with self._lock():
+                if self._read_meta() is None:
+                    self._write_meta(meta)
+            meta = self._read_meta()
+        elif dim is not None and dim != meta["dim"]:
+            raise ValueError(("`dim` must be {dim}.")
+                             .format(dim=meta["dim"]))
+
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self._meta = None
+        self.refresh()
+
+    def __len__(self):
+        return self._meta["count"]
+
+    def __contains__(self, id):
+        return bool(self._lookup([id])[0] >= 0)
+
+    def _path(self, name, generation=None):
+        generation = (self._meta["generation"] if generation is None
+                      else generation)
+        return os.path.join(self.directory,
+                            "{name}-{generation}.bin"
+                            .format(name=name, generation=generation))
+
+    def _index_path(self, generation, count):
+        return os.path.join(self.directory,
+                            "index-{generation}-{count}.bin"
+                            .format(generation=generation, count=count))
+
+    def _delta_path(self, generation, start, end):
+        return os.path.join(self.directory,
+                            "delta-{generation}-{start}-{end}.bin"
+                            .format(generation=generation, start=start,
+                                    end=end))
+
+    @staticmethod
+    def _indexed(meta):
+        "1つにまとめた索引の行数と差分の行の範囲のリスト"
+        # 差分を導入する前の meta.json は全ての行を1つの索引にまとめている
+        return meta.get("indexed", meta["count"]), meta.get("deltas", [])
+
+    def _index_files(self, meta):
+        "``meta`` が参照する索引ファイルの名前"
+        indexed, deltas = self._indexed(meta)
+        paths = [self._delta_path(meta["generation"], start, end)
+                 for start, end in deltas]
+        if indexed:
+            paths.append(self._index_path(meta["generation"], indexed))
+        return {os.path.basename(path) for path in paths}
+
+    def _columns(self):
+        import numpy as np
+
+        return (("features", self.dtype, (self.dim,)),
+                ("ids", np.dtype(np.int64), ()),
+                ("labels", np.dtype(np.int64), ()))
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.directory, self._meta_name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, self._meta_name))
+
+    @contextmanager
+    def _lock(self):
+        "書き込むプロセスを1つに制限するためのファイルロック"
+        with open(os.path.join(self.directory, self._lock_name), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """他のプロセスが追記、圧縮した内容を読み込み直す
+
+        Returns
+        -------
+        bool
+            内容が変わっていたかどうか
+        """
+        import numpy as np
+
+        meta = self._read_meta()
+        if meta == self._meta:
+            return False
+
+        self._meta = meta
+        count = meta["count"]
+        for name, dtype, shape in self._columns():
+            if count == 0:
+                array = np.empty((0,) + shape, dtype=dtype)
+            else:
+                array = np.memmap(self._path(name), dtype=dtype, mode="r",
+                                  shape=(count,) + shape)
+            setattr(self, name, array)
+        self._base, self._deltas = self._read_index(meta)
+        return True
+
+    def _read_index(self, meta):
+        """1つにまとめた索引と差分の索引を読み込む
+
+        索引ファイルがないとき(続けて書き込まれて削除されたときなど)は
+        IDのファイルから作り直す
+        """
+        import numpy as np
+
+        def read(path):
+            index = np.memmap(path, dtype=np.int64, mode="r").reshape(2, -1)
+            return index[0], index[1]
+
+        if meta["count"] == 0:
+            return None, []
+        indexed, deltas = self._indexed(meta)
+        generation = meta["generation"]
+        try:
+            base = (read(self._index_path(generation, indexed)) if indexed
+                    else None)
+            return base, [read(self._delta_path(generation, start, end))
+                          for start, end in deltas]
+        except FileNotFoundError:
+            return _build_index(self.ids, np.arange(meta["count"])), []
+
+    def _runs(self):
+        "索引を古い順に返す"
+        return ([] if self._base is None else [self._base]) + self._deltas
+
+    def _merged_index(self, runs):
+        "``runs`` を1つの索引にまとめる。同じIDは新しい索引の行を残す"
+        import numpy as np
+
+        if not runs:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        return _build_index(np.concatenate([ids for ids, _ in runs]),
+                            np.concatenate([rows for _, rows in runs]))
+
+    def _write_index(self, path, ids, rows):
+        import numpy as np
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(rows, dtype=np.int64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove_indexes(self, generation, keep):
+        "``generation`` の索引ファイルのうち ``keep`` 以外を削除する"
+        prefixes = ("index-{generation}-".format(generation=generation),
+                    "delta-{generation}-".format(generation=generation))
+        for name in os.listdir(self.directory):
+            if (name.startswith(prefixes) and name.endswith(".bin")
+                    and name not in keep):
+                self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _lookup(self, ids):
+        "IDに対応する行番号を返す。保存されていないIDは ``-1``"
+        import numpy as np
+
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        for run_ids, run_rows in self._runs():
+            positions = np.searchsorted(run_ids, ids)
+            found = positions < len(run_ids)
+            found[found] = run_ids[positions[found]] == ids[found]
+            rows[found] = run_rows[positions[found]]
+        return rows
+
+    def rows(self, ids):
+        """IDに対応する行番号を返す
+
+        同じIDが複数あるときは最後に追記した行を返す
+
+        Parameters
+        ----------
+        ids : array-like of int
+            ID
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(N,)`` の行番号
+
+        Raises
+        ------
+        KeyError
+            保存されていないIDが含まれるとき
+        """
+        import numpy as np
+
+        rows = self._lookup(ids)
+        missing = rows < 0
+        if missing.any():
+            raise KeyError(int(np.asarray(ids).reshape(-1)[missing][0]))
+        return rows
+
+    def get(self, ids):
+        """IDに対応する特徴量とラベルを返す
+
+        Parameters
+        ----------
+        ids : array-like of int
+            ID
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            ``(N, dim)`` の特徴量と ``(N,)`` のラベルのタプル
+
+        Raises
+        ------
+        KeyError
+            保存されていないIDが含まれるとき
+        """
+        rows = self.rows(ids)
+        return self.features[rows], self.labels[rows]
+
+    def append(self, ids, features, labels=None):
+        """特徴量とラベルを追記する
+
+        Parameters
+        ----------
+        ids : array-like of int
+            ``(N,)`` のID。既に保存されているIDは新しい行で上書きされる
+        features : array-like of float
+            ``(N, dim)`` の特徴量
+        labels : array-like of int, default None
+            ``(N,)`` のラベル。指定しなければ ``-1``
+        """
+        import numpy as np
+
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        features = np.asarray(features, dtype=self.dtype)
+        if features.shape != (len(ids), self.dim):
+            raise ValueError(("`features` must have shape ({n}, {dim}).")
+                             .format(n=len(ids), dim=self.dim))
+        if labels is None:
+            labels = np.full(len(ids), -1, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        if len(labels) != len(ids):
+            raise ValueError("`labels` must have the same length as `ids`.")
+
+        with self._lock():
+            self._meta = None
+            self.refresh()
+            meta = dict(self._meta)
+            count = meta["count"]
+            for (name, dtype, shape), values in zip(
+                    self._columns(), (features, ids, labels)):
+                path = self._path(name, meta["generation"])
+                with open(path, "ab") as f:
+                    # 前回の書き込みが途中で失敗したときの余分な末尾を捨てる
+                    f.truncate(count * dtype.itemsize * int(np.prod(shape)))
+                    f.write(np.ascontiguousarray(values).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            previous = dict(meta)
+            meta["indexed"], meta["deltas"] = self._indexed(meta)
+            meta["count"] = count + len(ids)
+            self._append_index(meta, _build_index(
+                ids, np.arange(count, meta["count"])))
+            self._write_meta(meta)
+            # 古い meta.json を読んだ直後のプロセスのために1つ前の索引は残す
+            self._remove_indexes(meta["generation"],
+                                 self._index_files(previous)
+                                 | self._index_files(meta))
+        self.refresh()
+
+    def _append_index(self, meta, delta):
+        """追記した行の索引 ``delta`` を書き込み、 ``meta`` を更新する
+
+        差分の行数が1つにまとめた索引の行数を超えたときは全てを1つにまとめ、
+        差分の数が ``_max_deltas`` を超えたときは差分どうしをまとめる。
+        どちらも書き直す行数は前回から倍以上に増えているため、
+        1行あたりの書き込みは償却して ``O(log N)`` になる
+        """
+        generation, count = meta["generation"], meta["count"]
+        indexed, deltas = self._indexed(meta)
+        if count - indexed > indexed:
+            self._write_index(self._index_path(generation, count),
+                              *self._merged_index(self._runs() + [delta]))
+            indexed, deltas = count, []
+        elif len(deltas) >= self._max_deltas:
+            start = deltas[0][0]
+            self._write_index(self._delta_path(generation, start, count),
+                              *self._merged_index(self._deltas + [delta]))
+            deltas = [[start, count]]
+        else:
+            start = deltas[-1][1] if deltas else indexed
+            self._write_index(self._delta_path(generation, start, count),
+                              *delta)
+            deltas = deltas + [[start, count]]
+        meta.update(indexed=indexed, deltas=deltas)
+
+    def compact(self):
+        """上書きされた古い行を取り除いたファイルに置き換え、索引を1つにまとめる
+
+        前回の ``compact`` で置き換えたファイルはここで削除する
+
+        Returns
+        -------
+        int
+            取り除いた行の数
+        """
+        import numpy as np
+
+        with self._lock():
+            self._meta = None
+            self.refresh()
+            meta = dict(self._meta)
+            self._remove_generations(meta["generation"])
+            index_ids, index_rows = self._merged_index(self._runs())
+            removed = len(self) - len(index_rows)
+            if removed == 0:
+                if self._indexed(meta) != (len(self), []):
+                    self._write_index(
+                        self._index_path(meta["generation"], len(self)),
+                        index_ids, index_rows)
+                    previous = dict(meta)
+                    meta.update(indexed=len(self), deltas=[])
+                    self._write_meta(meta)
+                    self._remove_indexes(meta["generation"],
+                                         self._index_files(previous)
+                                         | self._index_files(meta))
+                    self.refresh()
+                return 0
+
+            rows = np.sort(index_rows)
+            generation = meta["generation"] + 1
+            for name, _, _ in self._columns():
+                values = getattr(self, name)[rows]
+                with open(self._path(name, generation), "wb") as f:
+                    f.write(np.ascontiguousarray(values).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._write_index(self._index_path(generation, len(rows)),
+                              *_build_index(self.ids[rows],
+                                            np.arange(len(rows))))
+            meta.update(count=len(rows), generation=generation,
+                        indexed=len(rows), deltas=[])
+            self._write_meta(meta)
+            self.refresh()
+        return removed
+
+    def _remove_generations(self, generation):
+        """``generation`` より前の世代のファイルを削除する
+
+        古い ``meta.json`` を読んだ直後のプロセスが開けるように、
+        ``compact`` で置き換えた世代は次の ``compact`` まで残す
+        """
+        prefixes = tuple(name + "-" for name, _, _ in self._columns())
+        for name in os.listdir(self.directory):
+            if not (name.startswith(prefixes + ("index-", "delta-"))
+                    and name.endswith(".bin")):
+                continue
+            if int(name[:-4].split("-")[1]) < generation:
+                self._remove(name)
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -9,8 +11,8 @@ class TimelineIndex(Base):
     __tablename__ = "TimelineIndex"
 
     name = Column(String, primary_key=True)
-    since_id = Column(Integer)
-    max_id = Column(Integer)
+    since_id = Column(BigInteger)
+    max_id = Column(BigInteger)
 
     def __repr__(self):
         return ((self.__class__.__name__
@@ -29,3 +31,62 @@ class TimelineIndex(Base):
     def all(cls, session):
         "全てのレコードを返す"
         return session.query(cls).all()
+
+
+class TimelineGap(Base):
+    __tablename__ = "TimelineGap"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, index=True, nullable=False)
+    since_id = Column(BigInteger)
+    max_id = Column(BigInteger)
+
+    def __repr__(self):
+        return ((self.__class__.__name__
+                + "(id={id}, name={name}, since_id={since_id}, "
+                  "max_id={max_id})")
+                .format(id=self.id,
+                        name=self.name,
+                        since_id=self.since_id,
+                        max_id=self.max_id))
+
+    @classmethod
+    def find_by_name(cls, name, session):
+        "名前に対応するレコードを新しい順に返す"
+        return (session.query(cls).filter(cls.name == name)
+                .order_by(cls.max_id.desc()).all())
+
+    @classmethod
+    def find_by_id(cls, id, session):
+        "IDに対応するレコードを返す"
+        return session.query(cls).filter(cls.id == id).one_or_none()
+
+
+class ProcessedTweet(Base):
+    __tablename__ = "ProcessedTweet"
+
+    tweet_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    media_hash = Column(String, index=True)
+    verdict = Column(String)
+    processed_at = Column(DateTime, default=datetime.utcnow, nullable=False,
+                          index=True)
+
+    def __repr__(self):
+        return ((self.__class__.__name__
+                + "(tweet_id={tweet_id}, media_hash={media_hash}, "
+                  "verdict={verdict}, processed_at={processed_at})")
+                .format(tweet_id=self.tweet_id,
+                        media_hash=self.media_hash,
+                        verdict=self.verdict,
+                        processed_at=self.processed_at))
+
+    @classmethod
+    def find_by_tweet_ids(cls, tweet_ids, session):
+        "ツイートIDに対応するレコードを返す"
+        return session.query(cls).filter(cls.tweet_id.in_(tweet_ids)).all()
+
+    @classmethod
+    def find_by_media_hash(cls, media_hash, session):
+        "画像urlのハッシュ値に対応するレコードを返す"
+        return (session.query(cls).filter(cls.media_hash == media_hash)
+                .order_by(cls.processed_at.desc()).all())
@@ -1,12 +1,28 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from twissify import metrics
+from twissify.api import merge_tweets
+from twissify.ratelimit import GAP, POLL
+
+
 class Timeline:
     """タイムラインの取得と ``since_id`` と ``max_id`` を保存、取得するクラス
 
+    ``home_timeline`` は最初から登録されており、その他のタイムラインは
+    ``register`` で名前を付けて登録する。
+    ``budget`` を指定すると、APIを呼び出す前に名前の ``:`` より前の部分を
+    エンドポイントとして呼び出しの予算を確保する。レスポンスヘッダーは
+    共有される ``api.last_response`` から読むため、このときAPIの呼び出しは
+    ``poll`` の中でも1つずつ行う。
+    ``archive`` を指定すると、取得した全てのページを保存する
+
     Attributes
     ーーーーーー
     home_timeline_ids : TimelineIndex or None
         ホームタイムラインの ``since_id`` と ``max_id`` を保持するオブジェクト
     """
-    def __init__(self, api, storage):
+    def __init__(self, api, storage, budget=None, archive=None):
         """
         Parameters
         ----------
@@ -14,10 +30,127 @@ class Timeline:
             tweepyでユーザー認証したTwitterAPIのラッパー
         storage : TimelineIndexStorage
             ``since_id`` と ``max_id`` を保存するためのストレージ
+        budget : twissify.ratelimit.RateLimitBudget, default None
+            レート制限の予算。指定しなければ制限を考慮せずに呼び出す
+        archive : twissify.archive.TimelineArchive, default None
+            取得したページを保存するアーカイブ
         """
         self._api = api
         self._storage = storage
+        self._budget = budget
+        self._archive = archive
+        self._api_lock = threading.Lock()
+        self._endpoints = {}
+        self.register("home_timeline")
+
+    @property
+    def names(self):
+        "登録されているタイムラインの名前を格納したリスト"
+        return list(self._endpoints)
+
+    def register(self, name, method=None, **params):
+        """タイムラインを取得する関数を名前を付けて登録する
+
+        Parameters
+        ----------
+        name : str
+            ``since_id`` と ``max_id`` を保存するときに使う名前
+        method : callable, default None
+            ``count`` 、 ``since_id`` 、 ``max_id`` を受け取り
+            ``tweepy.models.ResultSet`` を返す関数。
+            指定しなければ ``api`` の ``name`` と同じ名前のメソッドを使う
+        **params
+            ``method`` を呼び出すときに毎回渡すキーワード引数
+
+        Examples
+        --------
+        >>> timeline.register("mentions_timeline")
+        >>> timeline.register("user_timeline:uec", api.user_timeline,
+        ...                   screen_name="uec")
+        """
+        self._endpoints[name] = (method, params)
+
+    def unregister(self, name):
+        """登録したタイムラインを取り除く
+
+        Raises
+        ------
+        KeyError
+            ``name`` が登録されていないとき
+        """
+        del self._endpoints[name]
+
+    def _fetch(self, name, count, since_id=None, max_id=None,
+               priority=POLL):
+        tweets = self._call(name, count, since_id, max_id, priority)
+        if self._archive is not None:
+            self._archive.write_page(name, tweets)
+        return tweets
+
+    def _call(self, name, count, since_id, max_id, priority):
+        method, params = self._endpoints[name]
+        if method is None:
+            method = getattr(self._api, name)
+        if self._budget is None:
+            return method(count=count, since_id=since_id, max_id=max_id,
+                          **params)
+
+        endpoint = name.partition(":")[0]
+        if not self._budget.acquire(endpoint, priority):
+            raise InterruptedError(
+                "Waiting for the rate limit of `{endpoint}` was interrupted."
+                .format(endpoint=endpoint))
+        # 他のスレッドの呼び出しが last_response を上書きする前にヘッダーを読む
+        with self._api_lock:
+            try:
+                tweets = method(count=count, since_id=since_id,
+                                max_id=max_id, **params)
+            except Exception as e:
+                response = getattr(e, "response", None)
+                if getattr(response, "status_code", None) == 429:
+                    self._budget.update(endpoint, response.headers)
+                    self._budget.exhaust(endpoint)
+                raise
+            response = getattr(self._api, "last_response", None)
+            headers = None if response is None else response.headers
+        if headers is not None:
+            self._budget.update(endpoint, headers)
+        return tweets
+
+    def _save(self, name, tweets):
+        if tweets != []:
+            self._storage.advance_ids(name, tweets.since_id, tweets.max_id)
+
+    @metrics.instrument("timeline_fetch", items=len)
+    def timeline(self, name, count, since_id=None, max_id=None):
+        """登録したタイムライン上のツイートを取得する
 
+        Parameters
+        ----------
+        name : str
+            登録したタイムラインの名前
+        count : int
+            取得するツイートの総数。最大は200
+        since_id : int, default None
+            タイムラインを取得し始めるツイートID
+        max_id : int, default None
+            タイムラインを取得し終えるツイートID
+
+        Returns
+        -------
+        tweets : tweepy.models.ResultSet
+            タイムライン上のツイート
+
+        Raises
+        ------
+        KeyError
+            ``name`` が登録されていないとき
+        """
+        tweets = self._fetch(name, count, since_id=since_id, max_id=max_id)
+        self._save(name, tweets)
+        return tweets
+
+    @metrics.instrument("timeline_home_timeline", items=len)
     def home_timeline(self, count, since_id=None, max_id=None):
         """ホームタイムライン上のツイートを取得する
 
@@ -41,17 +174,170 @@ class Timeline:
         ``max_id`` で指定した値以下のIDを持つツイートを取得する。
         両方指定しなければ、最新のタイムラインを取得する。
         """
-        tweets = self._api.home_timeline(count=count, since_id=since_id,
-                                         max_id=max_id)
-        timeline_name = self.home_timeline.__name__
+        return self.timeline("home_timeline", count, since_id=since_id,
+                             max_id=max_id)
 
-        if tweets != []:
+    @metrics.instrument("timeline_poll", items=len)
+    def poll(self, count=200, names=None, max_workers=None):
+        """登録したタイムラインの新しいツイートを並行して取得する
+
+        それぞれのタイムラインで保存されている ``since_id`` より新しいツイートを
+        1ページずつ取得し、ツイートIDで重複を取り除いてまとめる。
+        ``count`` 件のページを取得したときは保存されている ``since_id`` まで
+        遡れていない可能性があるため、その間を取得できていない範囲として保存する。
+        この範囲は ``iter_timeline`` を ``fill_gaps=True`` で呼び出したときに取得される
+
+        Parameters
+        ----------
+        count : int, default 200
+            それぞれのタイムラインで取得するツイートの数。最大は200
+        names : list of str, default None
+            取得するタイムラインの名前。指定しなければ登録した全てのタイムライン
+        max_workers : int, default None
+            同時に取得する最大数。指定しなければタイムラインの数
+
+        Returns
+        -------
+        list of tweepy.models.Status
+            新しい順に並んだ重複のないツイート
+        """
+        names = self.names if names is None else list(names)
+        if not names:
+            return []
+
+        since_ids = {}
+        for name in names:
+            ids = self._storage.get_ids(name)
+            since_ids[name] = None if ids is None else ids.since_id
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(names)) as e:
+            futures = [e.submit(self._fetch, name, count,
+                                since_id=since_ids[name])
+                       for name in names]
+            timelines = [future.result() for future in futures]
+
+        for name, tweets in zip(names, timelines):
+            self._save(name, tweets)
+            if since_ids[name] is not None and len(tweets) >= count:
+                self._storage.add_gap(name, since_ids[name], tweets.max_id)
+        return merge_tweets(timelines)
+
+    def iter_timeline(self, name, count=200, max_pages=None, fill_gaps=True):
+        """前回取得したツイートまで遡って登録したタイムライン上のツイートを取得する
+
+        ``max_id`` を小さくしながら、保存されている ``since_id`` に達するまで
+        ページを取得する。 ``max_pages`` に達したときや途中で例外が発生したときなど、
+        遡りきれなかった範囲は取得できていない範囲としてストレージに保存され、
+        次回以降に ``fill_gaps=True`` で呼び出したときに取得される
+
+        Parameters
+        ----------
+        name : str
+            登録したタイムラインの名前
+        count : int, default 200
+            1ページあたりに取得するツイートの数。最大は200
+        max_pages : int, default None
+            取得する最大のページ数。指定しなければ制限しない
+        fill_gaps : bool, default True
+            新しいツイートを取得した後に、取得できていない範囲を取得するかどうか
+
+        Yields
+        ------
+        tweets : tweepy.models.ResultSet
+            タイムライン上のツイートのページ。新しい順に返る
+
+        Notes
+        -----
+        ``since_id`` が保存されていないときは最新の1ページだけを取得する
+        """
+        def method(**kwargs):
+            return self._fetch(name, **kwargs)
+
+        ids = self._storage.get_ids(name)
+        since_id = None if ids is None else ids.since_id
+        walk = _Walk(max_pages)
+
+        try:
+            yield from walk.pages(method, count, since_id, None,
+                                  single=since_id is None)
+        finally:
+            if walk.first is not None:
+                self._storage.advance_ids(name, walk.first.since_id,
+                                          walk.max_id)
+                if not walk.complete:
+                    self._storage.add_gap(name, since_id, walk.max_id)
+
+        if fill_gaps:
+            yield from self._fill_gaps(name, count, walk)
+
+    def iter_home_timeline(self, count=200, max_pages=None, fill_gaps=True):
+        """前回取得したツイートまで遡ってホームタイムライン上のツイートを取得する
+
+        ``iter_timeline("home_timeline", ...)`` と同じ
+
+        Yields
+        ------
+        tweets : tweepy.models.ResultSet
+            ホームタイムライン上のツイートのページ。新しい順に返る
+        """
+        return self.iter_timeline("home_timeline", count=count,
+                                  max_pages=max_pages, fill_gaps=fill_gaps)
+
+    @metrics.instrument("timeline_backfill", items=len)
+    def backfill(self, count=200, names=None, max_pages=1):
+        """登録したタイムラインの取得できていない範囲のツイートを取得する
+
+        ``poll`` や ``iter_timeline`` が保存した範囲を新しいものから順に取得する。
+        ``budget`` を指定したときは ``GAP`` の優先度で呼び出す
+
+        Parameters
+        ----------
+        count : int, default 200
+            1ページあたりに取得するツイートの数。最大は200
+        names : list of str, default None
+            取得するタイムラインの名前。指定しなければ登録した全てのタイムライン
+        max_pages : int, default 1
+            それぞれのタイムラインで取得する最大のページ数。
+            ``None`` のときは制限しない
+
+        Returns
+        -------
+        list of tweepy.models.Status
+            新しい順に並んだ重複のないツイート
+        """
+        names = self.names if names is None else list(names)
+        pages = []
+        for name in names:
+            pages.extend(self._fill_gaps(name, count, _Walk(max_pages)))
+        return merge_tweets(pages)
+
+    def _fill_gaps(self, name, count, walk):
+        def method(**kwargs):
+            return self._fetch(name, priority=GAP, **kwargs)
+
+        gaps = [(gap.id, gap.since_id, gap.max_id)
+                for gap in self._storage.get_gaps(name)]
+        for gap_id, since_id, max_id in gaps:
+            if walk.exhausted:
+                return
+            walk.reset()
             try:
-                self._storage.create_ids(timeline_name, tweets)
-            except ValueError:
-                self._storage.update_ids(timeline_name, tweets)
+                yield from walk.pages(method, count, since_id, max_id)
+            finally:
+                if walk.complete:
+                    self._storage.delete_gap(gap_id)
+                elif walk.first is not None:
+                    self._storage.update_gap(gap_id, walk.max_id)
 
-        return tweets
+    def timeline_ids(self, name):
+        """登録したタイムラインの前回の ``since_id`` と ``max_id`` を保持するオブジェクトを取得する
+
+        Returns
+        -------
+        TimelineIndex or None
+            ``since_id`` と ``max_id`` を保持するオブジェクト。存在しなければ ``None``
+        """
+        return self._storage.get_ids(name)
 
     @property
     def home_timeline_ids(self):
@@ -62,4 +348,41 @@ class Timeline:
         TimelineIndex or None
             ``since_id`` と ``max_id`` を保持するオブジェクト。存在しなければ ``None``
         """
-        return self._storage.get_ids("home_timeline")
+        return self.timeline_ids("home_timeline")
+
+
+class _Walk:
+    "``max_id`` を小さくしながらタイムラインを遡るときの状態を保持するクラス"
+    def __init__(self, max_pages=None):
+        self.remaining = max_pages
+        self.reset()
+
+    def reset(self):
+        self.first = None
+        self.max_id = None
+        self.complete = False
+
+    @property
+    def exhausted(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    def pages(self, method, count, since_id, max_id, single=False):
+        self.max_id = max_id
+        while not self.exhausted:
+            tweets = method(count=count, since_id=since_id,
+                            max_id=self.max_id)
+            if self.remaining is not None:
+                self.remaining -= 1
+            if tweets == []:
+                self.complete = True
+                return
+
+            if self.first is None:
+                self.first = tweets
+            self.max_id = tweets.max_id
+            yield tweets
+            if single or (since_id is not None
+                          and self.max_id is not None
+                          and self.max_id <= since_id):
+                self.complete = True
+                return